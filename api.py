@@ -0,0 +1,87 @@
+# Supporto per l'API JSON (/api/v1): campi richiesti (sparse fieldset), serializzazione e risposte
+#
+# Il client sceglie i campi di ogni risorsa con ?fields[articles]=id,title,author&fields[users]=username:
+# vengono serializzati solo quelli e, dove possibile, nemmeno letti dal database (es. il contenuto
+# degli articoli). La codifica usa orjson se installato (molto più veloce su liste lunghe),
+# altrimenti il modulo json con separatori compatti.
+import json
+from datetime import date, datetime
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError: # orjson non installato: si usa json della libreria standard
+    orjson = None
+
+
+class ApiError(Exception):
+    """Errore da restituire al client come {"error": messaggio} con il codice HTTP indicato."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Tipo non serializzabile: {type(value).__name__}')
+
+
+def dumps(payload):
+    """Codifica in JSON (bytes UTF-8)."""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default)
+    return json.dumps(payload, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def json_response(payload, status=200, headers=None):
+    return Response(dumps(payload), status=status, headers=headers, mimetype='application/json')
+
+
+def requested_fields(args, resource, allowed, default):
+    """
+    I campi richiesti per una risorsa (parametro fields[<risorsa>]) oppure quelli predefiniti.
+    Solleva ApiError se un campo non esiste.
+    """
+    value = args.get(f'fields[{resource}]')
+    if value is None:
+        return tuple(default)
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise ApiError(f"Campi sconosciuti per {resource}: {', '.join(unknown)}")
+    return fields
+
+
+def serialize(obj, fields, getters):
+    """Dizionario con i soli campi richiesti; getters: nome -> funzione che riceve l'oggetto."""
+    return {name: getters[name](obj) for name in fields}
+
+
+def page_size(args, default, maximum):
+    """Il parametro ?limit= limitato a [1, maximum]."""
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        raise ApiError('Il parametro limit deve essere un numero intero.')
+    return max(1, min(limit, maximum))
+
+
+def parse_ids(values, maximum):
+    """Lista di id interi (senza duplicati, nell'ordine dato) da '1,2,3' o da una lista JSON."""
+    if isinstance(values, str):
+        values = [value for value in values.split(',') if value.strip()]
+    if not isinstance(values, list):
+        raise ApiError('Gli id vanno indicati come lista.')
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise ApiError('Gli id devono essere numeri interi.')
+    if not ids:
+        raise ApiError('Indica almeno un id.')
+    if len(ids) > maximum:
+        raise ApiError(f'Al massimo {maximum} id per richiesta.')
+    return ids
@@ -1,67 +1,164 @@
 # Importazioni necessarie
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import (Blueprint, Flask, abort, current_app, render_template, request, redirect, url_for, flash, jsonify, g,
+                   has_request_context, make_response, Response, session)
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.local import LocalProxy
+from sqlalchemy.schema import CreateIndex
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 import os
-import uuid
+import json
+import secrets
+import threading
 import functools # Per i decoratori di ruolo
+import contextlib
+from collections import Counter
 from datetime import datetime # Per i timestamp dei like e commenti
 
-# Nuove importazioni per il Chatbot AI
-from dotenv import load_dotenv
-import google.generativeai as genai
-
-# Carica le variabili d'ambiente dal file .env
-load_dotenv()
+# Configurazione predefinita (le variabili d'ambiente vengono caricate dal file .env)
+from config import Config
+# Chatbot AI: l'SDK di Gemini viene importato solo al primo utilizzo (vedi get_chat_assistant)
+from chat_service import (ChatService, ChatAssistant, ConversationStore, ResponseCache, FakeChatModel,
+                          create_gemini_model, ChatbotError, ChatbotBusyError, ChatbotTimeoutError)
+
+# Ricerca full-text (SQLite FTS5)
+import search
+# Importazione/esportazione massiva in JSONL o CSV
+import bulk
+# Contatore delle visualizzazioni con buffer in memoria
+from view_counter import ViewCounter
+# Scritture di like e commenti di più richieste raggruppate in un'unica transazione (opzionale)
+from write_batcher import WriteBatcher
+# Paginazione a cursore
+from pagination import CountCache, id_paginate, keyset_paginate
+# Cache delle pagine renderizzate
+from page_cache import PageCache
+# Pipeline per le immagini caricate (validazione e varianti ridimensionate)
+import images
+# Archivio dei file caricati: nomi dal contenuto, sottocartelle, conteggio dei riferimenti
+from storage import (LocalBackend, LocalS3Client, S3Backend, UploadStore, UploadTooLargeError, create_s3_client,
+                     is_content_name)
+# Profilo del database (pragma SQLite, pool, nuovi tentativi quando il database è occupato)
+import database
+# Strumentazione opzionale (tempi, query SQL, template, chatbot)
+from metrics import Metrics
+# Hash delle password su un pool limitato e limite ai tentativi di accesso falliti
+from passwords import LoginThrottle, PasswordHasher, PasswordHasherBusyError
+# Richieste condizionali (304), cache delle immagini caricate e compressione dell'HTML
+from http_cache import HttpCache
+# API JSON versionata: campi richiesti, codifica veloce, errori
+import api
+# Coda persistente dei lavori in background (file, varianti, indice di ricerca, visualizzazioni)
+from jobs import JobQueue, TaskRegistry
+# Classifiche: di tendenza (punteggi precalcolati), più visti, più apprezzati
+from ranking import Ranking, rank_table, utc_now
+import click
+
+# --- Estensioni ---
+# Vengono create qui senza app e collegate da create_app(): importare questo modulo
+# non apre il database, non crea cartelle e non contatta servizi esterni.
+db = SQLAlchemy()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login' # La rotta a cui reindirizzare se l'utente non è loggato
+page_cache = PageCache()
+http_cache = HttpCache()
+# Lavori in background, registrati all'import: la coda di ogni app usa questo registro
+job_tasks = TaskRegistry()
 
-# --- Configurazione dell'App Flask ---
-app = Flask(__name__)
-# La chiave segreta viene caricata dal file .env per sicurezza
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'una_chiave_segreta_default_molto_forte_e_complessa_E_UNICA')
-# Configura il database SQLite
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+def _app_service(name):
+    """
+    I servizi con uno stato (database, thread, configurazione) vengono creati da create_app() per
+    ogni app e salvati in app.extensions: questi nomi indicano quelli dell'app corrente, così una
+    seconda create_app() nello stesso processo (test, benchmark) non tocca i servizi della prima.
+    """
+    return LocalProxy(lambda: current_app.extensions[name])
+
+view_counter = _app_service('view_counter')
+# Cache dei totali: evita un COUNT(*) a ogni pagina; viene svuotata quando si crea o elimina un articolo
+count_cache = _app_service('count_cache')
+metrics = _app_service('metrics')
+password_hasher = _app_service('password_hasher')
+login_throttle = _app_service('login_throttle')
+job_queue = _app_service('job_queue')
+ranking = _app_service('ranking')
+upload_store = _app_service('upload_store')
+write_batcher = _app_service('write_batcher')
+
+# Tutte le rotte e i comandi CLI del blog (cli_group=None: i comandi restano 'flask <comando>')
+bp = Blueprint('main', __name__, cli_group=None)
+# API JSON per il client mobile e le integrazioni (il numero di versione è nell'URL)
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
 
-# Configurazione per gli upload di file
-UPLOAD_FOLDER = os.path.join(app.root_path, 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-
-# Assicurati che la cartella degli upload esista
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-
-# Inizializza il database
-db = SQLAlchemy(app)
-
-# --- Configurazione Flask-Login ---
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login' # La rotta a cui reindirizzare se l'utente non è loggato
 
 @login_manager.user_loader
 def load_user(user_id):
     """Ricarica l'oggetto utente dalla sessione."""
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
 
 # --- Configurazione Google Gemini AI ---
-# La chiave API viene caricata da .env
-GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GEMINI_API_KEY:
-    print("ERRORE: La chiave API di Google Gemini non è stata trovata. Assicurati che GOOGLE_API_KEY sia impostata nel tuo file .env")
-    # In un'applicazione di produzione, potresti voler sollevare un'eccezione o gestire l'errore in altro modo.
-    # Per ora, terminiamo l'applicazione per evidenziare il problema.
-    exit(1)
-genai.configure(api_key=GEMINI_API_KEY)
-# Utilizziamo un modello più recente e stabile per il chatbot
-# Controlla l'output di `check_models.py` per i nomi esatti disponibili
-try:
-    model = genai.GenerativeModel('gemini-1.5-flash') # Modello consigliato per la maggior parte dei casi
-except Exception as e:
-    print(f"Errore durante l'inizializzazione del modello Gemini. Prova con 'gemini-1.5-pro' o un altro modello disponibile. Errore: {e}")
-    model = None # Se il modello non si carica, le funzionalità del chatbot saranno disabilitate
+_chat_assistant_lock = threading.Lock()
+
+def create_chat_assistant(chat_model, config=None):
+    """
+    Crea l'assistente del chatbot: il servizio limita le chiamate concorrenti al modello e
+    applica i timeout, la cache e la memoria delle conversazioni evitano chiamate ripetute.
+    Nei test si può sostituire con: current_app.extensions['chat_assistant'] = create_chat_assistant(FakeChatModel(...), current_app.config)
+    """
+    config = config or current_app.config
+    service = ChatService(
+        chat_model,
+        max_concurrent=config['CHATBOT_MAX_CONCURRENT'],
+        queue_timeout=config['CHATBOT_QUEUE_TIMEOUT'],
+        timeout=config['CHATBOT_TIMEOUT'],
+        observer=metrics.observe_chatbot if metrics.enabled else None
+    )
+    cache = ResponseCache(ttl=config['CHATBOT_CACHE_TTL'], max_entries=config['CHATBOT_CACHE_MAX_ENTRIES'])
+    conversations = ConversationStore(
+        max_turns=config['CHATBOT_HISTORY_MAX_TURNS'],
+        max_tokens=config['CHATBOT_HISTORY_MAX_TOKENS'],
+        max_conversations=config['CHATBOT_MAX_CONVERSATIONS'],
+        ttl=config['CHATBOT_CONVERSATION_TTL']
+    )
+    return ChatAssistant(service, cache=cache, conversations=conversations)
+
+def load_chat_model(config):
+    """Crea il modello del chatbot scelto in configurazione, oppure None se non è disponibile."""
+    if config['CHATBOT_BACKEND'] == 'fake':
+        return FakeChatModel()
+    if not config['GOOGLE_API_KEY']:
+        current_app.logger.error("La chiave API di Google Gemini non è stata trovata. Assicurati che GOOGLE_API_KEY sia impostata nel tuo file .env")
+        return None
+    # Utilizziamo un modello più recente e stabile per il chatbot
+    # Controlla l'output di `check_models.py` per i nomi esatti disponibili
+    try:
+        return create_gemini_model(config['GOOGLE_API_KEY'], config['CHATBOT_MODEL_NAME'])
+    except Exception as e:
+        current_app.logger.error(f"Errore durante l'inizializzazione del modello Gemini. Prova con 'gemini-1.5-pro' o un altro modello disponibile. Errore: {e}")
+        return None # Se il modello non si carica, le funzionalità del chatbot saranno disabilitate
+
+def get_chat_assistant():
+    """
+    Restituisce l'assistente del chatbot, creandolo al primo utilizzo,
+    oppure None se il modello non è disponibile.
+    """
+    extensions = current_app.extensions
+    if 'chat_assistant' not in extensions:
+        with _chat_assistant_lock:
+            if 'chat_assistant' not in extensions:
+                chat_model = load_chat_model(current_app.config)
+                extensions['chat_assistant'] = create_chat_assistant(chat_model) if chat_model else None
+    return extensions['chat_assistant']
+
+def chat_conversation_id():
+    """
+    Identificativo della conversazione: l'id utente se autenticato, altrimenti un id casuale
+    salvato nella sessione (il cookie contiene solo l'id, la cronologia resta sul server).
+    """
+    if current_user.is_authenticated:
+        return f'user:{current_user.id}'
+    if 'chat_id' not in session:
+        session['chat_id'] = secrets.token_hex(16)
+    return f"anon:{session['chat_id']}"
 
 
 # --- Funzioni di Utility per l'Upload ---
@@ -70,6 +167,79 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def load_storage_backend(config):
+    """Crea l'archivio dei file caricati scelto in configurazione (STORAGE_BACKEND)."""
+    if config['STORAGE_BACKEND'] == 'local':
+        return LocalBackend(config['UPLOAD_FOLDER'])
+    if config['STORAGE_BACKEND'] == 'fake-s3':
+        client = LocalS3Client(config['STORAGE_FAKE_S3_PATH'])
+    else:
+        client = create_s3_client(config['STORAGE_S3_ENDPOINT_URL'], config['STORAGE_S3_REGION'])
+    return S3Backend(
+        client, config['STORAGE_S3_BUCKET'], prefix=config['STORAGE_S3_PREFIX'], public_url=config['STORAGE_PUBLIC_URL'],
+        cache_control=f"public, max-age={config['UPLOAD_CACHE_MAX_AGE']}, immutable"
+    )
+
+def variant_widths():
+    """Larghezze delle varianti da generare: nessuna se Pillow manca o se l'archivio non è locale."""
+    if images.Image is None or not upload_store.backend.local:
+        return ()
+    return current_app.config['IMAGE_VARIANT_WIDTHS']
+
+def image_variant_files(filename):
+    """Varianti da eliminare insieme a un'immagine (solo nell'archivio locale: altrove non vengono generate)."""
+    if not upload_store.backend.local:
+        return []
+    return images.variant_names(filename, current_app.config['IMAGE_VARIANT_WIDTHS'])
+
+def save_image(file_storage):
+    """
+    Valida il contenuto dell'immagine e la salva nell'archivio con un riferimento nella sessione:
+    il commit è a carico della vista, che poi chiama image_saved().
+    Solleva images.InvalidImageError se il file non è un'immagine valida
+    e UploadTooLargeError se supera UPLOAD_MAX_SIZE.
+    """
+    image_format = images.detect_format(file_storage.stream)
+    filename, _ = upload_store.save(db.session, file_storage.stream, images.IMAGE_FORMATS[image_format])
+    return filename
+
+def image_saved(filename):
+    """Accoda la generazione delle varianti di un'immagine salvata (da chiamare dopo il commit)."""
+    if variant_widths():
+        job_queue.enqueue('generate_variants', filename=filename)
+
+def release_image(*filenames):
+    """Toglie i riferimenti alle immagini non più usate da un record (da chiamare prima del commit)."""
+    upload_store.release(db.session, *filenames)
+
+def remove_image(*filenames):
+    """Accoda l'eliminazione delle immagini rimaste senza riferimenti e delle loro varianti (dopo il commit)."""
+    filenames = [filename for filename in filenames if filename]
+    if filenames:
+        job_queue.enqueue('remove_upload', filenames=filenames)
+
+def upload_url(filename):
+    """Indirizzo di un file caricato: /static/uploads/... oppure l'indirizzo pubblico del bucket."""
+    if not filename:
+        return None
+    return upload_store.backend.url(filename) or url_for('static', filename='uploads/' + filename)
+
+@bp.app_context_processor
+def inject_image_helpers():
+    """Rende disponibili nei template l'indirizzo delle immagini e l'elenco delle varianti (per srcset)."""
+    def image_variants(filename):
+        widths = variant_widths()
+        if not widths:
+            return []
+        return [
+            (width, url_for('static', filename='uploads/' + name),
+             url_for('static', filename='uploads/' + webp_name) if webp_name else None)
+            for width, name, webp_name in images.existing_variants(
+                current_app.config['UPLOAD_FOLDER'], filename, widths, webp=current_app.config['IMAGE_WEBP']
+            )
+        ]
+    return {'image_variants': image_variants, 'upload_url': upload_url}
+
 # --- Decoratore per i Ruoli Utente ---
 def role_required(role='admin'):
     """
@@ -81,10 +251,10 @@ def role_required(role='admin'):
         def decorated_function(*args, **kwargs):
             if not current_user.is_authenticated:
                 flash('Devi effettuare l\'accesso per accedere a questa pagina.', 'warning')
-                return redirect(url_for('login', next=request.url))
+                return redirect(url_for('main.login', next=request.url))
             if role == 'admin' and not current_user.is_admin:
                 flash('Non hai i permessi necessari per accedere a questa pagina.', 'danger')
-                return redirect(url_for('index'))
+                return redirect(url_for('main.index'))
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -101,6 +271,20 @@ class Article(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # L'autore dell'articolo
     image_filename = db.Column(db.String(100), nullable=True) # Nome del file immagine associato all'articolo
     views = db.Column(db.Integer, default=0) # Conteggio delle visualizzazioni dell'articolo
+    # Contatori denormalizzati, aggiornati da toggle_like(), add_comment() e delete_comment()
+    # (ricalcolabili con 'flask reconcile-counters')
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Data dell'ultima modifica (None se mai modificato), usata per ETag e Last-Modified
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+    # Indici composti per la paginazione a cursore su (pub_date, id) e per le classifiche
+    __table_args__ = (
+        db.Index('ix_article_pub_date_id', 'pub_date', 'id'),
+        db.Index('ix_article_user_pub_date_id', 'user_id', 'pub_date', 'id'),
+        db.Index('ix_article_views_id', 'views', 'id'),
+        db.Index('ix_article_like_count_id', 'like_count', 'id'),
+    )
 
     # 'author' qui è il nome della proprietà sul modello Article.
     # È creato dal backref='author' nella relazione 'articles' in User.
@@ -119,6 +303,14 @@ class User(db.Model, UserMixin):
     profile_picture = db.Column(db.String(100), nullable=True) # Nome del file immagine profilo
     # Campo per i ruoli utente (True se admin, False altrimenti)
     is_admin = db.Column(db.Boolean, default=False)
+    # Data dell'ultima modifica del profilo: nome e foto compaiono in tutte le pagine (vedi profiles_version)
+    updated_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    # Ricerca per prefisso senza distinzione tra maiuscole e minuscole nella gestione utenti
+    __table_args__ = (
+        db.Index('ix_user_username_lower', db.func.lower(username)),
+        db.Index('ix_user_email_lower', db.func.lower(email)),
+    )
 
     # Relazione 1:molti Articoli per un Utente
     # user.articles -> lista di articoli scritti dall'utente
@@ -137,12 +329,19 @@ class User(db.Model, UserMixin):
 
 
     def set_password(self, password):
-        """Genera l'hash della password."""
-        self.password_hash = generate_password_hash(password)
+        """Genera l'hash della password (sul pool di password_hasher)."""
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        """Verifica la password fornita con l'hash memorizzato."""
-        return check_password_hash(self.password_hash, password)
+        """
+        Verifica la password fornita con l'hash memorizzato. Se l'hash usa un metodo o un
+        costo diverso da quello configurato viene ricalcolato (il chiamante fa il commit).
+        """
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -155,6 +354,12 @@ class Comment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     article_id = db.Column(db.Integer, db.ForeignKey('article.id'), nullable=False)
 
+    # Indici per contare e paginare i commenti di un articolo e per trovare quelli di un utente
+    __table_args__ = (
+        db.Index('ix_comment_article_pub_date_id', 'article_id', 'pub_date', 'id'),
+        db.Index('ix_comment_user_id', 'user_id'),
+    )
+
     # Relazione: un commento appartiene a un articolo
     # E dall'articolo, puoi accedere ai suoi commenti tramite article.comments
     article = db.relationship('Article', backref=db.backref('comments', lazy=True))
@@ -173,6 +378,10 @@ class Like(db.Model):
     article_id = db.Column(db.Integer, db.ForeignKey('article.id'), primary_key=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=db.func.now())
 
+    # La chiave primaria (user_id, article_id) serve per "l'utente ha messo like?",
+    # questo indice per contare i like di un articolo
+    __table_args__ = (db.Index('ix_like_article_id', 'article_id'),)
+
     # Relazione: un like appartiene a un articolo
     # E dall'articolo, puoi accedere ai suoi like tramite article.likes
     article = db.relationship('Article', backref=db.backref('likes', lazy=True))
@@ -185,48 +394,573 @@ class Like(db.Model):
         return f'<Like User:{self.liking_user.username} Article:{self.article.title}>'
 
 
+# --- Query con Caricamento Anticipato ---
+# Tutte le viste usano queste funzioni invece di accedere alle relazioni "lazy" dai template,
+# che genererebbero una SELECT per ogni articolo o commento (problema N+1).
+
+def article_list_query():
+    """Articoli con l'autore caricato nella stessa query (JOIN)."""
+    return Article.query.options(db.joinedload(Article.author))
+
+def get_article_or_404(article_id):
+    """Un singolo articolo con il suo autore."""
+    return article_list_query().filter(Article.id == article_id).first_or_404()
+
+def user_articles_query(user):
+    """Articoli di un utente (l'ordinamento lo applica la paginazione)."""
+    return article_list_query().filter(Article.user_id == user.id)
+
+def article_comments_query(article_id):
+    """Commenti di un articolo con i rispettivi autori (l'ordinamento lo applica la paginazione)."""
+    return Comment.query.options(db.joinedload(Comment.comment_author)) \
+        .filter(Comment.article_id == article_id)
+
+
+# --- Paginazione ---
+def cached_total(key, query):
+    """Totale dei risultati di una query, calcolato al massimo una volta per TTL."""
+    return count_cache.get_or_compute(key, lambda: query.order_by(None).count())
+
+
+# --- Validatori per le Richieste Condizionali (vedi http_cache.py) ---
+def profiles_version():
+    """Ultima modifica di un profilo: nomi e foto degli utenti compaiono in tutte le pagine."""
+    return db.session.query(db.func.max(User.updated_at)).scalar()
+
+def listing_validation(query, extra=()):
+    """
+    Validatore di una pagina di articoli: la stessa paginazione della vista, ma leggendo solo
+    id, date e contatori (niente testo, niente autore, niente template).
+    """
+    columns = db.load_only(Article.id, Article.pub_date, Article.updated_at, Article.views,
+                           Article.like_count, Article.comment_count)
+    page = keyset_paginate(
+        query.options(columns), Article.pub_date, Article.id, current_app.config['ARTICLES_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    profiles = profiles_version()
+    parts = tuple((a.id, a.updated_at, a.views, a.like_count, a.comment_count) for a in page.items)
+    # Nessuna data: like, commenti, visualizzazioni ed eliminazioni non la aggiornano (solo ETag)
+    return parts + (page.next_cursor, page.prev_cursor, profiles) + tuple(extra), None
+
+def index_validation():
+    if request.args.get('q'):
+        return None # I risultati della ricerca non vengono validati
+    total = cached_total(('articles',), Article.query) if current_app.config['PAGINATION_EXACT_TOTALS'] else None
+    return listing_validation(Article.query, extra=(total,))
+
+def user_profile_validation(username):
+    user = db.session.query(User.id, User.updated_at).filter_by(username=username).first()
+    if user is None:
+        return None
+    total = None
+    if current_app.config['PAGINATION_EXACT_TOTALS']:
+        total = cached_total(('user', user.id), Article.query.filter(Article.user_id == user.id))
+    return listing_validation(Article.query.filter(Article.user_id == user.id), extra=(user.updated_at, total))
+
+def article_validation(article_id):
+    """
+    Date e contatori dell'articolo. Le visualizzazioni sono quelle già scritte sul database:
+    quelle ancora in memoria (view_counter) si vedono al flush successivo.
+    """
+    article = db.session.query(
+        Article.pub_date, Article.updated_at, Article.views, Article.like_count, Article.comment_count
+    ).filter_by(id=article_id).first()
+    if article is None:
+        return None
+    # Come listing_validation: i contatori cambiano senza toccare le date, quindi solo ETag
+    return tuple(article) + (profiles_version(),), None
+
+
+# --- Contatore delle Query per Richiesta ---
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Listener SQLAlchemy: conta le query eseguite durante la richiesta corrente."""
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+@bp.after_app_request
+def add_query_count_header(response):
+    """In modalità debug aggiunge alla risposta il numero di query SQL eseguite."""
+    if current_app.debug or current_app.config['SQL_QUERY_COUNTER']:
+        query_count = g.get('query_count', 0)
+        response.headers['X-Query-Count'] = str(query_count)
+        current_app.logger.debug('%s %s: %d query SQL', request.method, request.path, query_count)
+    return response
+
+
+# --- Scritture Brevi ---
+def commit_with_retry(work):
+    """
+    Esegue work() e fa commit, riprovando se il database è occupato da un'altra scrittura.
+    work() viene rieseguita da capo a ogni tentativo: deve solo preparare le modifiche nella sessione.
+    """
+    return database.run_in_transaction(
+        db.session, work,
+        retries=current_app.config['DB_WRITE_RETRIES'], delay=current_app.config['DB_WRITE_RETRY_DELAY']
+    )
+
+
+# --- Scritture di like e commenti ---
+# Le viste descrivono la scrittura come operazione: ('like', id_utente, id_articolo, 'like'|'unlike'|'toggle')
+# oppure ('comment', id_utente, id_articolo, testo). apply_writes() ne esegue una o un gruppo intero.
+def apply_writes(operations):
+    """
+    Prepara nella sessione (senza commit) le operazioni e restituisce i risultati nello stesso ordine:
+    (messo, cambiato) per un like, None per un commento. Ogni like è un'unica istruzione idempotente
+    (INSERT che ignora il duplicato o DELETE); contatori e punteggi di tendenza di tutti gli articoli
+    toccati vengono aggiornati alla fine, con un UPDATE a blocchi.
+    """
+    now = datetime.now() # Ora locale, come i like già salvati
+    no_sync = {'synchronize_session': False}
+    like_deltas, comment_deltas, scores = Counter(), Counter(), Counter()
+    comments, results = [], []
+    for kind, user_id, article_id, value in operations:
+        if kind == 'comment':
+            comments.append({'text': value, 'user_id': user_id, 'article_id': article_id})
+            comment_deltas[article_id] += 1
+            scores[article_id] += ranking.comment_score()
+            results.append(None)
+            continue
+        if value == 'toggle':
+            exists = db.session.execute(
+                db.select(Like.user_id).where(Like.user_id == user_id, Like.article_id == article_id)
+            ).first() is not None
+            value = 'unlike' if exists else 'like'
+        if value == 'like':
+            changed = db.session.execute(
+                database.insert_or_ignore(Like.__table__, db.engine.dialect.name)
+                .values(user_id=user_id, article_id=article_id, timestamp=now)
+            ).rowcount == 1
+            if changed:
+                like_deltas[article_id] += 1
+                scores[article_id] += ranking.like_score()
+        else:
+            # Con RETURNING il DELETE restituisce anche la data del like (per togliere il peso giusto)
+            statement = db.delete(Like).where(Like.user_id == user_id, Like.article_id == article_id)
+            if db.engine.dialect.delete_returning:
+                removed = db.session.execute(statement.returning(Like.timestamp), execution_options=no_sync).scalar()
+            else:
+                removed = db.session.execute(
+                    db.select(Like.timestamp).where(Like.user_id == user_id, Like.article_id == article_id)
+                ).scalar()
+                if removed is not None:
+                    db.session.execute(statement, execution_options=no_sync)
+            changed = removed is not None
+            if changed:
+                like_deltas[article_id] -= 1
+                scores[article_id] -= ranking.like_score((now - removed).total_seconds())
+        results.append((value == 'like', changed))
+
+    if comments:
+        db.session.execute(db.insert(Comment), comments)
+    touched = set(like_deltas) | set(comment_deltas)
+    if touched:
+        db.session.execute(
+            db.text("UPDATE article SET like_count = like_count + :likes, comment_count = comment_count + :comments "
+                    "WHERE id = :id"),
+            [{'id': article_id, 'likes': like_deltas[article_id], 'comments': comment_deltas[article_id]}
+             for article_id in touched]
+        )
+    ranking.add_many(db.session, {article_id: score for article_id, score in scores.items() if score})
+    return results
+
+def commit_writes(operations):
+    """Esegue le operazioni in un'unica transazione, riprovando se il database è occupato."""
+    return commit_with_retry(lambda: apply_writes(operations))
+
+def submit_write(operation):
+    """Esegue una scrittura di like o commento e ne restituisce il risultato (vedi apply_writes)."""
+    if not write_batcher.enabled:
+        return commit_writes([operation])[0]
+    # La transazione di lettura della richiesta si chiude prima di attendere: con SQLite senza WAL
+    # impedirebbe il commit del thread che scrive
+    db.session.close()
+    return write_batcher.submit(operation)
+
+
+# --- Lavori in Background ---
+# Eseguiti da job_queue fuori dalla richiesta (vedi jobs.py), ciascuno in un app context.
+# Vanno accodati dopo il commit: un lavoro può partire prima che la vista abbia finito.
+@job_tasks.task('remove_upload')
+def remove_upload_job(filenames):
+    # Solo i file rimasti senza riferimenti: la stessa immagine può essere usata da altri record
+    upload_store.collect(filenames, derived=image_variant_files)
+
+@job_tasks.task('generate_variants')
+def generate_variants_job(filename):
+    if not variant_widths() or not upload_store.backend.exists(filename):
+        return # Immagine già sostituita o eliminata
+    images.generate_variants(
+        current_app.config['UPLOAD_FOLDER'], filename, variant_widths(),
+        webp=current_app.config['IMAGE_WEBP'], quality=current_app.config['IMAGE_QUALITY'], raise_errors=True
+    )
+
+@job_tasks.task('index_article')
+def index_article_job(article_id):
+    article = db.session.get(Article, article_id)
+    if article is None: # Eliminato nel frattempo
+        search.remove_article(db.session, article_id)
+    else:
+        search.index_article(db.session, article)
+    db.session.commit()
+    # Una ricerca eseguita prima dell'indicizzazione potrebbe essere rimasta in cache
+    count_cache.clear()
+    page_cache.invalidate('articles')
+
+@job_tasks.task('remove_article_from_index')
+def remove_article_from_index_job(article_id):
+    search.remove_article(db.session, article_id)
+    db.session.commit()
+
+@job_tasks.task('flush_views')
+def flush_views_job(counts):
+    """Visualizzazioni che il contatore non è riuscito a scrivere: coppie [id_articolo, incremento]."""
+    view_counter.write({article_id: amount for article_id, amount in counts})
+
+@job_tasks.task('refresh_rankings')
+def refresh_rankings_job():
+    """Lavoro periodico: fa decadere i punteggi di tendenza e programma l'esecuzione successiva."""
+    job_queue.schedule('refresh_rankings', delay=ranking.refresh_interval)
+    ranking.apply_decay()
+    ranking.clear_cache()
+
+def save_views_as_job(queue, batch):
+    """Fallback di view_counter (nel suo thread, senza app context): il blocco non scritto viene salvato nella coda e riprovato."""
+    queue.enqueue('flush_views', counts=sorted(batch.items()))
+
+
 # --- Creazione/Aggiornamento del Database ---
+def add_missing_columns():
+    """
+    Aggiunge a un database già esistente le colonne dichiarate nei modelli che mancano
+    (solo colonne che ammettono NULL o hanno un valore predefinito lato server).
+    """
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            definition = f'{column.name} {column_type}'
+            if column.server_default is not None:
+                definition += f" NOT NULL DEFAULT {column.server_default.arg}"
+            db.session.execute(db.text(f'ALTER TABLE "{table.name}" ADD COLUMN {definition}'))
+    db.session.commit()
+
+def create_missing_indexes():
+    """Crea gli indici dichiarati nei modelli che mancano in un database già esistente."""
+    # IF NOT EXISTS invece di checkfirst: la riflessione di SQLite non vede gli indici su espressioni
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+def init_db():
+    """Crea tabelle, indici e indice di ricerca mancanti (le tabelle esistenti non vengono modificate)."""
+    db.create_all()
+    add_missing_columns()
+    create_missing_indexes()
+    search.create_search_index(db.session)
+    job_queue.create_table()
+    ranking.create_tables()
+    upload_store.create_table()
+    job_queue.schedule('refresh_rankings', delay=ranking.refresh_interval)
+
+
+# --- Comandi CLI ---
 # IMPORTANTE: Se hai già un database 'site.db' esistente e hai aggiunto/modificato campi,
 # dovrai eliminarlo e ricrearlo (solo la prima volta dopo le modifiche ai modelli).
-with app.app_context():
-    db.create_all()
+@bp.cli.command('init-db')
+def init_db_command():
+    """Crea il database (o le parti mancanti). Va eseguito all'installazione e dopo gli aggiornamenti."""
+    init_db()
     print("Database creato o già esistente.")
 
+@bp.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Ricostruisce l'indice di ricerca full-text per un database 'site.db' esistente."""
+    indexed = search.rebuild_search_index(db.session)
+    print(f"Indice di ricerca ricostruito: {indexed} articoli indicizzati.")
+
+@bp.cli.command('rebuild-rankings')
+def rebuild_rankings_command():
+    """Ricalcola da capo i punteggi di tendenza dai like, dai commenti e dalle visualizzazioni."""
+    print(f"Classifica ricalcolata: {ranking.rebuild(db.session)} articoli con un punteggio.")
+
+@bp.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """
+    Ricalcola like_count e comment_count di tutti gli articoli dalle tabelle dei like e dei commenti.
+    Su un 'site.db' creato prima dei contatori aggiunge anche le colonne e gli indici mancanti.
+    """
+    print(f"Contatori ricalcolati per {reconcile_counters()} articoli.")
+
+def reconcile_counters():
+    """Ricalcola i contatori denormalizzati; restituisce il numero di articoli aggiornati."""
+    add_missing_columns()
+    create_missing_indexes()
+
+    # Un solo UPDATE con sottoquery correlate, senza caricare le righe in Python
+    like_counts = db.select(db.func.count()).where(Like.article_id == Article.id).scalar_subquery()
+    comment_counts = db.select(db.func.count()).where(Comment.article_id == Article.id).scalar_subquery()
+    result = db.session.execute(db.update(Article).values(like_count=like_counts, comment_count=comment_counts))
+    db.session.commit()
+    return result.rowcount
+
+@bp.cli.command('generate-image-variants')
+def generate_image_variants_command():
+    """Genera le varianti mancanti per tutte le immagini già presenti in static/uploads."""
+    widths = variant_widths()
+    if not widths:
+        print("Varianti disattivate: serve Pillow e l'archivio locale (STORAGE_BACKEND=local).")
+        return
+    processed = created = 0
+    for filename in upload_store.backend.names():
+        if '.' not in filename or not allowed_file(filename) or images.is_variant(filename, widths):
+            continue
+        created += images.generate_variants(
+            current_app.config['UPLOAD_FOLDER'], filename, widths, webp=current_app.config['IMAGE_WEBP'], quality=current_app.config['IMAGE_QUALITY']
+        )
+        processed += 1
+    print(f"Immagini elaborate: {processed}, varianti create: {created}.")
+
+# Tabelle esportate e importate, nell'ordine in cui vanno importate (prima chi è referenziato)
+def bulk_tables():
+    return {model.__table__.name: model.__table__ for model in (User, Article, Comment, Like)}
+
+@bp.cli.command('export-data')
+@click.argument('directory', type=click.Path(file_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default='jsonl', show_default=True)
+@click.option('--table', 'only', multiple=True, help='Esporta solo queste tabelle (user, article, comment, like)')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+def export_data_command(directory, fmt, only, batch_size):
+    """Esporta utenti, articoli, commenti e like in DIRECTORY (un file per tabella)."""
+    view_counter.flush() # Le visualizzazioni ancora in memoria finiscono nell'esportazione
+    os.makedirs(directory, exist_ok=True)
+    for name, table in bulk_tables().items():
+        if only and name not in only:
+            continue
+        count = bulk.export_table(db.engine, table, bulk.data_path(directory, table, fmt), fmt, batch_size)
+        print(f"{name}: {count} righe esportate.")
+
+@bp.cli.command('import-data')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--table', 'only', multiple=True, help='Importa solo queste tabelle (user, article, comment, like)')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+@click.option('--skip-existing', is_flag=True, help='Ignora le righe con un id già presente invece di fermarsi')
+@click.option('--restart', is_flag=True, help="Ignora l'avanzamento salvato e reimporta i file da capo")
+def import_data_command(directory, only, batch_size, skip_existing, restart):
+    """
+    Importa i file di DIRECTORY creati da 'flask export-data' (JSONL o CSV). Se viene interrotta,
+    rieseguendo lo stesso comando riprende dal punto in cui si era fermata.
+    """
+    init_db()
+    for name, table in bulk_tables().items():
+        fmt = bulk.detect_format(directory, table)
+        if (only and name not in only) or fmt is None:
+            continue
+        path = bulk.data_path(directory, table, fmt)
+        if restart:
+            bulk.reset_progress(db.engine, path)
+        try:
+            imported, existing, skipped = bulk.import_table(
+                db.engine, table, path, fmt, batch_size, skip_existing=skip_existing,
+                on_batch=lambda total, name=name: print(f"{name}: {total} righe...", end='\r')
+            )
+        except db.exc.IntegrityError as e:
+            raise click.ClickException(
+                f"{name}: righe già presenti nel database ({e.orig}). "
+                "Usa --skip-existing per ignorarle; i blocchi già importati restano salvati."
+            )
+        details = [f"{existing} già presenti nel database"] if existing else []
+        if skipped:
+            details.append(f"{skipped} già importate in precedenza")
+        print(f"{name}: {imported} righe importate" + (f" ({', '.join(details)})." if details else "."))
+
+    # Contatori, indice di ricerca e cache vanno ricalcolati sui dati importati
+    reconcile_counters()
+    search.rebuild_search_index(db.session)
+    ranking.rebuild(db.session)
+    count_cache.clear()
+    page_cache.clear()
+    missing = upload_store.rebuild(referenced_uploads())
+    if missing:
+        print(f"Attenzione: {len(missing)} immagini referenziate non sono presenti nell'archivio dei file caricati.")
+
+def referenced_uploads():
+    """Quanti record usano ogni file caricato: {nome: articoli e profili che lo usano}."""
+    counts = {}
+    for column in (Article.image_filename, User.profile_picture):
+        for filename, count in db.session.execute(
+                db.select(column, db.func.count()).where(column.is_not(None)).group_by(column)):
+            counts[filename] = counts.get(filename, 0) + count
+    return counts
+
+@bp.cli.command('rebuild-upload-refs')
+@click.option('--prune', is_flag=True, help="Elimina anche i file dell'archivio che nessun record usa")
+def rebuild_upload_refs_command(prune):
+    """Ricalcola i riferimenti ai file caricati dalle immagini degli articoli e dei profili."""
+    counts = referenced_uploads()
+    missing = upload_store.rebuild(counts)
+    print(f"Riferimenti ricalcolati per {len(counts)} file.")
+    if missing:
+        print(f"Attenzione: {len(missing)} file referenziati non sono presenti nell'archivio.")
+    if prune:
+        removed = upload_store.collect(upload_store.unreferenced(), derived=image_variant_files, untracked=True)
+        print(f"File non usati eliminati: {removed}.")
+
+@bp.cli.command('migrate-uploads')
+def migrate_uploads_command():
+    """
+    Sposta nell'archivio le immagini salvate prima (un file '<uuid>.jpg' per caricamento):
+    ogni file prende il nome dal contenuto e i duplicati diventano un file solo.
+    """
+    moved = missing = too_large = 0
+    for filename in sorted(referenced_uploads()):
+        if is_content_name(filename):
+            continue
+        if not upload_store.backend.exists(filename):
+            missing += 1
+            continue
+        try:
+            with contextlib.closing(upload_store.backend.open(filename)) as f:
+                new_filename, _ = upload_store.save(None, f, filename.rsplit('.', 1)[-1].lower())
+        except UploadTooLargeError:
+            too_large += 1 # Resta con il vecchio nome
+            continue
+        # updated_at cambia: le pagine con il vecchio indirizzo non vengono più confermate con un 304
+        db.session.execute(db.update(Article).where(Article.image_filename == filename)
+                           .values(image_filename=new_filename, updated_at=db.func.now()))
+        db.session.execute(db.update(User).where(User.profile_picture == filename)
+                           .values(profile_picture=new_filename, updated_at=db.func.now()))
+        db.session.commit()
+        for name in [filename, *image_variant_files(filename)]:
+            upload_store.backend.delete(name)
+        image_saved(new_filename)
+        moved += 1
+    upload_store.rebuild(referenced_uploads())
+    page_cache.clear()
+    print(f"Immagini spostate nell'archivio: {moved}, mancanti: {missing}, troppo grandi: {too_large}.")
+
+@bp.cli.command('jobs-worker')
+@click.option('--workers', type=int, default=None, help='Thread che eseguono i lavori (predefinito: JOBS_WORKERS)')
+@click.option('--once', is_flag=True, help='Esegue i lavori pronti e termina')
+def jobs_worker_command(workers, once):
+    """Esegue i lavori in coda (da usare con JOBS_MODE=worker, anche su più processi)."""
+    job_queue.recover_stale()
+    if once:
+        print(f"Lavori eseguiti: {job_queue.run_pending()}.")
+        return
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(target=job_queue.work, args=(stop_event,), name=f'job-worker-{i}', daemon=True)
+        for i in range(workers or job_queue.workers)
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"Worker avviato con {len(threads)} thread (Ctrl+C per fermarlo).")
+    try:
+        while any(thread.is_alive() for thread in threads):
+            threads[0].join(timeout=1)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+@bp.cli.command('jobs-status')
+@click.option('--retry-failed', is_flag=True, help='Rimette in coda i lavori falliti definitivamente')
+def jobs_status_command(retry_failed):
+    """Mostra quanti lavori ci sono in coda per stato."""
+    if retry_failed:
+        print(f"Lavori rimessi in coda: {job_queue.retry_failed()}.")
+    stats = job_queue.stats()
+    print(', '.join(f'{status}: {count}' for status, count in sorted(stats.items())) or 'Nessun lavoro in coda.')
+
 
 # --- Routing dell'Applicazione ---
 
-@app.route('/')
+@bp.route('/')
+@http_cache.conditional(index_validation)
+@page_cache.cached(tags=lambda: ['articles'])
 def index():
     """Mostra la homepage con gli articoli paginati e la funzionalità di ricerca."""
-    page = request.args.get('page', 1, type=int) # Ottiene il numero di pagina dall'URL, default 1
-    per_page = 5 # Definisci quanti articoli vuoi per pagina
+    page = request.args.get('page', 1, type=int) # Ottiene il numero di pagina dall'URL, default 1 (solo ricerca)
+    per_page = current_app.config['ARTICLES_PER_PAGE'] # Quanti articoli mostrare per pagina
 
-    query_filter = Article.query
+    query_filter = article_list_query()
 
     search_query = request.args.get('q') # Ottiene il parametro di ricerca 'q' dall'URL
+    match_query = None
     if search_query:
-        # Applica il filtro di ricerca
-        query_filter = query_filter.filter(
-            (Article.title.ilike(f'%{search_query}%')) |
-            (Article.content.ilike(f'%{search_query}%'))
-        )
+        match_query = search.build_match_query(search_query)
+        if match_query and search.is_available(db.session):
+            # Usa l'indice FTS5: risultati ordinati per rilevanza (BM25), poi per data
+            fts, match_condition = search.match_clause(match_query)
+            query_filter = query_filter.join(fts, fts.c.rowid == Article.id).filter(match_condition) \
+                .order_by(fts.c.rank, Article.pub_date.desc())
+        else:
+            # Ripiego senza indice (database non SQLite o FTS5 non disponibile)
+            match_query = None
+            query_filter = query_filter.filter(
+                (Article.title.ilike(f'%{search_query}%')) |
+                (Article.content.ilike(f'%{search_query}%'))
+            )
         flash(f"Risultati per la ricerca: '{search_query}'", 'info')
 
-    # Applica l'ordinamento e la paginazione
-    articles_pagination = query_filter.order_by(Article.pub_date.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        # I risultati della ricerca restano paginati per numero di pagina (l'ordine è per rilevanza);
+        # il totale viene calcolato una volta e riusato dalle pagine successive
+        articles_pagination = query_filter.order_by(Article.pub_date.desc()).paginate(
+            page=page, per_page=per_page, error_out=False, count=False
+        )
+        articles_pagination.total = cached_total(('search', search_query), query_filter)
+    else:
+        # Homepage: paginazione a cursore su (pub_date, id), senza OFFSET né COUNT(*)
+        total = None
+        if current_app.config['PAGINATION_EXACT_TOTALS']:
+            total = cached_total(('articles',), Article.query)
+        articles_pagination = keyset_paginate(
+            query_filter, Article.pub_date, Article.id, per_page,
+            after=request.args.get('after'), before=request.args.get('before'), total=total
+        )
     articles = articles_pagination.items # Gli articoli per la pagina corrente
 
-    return render_template('index.html', articles=articles, pagination=articles_pagination, query=search_query)
+    # Titoli ed estratti con i termini cercati evidenziati
+    snippets = {}
+    if match_query:
+        snippets = search.snippets_for(db.session, match_query, [article.id for article in articles])
 
-@app.route('/article/<int:article_id>')
+    return render_template('index.html', articles=articles, pagination=articles_pagination, query=search_query, snippets=snippets)
+
+@bp.route('/article/<int:article_id>')
 def article_detail(article_id):
     """Mostra i dettagli di un singolo articolo e incrementa le visualizzazioni."""
-    article = Article.query.get_or_404(article_id)
-    article.views += 1
-    db.session.commit()
-    return render_template('article_detail.html', article=article)
-
-@app.route('/create', methods=('GET', 'POST'))
+    # La pagina può arrivare dalla cache (o essere già nel browser: 304), ma la visualizzazione viene contata comunque
+    response = http_cache.conditional_call(
+        article_validation(article_id),
+        lambda: page_cache.cached_call([f'article:{article_id}'], lambda: render_article_detail(article_id))
+    )
+    # L'incremento resta in memoria: la lettura della pagina non apre transazioni di scrittura
+    view_counter.increment(article_id)
+    return response
+
+def render_article_detail(article_id):
+    """Esegue le query e renderizza la pagina di un articolo."""
+    article = get_article_or_404(article_id)
+    views = (article.views or 0) + view_counter.pending(article.id)
+    # Ricerca diretta sulla chiave primaria composta di Like
+    user_liked = current_user.is_authenticated and \
+        db.session.get(Like, (current_user.id, article.id)) is not None
+    comments = keyset_paginate(
+        article_comments_query(article.id), Comment.pub_date, Comment.id, current_app.config['COMMENTS_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    return render_template('article_detail.html', article=article, comments=comments, views=views, user_liked=user_liked)
+
+@bp.route('/create', methods=('GET', 'POST'))
 @login_required
 def create():
     """Permette agli utenti autenticati di creare un nuovo articolo."""
@@ -237,117 +971,177 @@ def create():
 
         if not title or not content:
             flash('Titolo e contenuto sono obbligatori!', 'danger')
-            return redirect(url_for('create'))
+            return redirect(url_for('main.create'))
 
         image_filename = None
         if image_file and image_file.filename != '': # Controlla se un file è stato effettivamente selezionato
             if allowed_file(image_file.filename):
-                original_filename = secure_filename(image_file.filename)
-                extension = original_filename.rsplit('.', 1)[1].lower()
-                image_filename = str(uuid.uuid4()) + '.' + extension
-                image_file.save(os.path.join(app.config['UPLOAD_FOLDER'], image_filename))
+                try:
+                    image_filename = save_image(image_file)
+                except images.InvalidImageError:
+                    flash('Il file caricato non è un\'immagine valida.', 'warning')
+                    return redirect(url_for('main.create'))
+                except UploadTooLargeError as e:
+                    flash(str(e), 'warning')
+                    return redirect(url_for('main.create'))
             else:
                 flash('Tipo di file immagine non permesso! Sono consentiti solo PNG, JPG, JPEG, GIF.', 'warning')
-                return redirect(url_for('create'))
+                return redirect(url_for('main.create'))
 
 
         new_article = Article(title=title, content=content, author=current_user, image_filename=image_filename)
         db.session.add(new_article)
         db.session.commit()
+        job_queue.enqueue('index_article', article_id=new_article.id)
+        if image_filename:
+            image_saved(image_filename)
+        count_cache.clear()
+        page_cache.invalidate('articles', f'user:{current_user.username}')
         flash('Articolo creato con successo!', 'success')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
 
     return render_template('create.html')
 
-@app.route('/edit/<int:article_id>', methods=('GET', 'POST'))
+@bp.route('/edit/<int:article_id>', methods=('GET', 'POST'))
 @login_required
 def edit_article(article_id):
     """Permette all'autore o all'admin di modificare un articolo."""
-    article = Article.query.get_or_404(article_id)
+    article = get_article_or_404(article_id)
 
     # Controllo autorizzazione: solo l'autore o un admin possono modificare
     if article.author != current_user and not current_user.is_admin:
         flash('Non hai il permesso di modificare questo articolo.', 'danger')
-        return redirect(url_for('article_detail', article_id=article.id))
+        return redirect(url_for('main.article_detail', article_id=article.id))
 
     if request.method == 'POST':
+        old_image_filename = new_image_filename = None
         article.title = request.form['title']
         article.content = request.form['content']
+        article.updated_at = db.func.now()
         image_file = request.files.get('image')
 
         if not article.title or not article.content:
             flash('Titolo e contenuto sono obbligatori!', 'danger')
-            return redirect(url_for('edit_article', article_id=article.id))
+            return redirect(url_for('main.edit_article', article_id=article.id))
 
         if image_file and image_file.filename != '':
             if allowed_file(image_file.filename):
-                # Elimina la vecchia immagine se presente
-                if article.image_filename:
-                    old_image_path = os.path.join(app.config['UPLOAD_FOLDER'], article.image_filename)
-                    if os.path.exists(old_image_path):
-                        os.remove(old_image_path)
-                original_filename = secure_filename(image_file.filename)
-                extension = original_filename.rsplit('.', 1)[1].lower()
-                new_image_filename = str(uuid.uuid4()) + '.' + extension
-                image_file.save(os.path.join(app.config['UPLOAD_FOLDER'], new_image_filename))
+                try:
+                    new_image_filename = save_image(image_file)
+                except images.InvalidImageError:
+                    flash('Il file caricato non è un\'immagine valida.', 'warning')
+                    return redirect(url_for('main.edit_article', article_id=article.id))
+                except UploadTooLargeError as e:
+                    flash(str(e), 'warning')
+                    return redirect(url_for('main.edit_article', article_id=article.id))
+                # La vecchia immagine perde un riferimento; se non la usa nessun altro viene eliminata dopo il commit
+                old_image_filename = article.image_filename
+                release_image(old_image_filename)
                 article.image_filename = new_image_filename
                 flash('Nuova immagine caricata con successo!', 'success')
             else:
                 flash('Tipo di file immagine non permesso! Sono consentiti solo PNG, JPG, JPEG, GIF.', 'warning')
-                return redirect(url_for('edit_article', article_id=article.id))
+                return redirect(url_for('main.edit_article', article_id=article.id))
         
         # Per implementare la rimozione dell'immagine senza caricarne una nuova,
         # si potrebbe aggiungere una checkbox nel form HTML.
         # Es: remove_image = request.form.get('remove_image_checkbox')
         # if remove_image and article.image_filename:
-        #    os.remove(os.path.join(app.config['UPLOAD_FOLDER'], article.image_filename))
+        #    os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], article.image_filename))
         #    article.image_filename = None
 
         db.session.commit()
+        job_queue.enqueue('index_article', article_id=article.id)
+        if new_image_filename:
+            image_saved(new_image_filename)
+        if old_image_filename:
+            remove_image(old_image_filename)
+        count_cache.clear() # Le modifiche possono cambiare i risultati delle ricerche
+        page_cache.invalidate('articles', f'article:{article.id}', f'user:{article.author.username}')
         flash('Articolo aggiornato con successo!', 'success')
-        return redirect(url_for('article_detail', article_id=article.id))
+        return redirect(url_for('main.article_detail', article_id=article.id))
 
     return render_template('edit_article.html', article=article)
 
 
-@app.route('/delete/<int:article_id>', methods=('POST',))
+@bp.route('/delete/<int:article_id>', methods=('POST',))
 @login_required
 def delete(article_id):
     """Permette all'autore dell'articolo o all'admin di eliminare un articolo."""
-    article_to_delete = Article.query.get_or_404(article_id)
+    article_to_delete = get_article_or_404(article_id)
     # L'autore o l'admin possono eliminare l'articolo
     if article_to_delete.author != current_user and not current_user.is_admin:
         flash('Non hai il permesso di eliminare questo articolo!', 'danger')
-        return redirect(url_for('index'))
-
-    # Elimina anche il file immagine associato se esiste
-    if article_to_delete.image_filename:
-        image_path = os.path.join(app.config['UPLOAD_FOLDER'], article_to_delete.image_filename)
-        if os.path.exists(image_path):
-            os.remove(image_path)
-
+        return redirect(url_for('main.index'))
+
+    view_counter.discard(article_to_delete.id)
+    article_id, image_filename = article_to_delete.id, article_to_delete.image_filename
+    article_tags = ('articles', f'article:{article_id}', f'user:{article_to_delete.author.username}')
+    # Like e commenti dell'articolo con due DELETE: l'ORM proverebbe ad azzerarne la chiave esterna
+    no_sync = {'synchronize_session': False}
+    db.session.execute(db.delete(Like).where(Like.article_id == article_id), execution_options=no_sync)
+    db.session.execute(db.delete(Comment).where(Comment.article_id == article_id), execution_options=no_sync)
+    ranking.remove_articles(db.session, [article_id])
+    release_image(image_filename)
     db.session.delete(article_to_delete)
     db.session.commit()
+    job_queue.enqueue('remove_article_from_index', article_id=article_id)
+    # Elimina anche il file immagine associato, se nessun altro lo usa
+    if image_filename:
+        remove_image(image_filename)
+    count_cache.clear()
+    page_cache.invalidate(*article_tags)
     flash('Articolo eliminato con successo!', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
 
 # Rotta per la pagina del profilo utente
-@app.route('/user/<string:username>')
+@bp.route('/user/<string:username>')
+@http_cache.conditional(user_profile_validation)
+@page_cache.cached(tags=lambda username: [f'user:{username}'])
 def user_profile(username):
     """Mostra il profilo pubblico di un utente e i suoi articoli."""
     user = User.query.filter_by(username=username).first_or_404()
     # Ordina gli articoli dell'utente per data di pubblicazione
-    articles = Article.query.filter_by(author=user).order_by(Article.pub_date.desc()).all()
+    total = None
+    if current_app.config['PAGINATION_EXACT_TOTALS']:
+        total = cached_total(('user', user.id), Article.query.filter(Article.user_id == user.id))
+    articles = keyset_paginate(
+        user_articles_query(user), Article.pub_date, Article.id, current_app.config['ARTICLES_PER_PAGE'],
+        after=request.args.get('after'), before=request.args.get('before'), total=total
+    )
     return render_template('user_profile.html', user=user, articles=articles)
 
+# Classifiche: nome nell'URL -> (titolo, colonna del punteggio, colonna dell'id, filtro)
+def ranking_feeds():
+    return {
+        'trending': ('Di tendenza', rank_table.c.trending, rank_table.c.article_id, (rank_table.c.trending > 0,)),
+        'viewed': ('Più visti', Article.views, Article.id, (Article.views > 0,)),
+        'liked': ('Più apprezzati', Article.like_count, Article.id, (Article.like_count > 0,)),
+    }
+
+@bp.route('/top/<any(trending, viewed, liked):feed>')
+def top_articles(feed):
+    """Classifica degli articoli a pagine; le prime vengono dalla cache dei primi risultati."""
+    feeds = ranking_feeds()
+    title, score_column, id_column, where = feeds[feed]
+    page = ranking.page(db.session, feed, score_column, id_column, current_app.config['ARTICLES_PER_PAGE'],
+                        after=request.args.get('after'), where=where)
+    # Gli articoli della pagina in una sola query, poi nell'ordine della classifica
+    ids = [article_id for _, article_id in page.items]
+    by_id = {article.id: article for article in article_list_query().filter(Article.id.in_(ids))} if ids else {}
+    articles = [by_id[article_id] for article_id in ids if article_id in by_id]
+    return render_template('top.html', articles=articles, pagination=page, feed=feed, title=title,
+                           feeds={name: feed_title for name, (feed_title, *_) in feeds.items()})
+
 # Rotta per la modifica del profilo utente
-@app.route('/edit_profile', methods=('GET', 'POST'))
+@bp.route('/edit_profile', methods=('GET', 'POST'))
 @login_required
 def edit_profile():
     """Permette all'utente corrente di modificare il proprio profilo."""
     user = current_user
     if request.method == 'POST':
+        old_pic_filename = new_pic_filename = None
         # Validazione base per username ed email (devono essere unici e non quelli di altri utenti)
         new_username = request.form['username']
         new_email = request.form['email']
@@ -355,73 +1149,260 @@ def edit_profile():
         # Controllo se il nuovo username è già in uso da un altro utente (escluso se stesso)
         if new_username != user.username and User.query.filter_by(username=new_username).first():
             flash('Username già in uso da un altro utente!', 'danger')
-            return redirect(url_for('edit_profile'))
+            return redirect(url_for('main.edit_profile'))
         
         # Controllo se la nuova email è già in uso da un altro utente (escluso se stesso)
         if new_email != user.email and User.query.filter_by(email=new_email).first():
             flash('Email già in uso da un altro utente!', 'danger')
-            return redirect(url_for('edit_profile'))
+            return redirect(url_for('main.edit_profile'))
 
         user.username = new_username
         user.email = new_email
         user.bio = request.form['bio']
+        user.updated_at = db.func.now()
 
         profile_pic_file = request.files.get('profile_picture')
         if profile_pic_file and profile_pic_file.filename != '':
             if allowed_file(profile_pic_file.filename):
-                # Elimina la vecchia immagine profilo se presente
-                if user.profile_picture:
-                    old_pic_path = os.path.join(app.config['UPLOAD_FOLDER'], user.profile_picture)
-                    if os.path.exists(old_pic_path):
-                        os.remove(old_pic_path)
-                original_filename = secure_filename(profile_pic_file.filename)
-                extension = original_filename.rsplit('.', 1)[1].lower()
-                new_pic_filename = str(uuid.uuid4()) + '.' + extension
-                profile_pic_file.save(os.path.join(app.config['UPLOAD_FOLDER'], new_pic_filename))
+                try:
+                    new_pic_filename = save_image(profile_pic_file)
+                except images.InvalidImageError:
+                    flash('Il file caricato non è un\'immagine valida.', 'warning')
+                    return redirect(url_for('main.edit_profile'))
+                except UploadTooLargeError as e:
+                    flash(str(e), 'warning')
+                    return redirect(url_for('main.edit_profile'))
+                # La vecchia immagine profilo perde un riferimento; se non la usa nessun altro viene eliminata dopo il commit
+                old_pic_filename = user.profile_picture
+                release_image(old_pic_filename)
                 user.profile_picture = new_pic_filename
                 flash('Immagine profilo caricata con successo!', 'success')
             else:
                 flash('Tipo di file immagine profilo non permesso! Sono consentiti solo PNG, JPG, JPEG, GIF.', 'warning')
-                return redirect(url_for('edit_profile'))
+                return redirect(url_for('main.edit_profile'))
 
         db.session.commit()
+        if new_pic_filename:
+            image_saved(new_pic_filename)
+        if old_pic_filename:
+            remove_image(old_pic_filename)
+        # Nome e foto dell'utente compaiono in molte pagine (articoli, commenti): si svuota tutta la cache
+        page_cache.clear()
         flash('Profilo aggiornato con successo!', 'success')
-        return redirect(url_for('user_profile', username=user.username))
+        return redirect(url_for('main.user_profile', username=user.username))
 
     return render_template('edit_profile.html', user=user)
 
 # Rotta per il chatbot AI
-@app.route('/chatbot', methods=['GET', 'POST'])
+@bp.route('/chatbot', methods=['GET', 'POST'])
 def chatbot():
     """Gestisce le interazioni con il chatbot AI."""
     response_text = ""
     if request.method == 'POST':
         user_message = request.form['message']
         if user_message:
-            if model: # Controlla se il modello AI è stato caricato con successo
+            chat_assistant = get_chat_assistant()
+            if chat_assistant: # Controlla se il modello AI è stato caricato con successo
                 try:
-                    # Invia il messaggio al modello Gemini (una nuova chat per ogni richiesta per semplicità)
-                    chat = model.start_chat(history=[])
-                    gemini_response = chat.send_message(user_message)
-                    response_text = gemini_response.text
+                    # Invia il messaggio al modello insieme alla cronologia della conversazione
+                    response_text = chat_assistant.generate(chat_conversation_id(), user_message)
+                except ChatbotBusyError as e:
+                    response_text = str(e)
+                    flash("Il chatbot è molto richiesto in questo momento. Riprova tra qualche secondo.", 'warning')
                 except Exception as e:
                     response_text = f"Errore del chatbot: {e}"
                     flash("Si è verificato un errore con il chatbot. Riprova più tardi.", 'danger')
             else:
                 response_text = "Il chatbot AI non è disponibile. Controlla la configurazione del modello o la chiave API."
                 flash("Il chatbot AI non è disponibile. Controlla il log del server per maggiori dettagli.", 'danger')
-    return render_template('chatbot.html', response_text=response_text)
+    chat_assistant = get_chat_assistant()
+    turns = chat_assistant.conversations.turns(chat_conversation_id()) if chat_assistant else []
+    return render_template('chatbot.html', response_text=response_text, turns=turns)
+
+# Rotta per iniziare una nuova conversazione con il chatbot
+@bp.route('/chatbot/reset', methods=['POST'])
+def chatbot_reset():
+    """Cancella la memoria della conversazione corrente."""
+    chat_assistant = get_chat_assistant()
+    if chat_assistant:
+        chat_assistant.conversations.reset(chat_conversation_id())
+    return redirect(url_for('main.chatbot'))
+
+# Rotta con le statistiche della cache del chatbot (solo Admin)
+@bp.route('/admin/chatbot/stats')
+@role_required(role='admin')
+def chatbot_stats():
+    """Restituisce hit/miss della cache, tempo risparmiato e conversazioni in memoria."""
+    chat_assistant = get_chat_assistant()
+    if not chat_assistant:
+        return jsonify({'error': 'Il chatbot AI non è disponibile.'}), 503
+    return jsonify(chat_assistant.stats())
+
+@bp.route('/admin/metrics')
+@role_required(role='admin')
+def admin_metrics():
+    """
+    Metriche del processo corrente in JSON, oppure nel formato di Prometheus
+    con ?format=prometheus. Disponibile solo con METRICS_ENABLED attivo.
+    """
+    if not metrics.enabled:
+        abort(404)
+    if request.args.get('format') == 'prometheus':
+        return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+    return jsonify(metrics.snapshot())
+
+def sse_event(event, data):
+    """Formatta un evento Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Rotta per il chatbot in streaming (Server-Sent Events)
+@bp.route('/chatbot/stream', methods=['POST'])
+def chatbot_stream():
+    """Inoltra la risposta del chatbot al browser man mano che il modello la genera."""
+    user_message = request.form.get('message') or (request.get_json(silent=True) or {}).get('message')
+    if not user_message:
+        return jsonify({'error': 'Il messaggio non può essere vuoto.'}), 400
+    chat_assistant = get_chat_assistant()
+    if not chat_assistant:
+        return jsonify({'error': 'Il chatbot AI non è disponibile.'}), 503
+    try:
+        chunks = chat_assistant.stream(chat_conversation_id(), user_message)
+    except ChatbotBusyError as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '5'}
+
+    # Il generatore viene eseguito dopo la fine della richiesta, senza app context
+    logger = current_app.logger
+
+    def events():
+        # Se il client si disconnette il server chiude questo generatore, e con lui 'chunks':
+        # l'inoltro si interrompe e lo slot del modello viene liberato
+        try:
+            for chunk in chunks:
+                yield sse_event('message', {'text': chunk})
+            yield sse_event('done', {})
+        except ChatbotTimeoutError as e:
+            yield sse_event('error', {'error': str(e)})
+        except ChatbotError:
+            logger.exception('Errore del chatbot in streaming')
+            yield sse_event('error', {'error': 'Si è verificato un errore con il chatbot. Riprova più tardi.'})
+        finally:
+            chunks.close()
+
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no', # Disattiva il buffering di nginx
+    })
 
 # Rotta per la gestione degli utenti (solo Admin)
-@app.route('/admin/users')
+@bp.route('/admin/users')
 @role_required(role='admin')
 def admin_users():
-    """Mostra la lista degli utenti per la gestione da parte dell'admin."""
-    users = User.query.all()
-    return render_template('admin_users.html', users=users)
+    """
+    Mostra gli utenti a pagine (cursore sull'id) con il numero di articoli e commenti di ciascuno.
+    Con ?q= cerca per prefisso nel nome utente o nell'email (indici su lower(username) e lower(email)).
+    """
+    search_query = request.args.get('q', '').strip().lower()
+    # Conteggi come sottoquery correlate nella stessa SELECT: calcolati solo per gli utenti della pagina
+    article_count = db.select(db.func.count()).where(Article.user_id == User.id).scalar_subquery()
+    comment_count = db.select(db.func.count()).where(Comment.user_id == User.id).scalar_subquery()
+    query = db.session.query(User, article_count.label('article_count'), comment_count.label('comment_count'))
+    if search_query:
+        # Intervallo [q, q + carattere massimo]: lo stesso filtro di LIKE 'q%' ma usa gli indici
+        upper = search_query + '\U0010ffff'
+        query = query.filter(db.or_(
+            db.func.lower(User.username).between(search_query, upper),
+            db.func.lower(User.email).between(search_query, upper),
+        ))
+    users = id_paginate(
+        query, User.id, current_app.config['ADMIN_USERS_PER_PAGE'],
+        after=request.args.get('after', type=int), before=request.args.get('before', type=int)
+    )
+    return render_template('admin_users.html', users=users, query=search_query)
+
+# Azioni su più utenti insieme (solo Admin)
+@bp.route('/admin/users/bulk', methods=('POST',))
+@role_required(role='admin')
+def admin_users_bulk():
+    """Rende admin, toglie il ruolo o elimina gli utenti selezionati, in un'unica transazione."""
+    action = request.form.get('action')
+    # L'admin corrente non può modificare né eliminare se stesso
+    user_ids = sorted({user_id for user_id in request.form.getlist('user_id', type=int) if user_id != current_user.id})
+    if action not in ('make_admin', 'remove_admin', 'delete') or not user_ids:
+        flash('Seleziona almeno un altro utente e un\'azione.', 'warning')
+        return redirect(url_for('main.admin_users', q=request.form.get('q') or None))
+
+    if action == 'delete':
+        result = commit_with_retry(lambda: delete_users(user_ids))
+        remove_image(*result['images'])
+        for article_id in result['article_ids']:
+            view_counter.discard(article_id)
+        count_cache.clear()
+        page_cache.clear()
+        flash(f"Utenti eliminati: {result['users']} (articoli: {len(result['article_ids'])}).", 'success')
+    else:
+        def change_role():
+            return db.session.execute(
+                db.update(User).where(User.id.in_(user_ids))
+                .values(is_admin=action == 'make_admin', updated_at=db.func.now())
+            ).rowcount
+        updated = commit_with_retry(change_role)
+        page_cache.clear()
+        flash(f"Ruolo aggiornato per {updated} utenti.", 'success')
+    return redirect(url_for('main.admin_users', q=request.form.get('q') or None))
+
+def delete_users(user_ids):
+    """
+    Elimina gli utenti con articoli, commenti e like (propri e ricevuti sui loro articoli) con
+    poche istruzioni a insiemi; ricalcola i contatori degli articoli degli altri utenti toccati.
+    Non fa commit. Restituisce i numeri e i file da eliminare dopo il commit.
+    """
+    own_articles = db.select(Article.id).where(Article.user_id.in_(user_ids))
+    article_ids = db.session.execute(own_articles).scalars().all()
+    images_to_remove = db.session.execute(
+        db.union_all(
+            db.select(Article.image_filename).where(Article.user_id.in_(user_ids), Article.image_filename.is_not(None)),
+            db.select(User.profile_picture).where(User.id.in_(user_ids), User.profile_picture.is_not(None)),
+        )
+    ).scalars().all()
+    # Articoli di altri utenti con like o commenti degli utenti eliminati: i loro contatori cambiano
+    touched = db.session.execute(
+        db.union(
+            db.select(Like.article_id).where(Like.user_id.in_(user_ids)),
+            db.select(Comment.article_id).where(Comment.user_id.in_(user_ids)),
+        )
+    ).scalars().all()
+    touched = sorted(set(touched) - set(article_ids))
+    # Il peso attuale dei like e dei commenti tolti agli articoli degli altri utenti
+    lost = {}
+    if touched:
+        now_local, now_utc = datetime.now(), utc_now()
+        for article_id, timestamp in db.session.execute(
+                db.select(Like.article_id, Like.timestamp).where(Like.user_id.in_(user_ids), Like.article_id.in_(touched))):
+            lost[article_id] = lost.get(article_id, 0) - ranking.like_weight * ranking.decay((now_local - timestamp).total_seconds())
+        for article_id, pub_date in db.session.execute(
+                db.select(Comment.article_id, Comment.pub_date).where(Comment.user_id.in_(user_ids), Comment.article_id.in_(touched))):
+            lost[article_id] = lost.get(article_id, 0) - ranking.comment_weight * ranking.decay((now_utc - pub_date).total_seconds())
+
+    no_sync = {'synchronize_session': False}
+    db.session.execute(db.delete(Like).where(db.or_(Like.user_id.in_(user_ids), Like.article_id.in_(own_articles))),
+                       execution_options=no_sync)
+    db.session.execute(db.delete(Comment).where(db.or_(Comment.user_id.in_(user_ids), Comment.article_id.in_(own_articles))),
+                       execution_options=no_sync)
+    search.remove_articles(db.session, article_ids)
+    ranking.remove_articles(db.session, article_ids)
+    release_image(*images_to_remove)
+    ranking.add_many(db.session, lost)
+    db.session.execute(db.delete(Article).where(Article.user_id.in_(user_ids)), execution_options=no_sync)
+    deleted = db.session.execute(db.delete(User).where(User.id.in_(user_ids)), execution_options=no_sync).rowcount
+    if touched:
+        like_counts = db.select(db.func.count()).where(Like.article_id == Article.id).scalar_subquery()
+        comment_counts = db.select(db.func.count()).where(Comment.article_id == Article.id).scalar_subquery()
+        db.session.execute(db.update(Article).where(Article.id.in_(touched))
+                           .values(like_count=like_counts, comment_count=comment_counts), execution_options=no_sync)
+    return {'users': deleted, 'article_ids': article_ids, 'images': images_to_remove}
 
 # Rotta per cambiare il ruolo di un utente (solo Admin)
-@app.route('/admin/toggle_admin/<int:user_id>', methods=('POST',))
+@bp.route('/admin/toggle_admin/<int:user_id>', methods=('POST',))
 @role_required(role='admin')
 def toggle_admin(user_id):
     """Permette all'admin di abilitare/disabilitare lo stato di amministratore per un utente."""
@@ -430,30 +1411,32 @@ def toggle_admin(user_id):
         flash("Non puoi modificare il tuo stato di amministratore da qui.", 'warning')
     else:
         user.is_admin = not user.is_admin
+        user.updated_at = db.func.now() # Cambiano i link mostrati nelle pagine: i vecchi ETag non valgono più
         db.session.commit()
+        page_cache.clear()
         flash(f"Ruolo di amministratore per {user.username} è ora {'abilitato' if user.is_admin else 'disabilitato'}.", 'success')
-    return redirect(url_for('admin_users'))
+    return redirect(url_for('main.admin_users'))
 
 # Rotta per aggiungere un commento
-@app.route('/article/<int:article_id>/comment', methods=('POST',))
+@bp.route('/article/<int:article_id>/comment', methods=('POST',))
 @login_required
 def add_comment(article_id):
     """Permette agli utenti autenticati di aggiungere un commento a un articolo."""
-    article = Article.query.get_or_404(article_id)
+    if db.session.execute(db.select(Article.id).where(Article.id == article_id)).first() is None:
+        abort(404)
     comment_text = request.form['comment_text']
 
     if not comment_text:
         flash('Il commento non può essere vuoto!', 'danger')
     else:
-        # Crea il commento usando user_id e article_id
-        new_comment = Comment(text=comment_text, user_id=current_user.id, article_id=article.id)
-        db.session.add(new_comment)
-        db.session.commit()
+        # Commento, contatore e punteggio nella stessa transazione (eventualmente insieme ad altre richieste)
+        submit_write(('comment', current_user.id, article_id, comment_text))
+        page_cache.invalidate(f'article:{article_id}')
         flash('Commento aggiunto con successo!', 'success')
-    return redirect(url_for('article_detail', article_id=article.id))
+    return redirect(url_for('main.article_detail', article_id=article_id))
 
 # Rotta per eliminare un commento
-@app.route('/delete_comment/<int:comment_id>', methods=('POST',))
+@bp.route('/delete_comment/<int:comment_id>', methods=('POST',))
 @login_required
 def delete_comment(comment_id):
     """Permette all'autore del commento o all'admin di eliminarlo."""
@@ -462,42 +1445,54 @@ def delete_comment(comment_id):
     # Solo l'autore del commento o un admin può eliminare
     if comment_to_delete.comment_author != current_user and not current_user.is_admin:
         flash('Non hai il permesso di eliminare questo commento!', 'danger')
-        return redirect(url_for('article_detail', article_to_delete.article.id))
+        return redirect(url_for('main.article_detail', article_id=comment_to_delete.article_id))
 
-    article_id = comment_to_delete.article.id # Salva l'ID dell'articolo per il reindirizzamento
-    db.session.delete(comment_to_delete)
-    db.session.commit()
+    article_id = comment_to_delete.article_id # Salva l'ID dell'articolo per il reindirizzamento
+
+    comment_age = (utc_now() - comment_to_delete.pub_date).total_seconds()
+
+    def remove():
+        db.session.delete(comment_to_delete)
+        Article.query.filter_by(id=article_id).update(
+            {Article.comment_count: Article.comment_count - 1}, synchronize_session=False
+        )
+        ranking.record_comment(db.session, article_id, added=False, age_seconds=comment_age)
+    commit_with_retry(remove)
+    page_cache.invalidate(f'article:{article_id}')
     flash('Commento eliminato con successo!', 'success')
-    return redirect(url_for('article_detail', article_id=article_id))
+    return redirect(url_for('main.article_detail', article_id=article_id))
 
 # Rotta API per gestire i "Mi Piace"
-@app.route('/toggle_like/<int:article_id>', methods=['POST'])
+@bp.route('/toggle_like/<int:article_id>', methods=['POST'])
 @login_required
 def toggle_like(article_id):
-    """Gestisce l'aggiunta o la rimozione di un "Mi Piace" a un articolo tramite richiesta AJAX."""
-    article = Article.query.get_or_404(article_id)
-    user_id = current_user.id
-
-    existing_like = Like.query.filter_by(user_id=user_id, article_id=article_id).first()
-
-    if existing_like:
-        # Se esiste già un like, rimuovilo (un-like)
-        db.session.delete(existing_like)
-        db.session.commit()
-        return jsonify({'status': 'unliked', 'likes_count': len(article.likes)}) # Restituisce il nuovo conteggio
-    else:
-        # Se non esiste, aggiungi un like
-        new_like = Like(user_id=user_id, article_id=article_id, timestamp=datetime.now())
-        db.session.add(new_like)
-        db.session.commit()
-        return jsonify({'status': 'liked', 'likes_count': len(article.likes)}) # Restituisce il nuovo conteggio
+    """
+    Mette o toglie un "Mi Piace" tramite richiesta AJAX. Con action 'like' o 'unlike' (form o JSON)
+    la richiesta è idempotente: ripeterla (doppio clic, nuovo tentativo) non cambia nulla;
+    senza action inverte lo stato attuale.
+    """
+    body = request.get_json(silent=True)
+    if body is not None and not isinstance(body, dict):
+        return jsonify({'error': 'Il corpo JSON deve essere un oggetto.'}), 400
+    action = request.form.get('action') or (body or {}).get('action') or 'toggle'
+    if action not in ('like', 'unlike', 'toggle'):
+        return jsonify({'error': "L'azione deve essere 'like' o 'unlike'."}), 400
+    if db.session.execute(db.select(Article.id).where(Article.id == article_id)).first() is None:
+        abort(404)
+
+    liked, changed = submit_write(('like', current_user.id, article_id, action))
+    if changed:
+        page_cache.invalidate(f'article:{article_id}')
+    likes_count = db.session.query(Article.like_count).filter_by(id=article_id).scalar()
+    # Restituisce lo stato e il nuovo conteggio
+    return jsonify({'status': 'liked' if liked else 'unliked', 'changed': changed, 'likes_count': likes_count})
 
 # Rotte di Registrazione, Login, Logout
-@app.route('/register', methods=('GET', 'POST'))
+@bp.route('/register', methods=('GET', 'POST'))
 def register():
     """Permette la registrazione di nuovi utenti."""
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     if request.method == 'POST':
         username = request.form['username']
         email = request.form['email']
@@ -505,56 +1500,313 @@ def register():
         confirm_password = request.form['confirm_password']
         if not username or not email or not password or not confirm_password:
             flash('Tutti i campi sono obbligatori!', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         if password != confirm_password:
             flash('Le password non corrispondono!', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         user_by_username = User.query.filter_by(username=username).first()
         user_by_email = User.query.filter_by(email=email).first()
         if user_by_username:
             flash('Username già registrato!', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         if user_by_email:
             flash('Email già registrata!', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         new_user = User(username=username, email=email)
-        new_user.set_password(password)
+        try:
+            new_user.set_password(password)
+        except PasswordHasherBusyError as e:
+            flash(str(e), 'warning')
+            return render_template('register.html'), 503
         db.session.add(new_user)
         db.session.commit()
         flash('Registrazione completata con successo! Ora puoi accedere.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html')
 
-@app.route('/login', methods=('GET', 'POST'))
+@bp.route('/login', methods=('GET', 'POST'))
 def login():
     """Gestisce il login degli utenti."""
     if current_user.is_authenticated:
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
         remember_me = request.form.get('remember_me')
+        # Il tentativo viene contato prima dell'hash: oltre il limite per utente o indirizzo si
+        # respinge senza calcolarlo, anche con molte richieste in parallelo
+        ip = request.remote_addr
+        attempt, retry_after = login_throttle.try_acquire(username, ip)
+        if attempt is None:
+            flash(f'Troppi tentativi di accesso falliti. Riprova tra {int(retry_after) + 1} secondi.', 'danger')
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = str(int(retry_after) + 1)
+            return response
         user = User.query.filter_by(username=username).first()
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and user.check_password(password)
+        except PasswordHasherBusyError as e:
+            login_throttle.release(username, ip, attempt)
+            flash(str(e), 'warning')
+            return render_template('login.html'), 503
+        if valid:
+            if db.session.is_modified(user):
+                db.session.commit() # Hash ricalcolato con il metodo configurato
+            login_throttle.release(username, ip, attempt)
+            login_throttle.reset(username)
             login_user(user, remember=bool(remember_me))
             flash('Accesso effettuato con successo!', 'success')
             next_page = request.args.get('next')
-            return redirect(next_page or url_for('index'))
+            return redirect(next_page or url_for('main.index'))
         else:
+            # Il tentativo resta registrato come fallito
             flash('Credenziali non valide. Controlla username e password.', 'danger')
-            return redirect(url_for('login'))
+            return redirect(url_for('main.login'))
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     """Effettua il logout dell'utente corrente."""
     logout_user()
     flash('Disconnesso con successo.', 'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
+
+
+# --- API JSON (v1) ---
+# Stesse query con caricamento anticipato delle pagine HTML; ogni risorsa espone i campi
+# elencati qui sotto (quelli "predefiniti" se il client non usa fields[<risorsa>]).
+USER_FIELDS = {
+    'id': lambda u: u.id,
+    'username': lambda u: u.username,
+    'bio': lambda u: u.bio,
+    'profile_picture_url': lambda u: upload_url(u.profile_picture),
+}
+USER_DEFAULT_FIELDS = ('id', 'username', 'profile_picture_url')
+
+ARTICLE_FIELDS = {
+    'id': lambda a: a.id,
+    'title': lambda a: a.title,
+    'content': lambda a: a.content,
+    'pub_date': lambda a: a.pub_date,
+    'updated_at': lambda a: a.updated_at,
+    'image_url': lambda a: upload_url(a.image_filename),
+    'views': lambda a: (a.views or 0) + view_counter.pending(a.id),
+    'like_count': lambda a: a.like_count,
+    'comment_count': lambda a: a.comment_count,
+    'author': lambda a: api.serialize(a.author, g.api_fields['users'], USER_FIELDS),
+    'liked': lambda a: a.id in g.api_liked, # Solo se richiesto: una query in più per tutta la pagina
+}
+ARTICLE_DEFAULT_FIELDS = ('id', 'title', 'pub_date', 'image_url', 'views', 'like_count', 'comment_count', 'author')
+
+COMMENT_FIELDS = {
+    'id': lambda c: c.id,
+    'text': lambda c: c.text,
+    'pub_date': lambda c: c.pub_date,
+    'article_id': lambda c: c.article_id,
+    'author': lambda c: api.serialize(c.comment_author, g.api_fields['users'], USER_FIELDS),
+}
+COMMENT_DEFAULT_FIELDS = ('id', 'text', 'pub_date', 'author')
+
+LIKE_FIELDS = {
+    'article_id': lambda l: l.article_id,
+    'timestamp': lambda l: l.timestamp,
+    'user': lambda l: api.serialize(l.liking_user, g.api_fields['users'], USER_FIELDS),
+}
+LIKE_DEFAULT_FIELDS = ('timestamp', 'user')
+
+@api_bp.errorhandler(api.ApiError)
+def api_error(e):
+    return api.json_response({'error': e.message}, e.status)
+
+@api_bp.errorhandler(404)
+def api_not_found(e):
+    return api.json_response({'error': 'Risorsa non trovata.'}, 404)
+
+@api_bp.before_request
+def parse_api_fields():
+    """Campi richiesti per ogni risorsa, letti una volta per richiesta."""
+    g.api_fields = {
+        'articles': api.requested_fields(request.args, 'articles', ARTICLE_FIELDS, ARTICLE_DEFAULT_FIELDS),
+        'users': api.requested_fields(request.args, 'users', USER_FIELDS, USER_DEFAULT_FIELDS),
+        'comments': api.requested_fields(request.args, 'comments', COMMENT_FIELDS, COMMENT_DEFAULT_FIELDS),
+        'likes': api.requested_fields(request.args, 'likes', LIKE_FIELDS, LIKE_DEFAULT_FIELDS),
+    }
+    g.api_liked = set()
+
+def api_article_query(query, fields):
+    """Non legge il contenuto (il campo più pesante) se il client non lo ha chiesto."""
+    return query if 'content' in fields else query.options(db.defer(Article.content))
+
+def liked_article_ids(article_ids):
+    """Gli id, tra quelli dati, degli articoli a cui l'utente corrente ha messo like (una sola query)."""
+    if not current_user.is_authenticated or not article_ids:
+        return set()
+    return set(db.session.execute(
+        db.select(Like.article_id).where(Like.user_id == current_user.id, Like.article_id.in_(article_ids))
+    ).scalars())
+
+def api_page(pagination, fields, getters):
+    return {
+        'data': [api.serialize(item, fields, getters) for item in pagination.items],
+        'next': pagination.next_cursor,
+        'prev': pagination.prev_cursor,
+    }
+
+def api_limit():
+    return api.page_size(request.args, current_app.config['API_PAGE_SIZE'], current_app.config['API_MAX_PAGE_SIZE'])
+
+def api_articles_page(query):
+    fields = g.api_fields['articles']
+    page = keyset_paginate(
+        api_article_query(query, fields), Article.pub_date, Article.id, api_limit(),
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    if 'liked' in fields:
+        g.api_liked = liked_article_ids([article.id for article in page.items])
+    return api.json_response(api_page(page, fields, ARTICLE_FIELDS))
+
+@api_bp.route('/articles')
+def api_articles():
+    """Articoli dal più recente, a pagine con cursore (?after= / ?before=, ?limit=)."""
+    return api_articles_page(article_list_query())
+
+@api_bp.route('/articles/<int:article_id>')
+def api_article(article_id):
+    """Un articolo (con il contenuto, se non si scelgono i campi); conta una visualizzazione come la pagina."""
+    if 'fields[articles]' not in request.args:
+        g.api_fields['articles'] += ('content',)
+    fields = g.api_fields['articles']
+    article = api_article_query(article_list_query(), fields).filter(Article.id == article_id).first_or_404()
+    if 'liked' in fields:
+        g.api_liked = liked_article_ids([article.id])
+    response = api.json_response({'data': api.serialize(article, fields, ARTICLE_FIELDS)})
+    view_counter.increment(article_id)
+    return response
+
+@api_bp.route('/articles/batch', methods=('GET', 'POST'))
+def api_articles_batch():
+    """
+    Più articoli in una richiesta, con lo stato del like dell'utente corrente:
+    GET ?ids=1,2,3 oppure POST {"ids": [1, 2, 3]}. Gli articoli sono nell'ordine richiesto,
+    gli id inesistenti finiscono in "missing". Due query in tutto, qualunque sia il numero di id.
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            raise api.ApiError('Il corpo deve essere un oggetto JSON con "ids".')
+        values = body.get('ids')
+    else:
+        values = request.args.get('ids', '')
+    article_ids = api.parse_ids(values, current_app.config['API_BATCH_MAX_IDS'])
+    fields = g.api_fields['articles']
+    if 'fields[articles]' not in request.args:
+        fields = g.api_fields['articles'] = fields + ('liked',)
+    found = {article.id: article for article in
+             api_article_query(article_list_query(), fields).filter(Article.id.in_(article_ids))}
+    if 'liked' in fields:
+        g.api_liked = liked_article_ids(list(found))
+    return api.json_response({
+        'data': [api.serialize(found[article_id], fields, ARTICLE_FIELDS) for article_id in article_ids if article_id in found],
+        'missing': [article_id for article_id in article_ids if article_id not in found],
+    })
+
+@api_bp.route('/articles/<int:article_id>/comments')
+def api_article_comments(article_id):
+    """Commenti di un articolo dal più recente, a pagine con cursore."""
+    if not db.session.query(Article.query.filter_by(id=article_id).exists()).scalar():
+        abort(404)
+    page = keyset_paginate(
+        article_comments_query(article_id), Comment.pub_date, Comment.id, api_limit(),
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    return api.json_response(api_page(page, g.api_fields['comments'], COMMENT_FIELDS))
+
+@api_bp.route('/articles/<int:article_id>/likes')
+def api_article_likes(article_id):
+    """Chi ha messo like a un articolo, dal più recente, a pagine con cursore."""
+    if not db.session.query(Article.query.filter_by(id=article_id).exists()).scalar():
+        abort(404)
+    query = Like.query.options(db.joinedload(Like.liking_user)).filter(Like.article_id == article_id)
+    page = keyset_paginate(
+        query, Like.timestamp, Like.user_id, api_limit(),
+        after=request.args.get('after'), before=request.args.get('before')
+    )
+    return api.json_response(api_page(page, g.api_fields['likes'], LIKE_FIELDS))
+
+@api_bp.route('/users/<string:username>')
+def api_user(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    return api.json_response({'data': api.serialize(user, g.api_fields['users'], USER_FIELDS)})
+
+@api_bp.route('/users/<string:username>/articles')
+def api_user_articles(username):
+    """Articoli di un utente dal più recente, a pagine con cursore."""
+    user = User.query.filter_by(username=username).first_or_404()
+    return api_articles_page(user_articles_query(user))
+
+
+# --- Application Factory ---
+def create_app(config=None):
+    """
+    Crea e configura l'applicazione. 'config' (dizionario o oggetto) sovrascrive i valori di Config.
+    Non tocca il database né il modello AI: lo schema si crea con 'flask init-db' e il
+    chatbot viene inizializzato alla prima richiesta che lo usa.
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    # Opzioni dell'engine dal profilo del database; quelle impostate esplicitamente hanno la precedenza
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **database.engine_options(app.config), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    }
+
+    # Percorsi predefiniti relativi all'app
+    if not app.config['UPLOAD_FOLDER']:
+        app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'static', 'uploads')
+    if not app.config['PAGE_CACHE_PATH']:
+        app.config['PAGE_CACHE_PATH'] = os.path.join(app.instance_path, 'page_cache.db')
+    if not app.config['STORAGE_FAKE_S3_PATH']:
+        app.config['STORAGE_FAKE_S3_PATH'] = os.path.join(app.instance_path, 'fake-s3')
+
+    # Inizializza il database e le estensioni
+    db.init_app(app)
+    login_manager.init_app(app)
+    page_cache.init_app(app)
+    app.extensions['count_cache'] = CountCache(ttl=app.config['PAGINATION_COUNT_CACHE_TTL'])
+    with app.app_context():
+        # Crea solo l'oggetto engine: la prima connessione avviene alla prima query
+        database.apply_sqlite_pragmas(db.engine, database.sqlite_pragmas(app.config))
+        # Servizi di questa app (vedi _app_service): ciascuno si registra in app.extensions
+        counter, queue, rank, batcher = ViewCounter(), JobQueue(registry=job_tasks), Ranking(), WriteBatcher()
+        counter.init_app(app, db.engine)
+        Metrics().init_app(app, db.engine)
+        queue.init_app(app, db.engine)
+        counter.fallback = functools.partial(save_views_as_job, queue)
+        rank.init_app(app, db.engine)
+        counter.on_write = rank.record_views
+        batcher.init_app(app)
+        batcher.apply = commit_writes
+        UploadStore().init_app(app, db.engine, load_storage_backend(app.config))
+        db.event.listen(db.engine, 'before_cursor_execute', _count_query)
+    http_cache.init_app(app)
+    PasswordHasher().init_app(app)
+    LoginThrottle().init_app(app)
+
+    app.register_blueprint(bp)
+    app.register_blueprint(api_bp)
+    return app
 
 
 # --- Avvio dell'Applicazione ---
 if __name__ == '__main__':
+    app = create_app()
+    # In sviluppo crea il database se manca (in produzione: 'flask init-db')
+    with app.app_context():
+        init_db()
     # Esegui l'app in modalità debug per lo sviluppo (ricarica automatica e messaggi di errore)
     app.run(debug=True)
\ No newline at end of file
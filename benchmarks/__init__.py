@@ -0,0 +1 @@
+# Script di misura delle prestazioni dell'applicazione (avvio, carico, database)
@@ -0,0 +1,68 @@
+# Confronta due risultati di benchmarks.load e segnala i rallentamenti
+#
+# Uso:
+#   python -m benchmarks.compare prima.json dopo.json --threshold 0.2
+# Termina con codice 1 se almeno uno scenario peggiora oltre la soglia (es. 0.2 = 20%).
+import argparse
+import json
+import sys
+
+# Metriche confrontate: (nome, True se un valore più alto è peggiore)
+METRICS = (
+    ('p50_ms', True),
+    ('p95_ms', True),
+    ('p99_ms', True),
+    ('requests_per_second', False),
+    ('queries_per_request', True),
+)
+
+
+def compare_results(baseline, current, threshold=0.2):
+    """
+    Restituisce la lista dei peggioramenti oltre la soglia relativa:
+    [{'scenario', 'metric', 'baseline', 'current', 'change'}]. Gli scenari presenti
+    in uno solo dei due risultati vengono ignorati.
+    """
+    regressions = []
+    for name, current_stats in current['scenarios'].items():
+        baseline_stats = baseline['scenarios'].get(name)
+        if baseline_stats is None:
+            continue
+        for metric, higher_is_worse in METRICS:
+            old, new = baseline_stats.get(metric), current_stats.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            change = (new - old) / old
+            if (change if higher_is_worse else -change) > threshold:
+                regressions.append({
+                    'scenario': name, 'metric': metric, 'baseline': old, 'current': new, 'change': round(change, 3)
+                })
+    return regressions
+
+
+def print_regressions(regressions, threshold):
+    if not regressions:
+        print(f'Nessun peggioramento oltre il {threshold:.0%}.', file=sys.stderr)
+    for r in regressions:
+        print(f"REGRESSIONE {r['scenario']}.{r['metric']}: {r['baseline']} -> {r['current']} ({r['change']:+.1%})",
+              file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Confronta due risultati dei benchmark.')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Peggioramento relativo tollerato')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare_results(baseline, current, args.threshold)
+    print_regressions(regressions, args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+# Confronta il throughput del database con e senza il profilo SQLite 'production'
+#
+# Più processi (come i worker gunicorn) usano lo stesso file SQLite tramite il test client di Flask:
+# la maggior parte delle richieste legge articoli, le altre mettono/tolgono like e aggiungono commenti.
+# Per ogni profilo si usa un database nuovo (la modalità WAL resta salvata nel file).
+# Uso:
+#   python -m benchmarks.db_concurrency --workers 8 --duration 10
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def benchmark_config(path, profile):
+    return {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'DATABASE_PROFILE': profile,
+        'PAGE_CACHE_BACKEND': 'none', # Ogni lettura arriva al database
+    }
+
+
+def seed(path, profile, users, articles):
+    import app as site
+    flask_app = site.create_app(benchmark_config(path, profile))
+    with flask_app.app_context():
+        site.init_db()
+        authors = []
+        for i in range(users):
+            user = site.User(username=f'bench{i}', email=f'bench{i}@example.com')
+            user.set_password('password')
+            authors.append(user)
+        site.db.session.add_all(authors)
+        site.db.session.flush()
+        site.db.session.add_all(
+            site.Article(title=f'Articolo {i}', content='Testo di prova. ' * 50, user_id=authors[i % users].id)
+            for i in range(articles)
+        )
+        site.db.session.commit()
+        site.view_counter.stop()
+
+
+def worker(path, profile, index, articles, duration, write_ratio, results):
+    import app as site
+    flask_app = site.create_app(benchmark_config(path, profile))
+    flask_app.logger.disabled = True # Gli errori vengono contati, non stampati
+    client = flask_app.test_client()
+    client.post('/login', data={'username': f'bench{index}', 'password': 'password'})
+    rng = random.Random(index)
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        article_id = rng.randint(1, articles)
+        if rng.random() >= write_ratio:
+            kind, response = 'reads', client.get(f'/article/{article_id}')
+        elif rng.random() < 0.5:
+            kind, response = 'writes', client.post(f'/toggle_like/{article_id}')
+        else:
+            kind, response = 'writes', client.post(f'/article/{article_id}/comment', data={'comment_text': 'Commento'})
+        if response.status_code >= 400:
+            counts['errors'] += 1
+        else:
+            counts[kind] += 1
+    with flask_app.app_context():
+        site.view_counter.stop()
+    results.put(counts)
+
+
+def run_profile(profile, workers, users, articles, duration, write_ratio):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        seed(path, profile, max(users, workers), articles)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(path, profile, i, articles, duration, write_ratio, results))
+            for i in range(workers)
+        ]
+        started = time.monotonic()
+        for process in processes:
+            process.start()
+        totals = {'reads': 0, 'writes': 0, 'errors': 0}
+        for _ in processes:
+            for key, value in results.get().items():
+                totals[key] += value
+        for process in processes:
+            process.join()
+        elapsed = time.monotonic() - started
+    completed = totals['reads'] + totals['writes']
+    return {
+        'profile': profile,
+        **totals,
+        'requests_per_second': round(completed / elapsed, 1),
+        'error_rate': round(totals['errors'] / max(1, completed + totals['errors']), 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput concorrente del database SQLite per profilo.')
+    parser.add_argument('--workers', type=int, default=8, help='Processi concorrenti')
+    parser.add_argument('--duration', type=float, default=10, help='Secondi di carico per profilo')
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--articles', type=int, default=200)
+    parser.add_argument('--write-ratio', type=float, default=0.3, help='Quota di richieste in scrittura')
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'])
+    args = parser.parse_args(argv)
+
+    results = [
+        run_profile(profile, args.workers, args.users, args.articles, args.duration, args.write_ratio)
+        for profile in args.profiles
+    ]
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# Contesa sulle scritture di like e commenti: vecchio toggle_like, scrittura idempotente, scritture raggruppate
+#
+# Più processi, ciascuno con più thread (come i worker gunicorn con --threads), mettono e tolgono
+# like e aggiungono commenti su pochi articoli "caldi" dello stesso file SQLite. Ogni utente è usato
+# da due thread insieme, come un doppio clic o due schede aperte.
+# Modalità:
+# - 'legacy':    il vecchio toggle_like (SELECT del like, poi INSERT o DELETE): due richieste insieme
+#                possono inserire lo stesso like e la seconda fallisce con IntegrityError
+# - 'direct':    apply_writes, una transazione per scrittura (WRITE_COALESCING disattivato)
+# - 'coalesced': apply_writes tramite WriteBatcher, più scritture per transazione
+# Le scritture vengono chiamate direttamente (senza HTTP), così si misura solo il percorso di scrittura.
+# Uso:
+#   python -m benchmarks.like_contention --processes 4 --threads 8 --duration 5
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+MODES = ('legacy', 'direct', 'coalesced')
+
+
+def benchmark_config(path, mode, profile):
+    return {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'DATABASE_PROFILE': profile,
+        'PAGE_CACHE_BACKEND': 'none',
+        'JOBS_MODE': 'worker', # I lavori restano in coda: non competono per il database
+        'WRITE_COALESCING': mode == 'coalesced',
+    }
+
+
+def seed(path, profile, users, articles):
+    import app as site
+    flask_app = site.create_app(benchmark_config(path, 'direct', profile))
+    with flask_app.app_context():
+        site.init_db()
+        authors = [site.User(username=f'bench{i}', email=f'bench{i}@example.com', password_hash='-') for i in range(users)]
+        site.db.session.add_all(authors)
+        site.db.session.flush()
+        site.db.session.add_all(
+            site.Article(title=f'Articolo {i}', content='Testo di prova.', user_id=authors[i % users].id)
+            for i in range(articles)
+        )
+        site.db.session.commit()
+
+
+def legacy_toggle_like(site, user_id, article_id):
+    """Il toggle_like precedente: lettura del like, poi inserimento o eliminazione."""
+    def toggle():
+        existing_like = site.db.session.get(site.Like, (user_id, article_id))
+        if existing_like:
+            site.db.session.delete(existing_like)
+            site.ranking.record_like(site.db.session, article_id, liked=False,
+                                     age_seconds=(datetime.now() - existing_like.timestamp).total_seconds())
+            delta = -1
+        else:
+            site.db.session.add(site.Like(user_id=user_id, article_id=article_id, timestamp=datetime.now()))
+            site.ranking.record_like(site.db.session, article_id, liked=True)
+            delta = 1
+        site.Article.query.filter_by(id=article_id).update(
+            {site.Article.like_count: site.Article.like_count + delta}, synchronize_session=False
+        )
+    site.commit_with_retry(toggle)
+
+
+def legacy_add_comment(site, user_id, article_id, text):
+    def add():
+        site.db.session.add(site.Comment(text=text, user_id=user_id, article_id=article_id))
+        site.Article.query.filter_by(id=article_id).update(
+            {site.Article.comment_count: site.Article.comment_count + 1}, synchronize_session=False
+        )
+        site.ranking.record_comment(site.db.session, article_id, added=True)
+    site.commit_with_retry(add)
+
+
+def run_thread(site, flask_app, mode, user_id, seed_value, articles, duration, comment_ratio, counts, lock):
+    rng = random.Random(seed_value)
+    done = errors = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        article_id = rng.randint(1, articles)
+        with flask_app.app_context():
+            try:
+                if rng.random() < comment_ratio:
+                    if mode == 'legacy':
+                        legacy_add_comment(site, user_id, article_id, 'Commento')
+                    else:
+                        site.submit_write(('comment', user_id, article_id, 'Commento'))
+                elif mode == 'legacy':
+                    legacy_toggle_like(site, user_id, article_id)
+                else:
+                    site.submit_write(('like', user_id, article_id, rng.choice(('like', 'unlike'))))
+                done += 1
+            except Exception: # noqa: BLE001 - il benchmark conta gli errori invece di fermarsi
+                site.db.session.rollback()
+                errors += 1
+    with lock:
+        counts['writes'] += done
+        counts['errors'] += errors
+
+
+def worker(path, mode, profile, index, threads, articles, duration, comment_ratio, results):
+    from sqlalchemy.exc import SAWarning
+
+    import app as site
+    # Nel vecchio toggle_like la gara tra due thread produce anche avvisi "0 righe eliminate": bastano i conteggi
+    warnings.filterwarnings('ignore', category=SAWarning)
+    flask_app = site.create_app(benchmark_config(path, mode, profile))
+    counts = {'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    pool = [
+        # Due thread per utente: le stesse righe di like vengono scritte in parallelo
+        threading.Thread(target=run_thread, args=(
+            site, flask_app, mode, index * threads // 2 + t // 2 + 1, index * 1000 + t,
+            articles, duration, comment_ratio, counts, lock
+        ))
+        for t in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    batcher = flask_app.extensions['write_batcher']
+    batcher.stop()
+    counts['transactions'] = batcher.batches if mode == 'coalesced' else counts['writes']
+    results.put(counts)
+
+
+def run_mode(mode, profile, processes, threads, articles, duration, comment_ratio):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        seed(path, profile, processes * threads // 2 + 1, articles)
+        results = multiprocessing.Queue()
+        pool = [
+            multiprocessing.Process(target=worker, args=(path, mode, profile, i, threads, articles, duration, comment_ratio, results))
+            for i in range(processes)
+        ]
+        started = time.monotonic()
+        for process in pool:
+            process.start()
+        totals = {'writes': 0, 'errors': 0, 'transactions': 0}
+        for _ in pool:
+            for key, value in results.get().items():
+                totals[key] += value
+        for process in pool:
+            process.join()
+        elapsed = time.monotonic() - started
+    return {
+        'mode': mode,
+        **totals,
+        'writes_per_second': round(totals['writes'] / elapsed, 1),
+        'writes_per_transaction': round(totals['writes'] / max(1, totals['transactions']), 2),
+        'error_rate': round(totals['errors'] / max(1, totals['writes'] + totals['errors']), 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput delle scritture di like e commenti sotto contesa.')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8, help='Thread per processo (due per utente)')
+    parser.add_argument('--articles', type=int, default=5, help='Articoli su cui si concentrano le scritture')
+    parser.add_argument('--duration', type=float, default=5, help='Secondi di carico per modalità')
+    parser.add_argument('--comment-ratio', type=float, default=0.3, help='Quota di scritture che sono commenti')
+    parser.add_argument('--profile', default='production', help='Profilo del database (vedi database.py)')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args(argv)
+
+    results = [
+        run_mode(mode, args.profile, args.processes, args.threads, args.articles, args.duration, args.comment_ratio)
+        for mode in args.modes
+    ]
+    baseline = next((r for r in results if r['mode'] == 'legacy'), None)
+    if baseline and baseline['writes_per_second']:
+        for result in results:
+            result['speedup'] = round(result['writes_per_second'] / baseline['writes_per_second'], 2)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
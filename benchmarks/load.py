@@ -0,0 +1,295 @@
+# Test di carico delle rotte principali: latenza (p50/p95/p99), throughput e query per richiesta
+#
+# Due driver:
+# - 'client': l'app gira nel processo stesso, chiamata con il test client di Flask da più thread
+# - 'http':   richieste HTTP vere a un server già avviato, da più thread o più processi
+#             (avviare il server con SQL_QUERY_COUNTER=1 per avere anche le query per richiesta)
+# Il database va prima popolato con benchmarks.seed; i risultati sono in JSON e si possono
+# confrontare tra un'esecuzione e l'altra (--baseline, oppure benchmarks.compare).
+# Latenze e throughput contano solo le risposte riuscite; se uno scenario ha risposte di errore
+# il comando lo segnala e termina con codice 1, come per un peggioramento.
+# Uso:
+#   python -m benchmarks.seed --database bench.db --reset
+#   python -m benchmarks.load --database bench.db --output prima.json
+#   python -m benchmarks.load --database bench.db --baseline prima.json --threshold 0.2
+#   python -m benchmarks.load --database bench.db --driver http --url http://127.0.0.1:8000 --processes
+import argparse
+import http.cookiejar
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from flask import current_app
+
+from benchmarks.compare import compare_results, print_regressions
+from benchmarks.seed import PASSWORD, VOCABULARY, database_uri
+from pagination import encode_cursor
+
+# --- Scenari ---
+# Ogni scenario riceve il contesto (dati del database), un generatore casuale e il numero del
+# worker, e restituisce (metodo, percorso, dati del form o None).
+SCENARIOS = {
+    'index': lambda ctx, rng, worker: ('GET', '/', None),
+    'index_search': lambda ctx, rng, worker: ('GET', '/?' + urllib.parse.urlencode({'q': rng.choice(VOCABULARY)}), None),
+    'index_search_deep': lambda ctx, rng, worker: (
+        'GET', '/?' + urllib.parse.urlencode({'q': rng.choice(VOCABULARY), 'page': ctx['deep_page']}), None),
+    'index_deep': lambda ctx, rng, worker: ('GET', '/?' + urllib.parse.urlencode({'after': ctx['deep_cursor']}), None),
+    'article_detail': lambda ctx, rng, worker: ('GET', f"/article/{rng.choice(ctx['article_ids'])}", None),
+    'user_profile': lambda ctx, rng, worker: ('GET', f"/user/{rng.choice(ctx['usernames'])}", None),
+    'toggle_like': lambda ctx, rng, worker: ('POST', f"/toggle_like/{rng.choice(ctx['article_ids'])}", None),
+    'add_comment': lambda ctx, rng, worker: (
+        'POST', f"/article/{rng.choice(ctx['article_ids'])}/comment", {'comment_text': 'Commento di prova del benchmark'}),
+    'login': lambda ctx, rng, worker: (
+        'POST', '/login', {'username': ctx['usernames'][worker % len(ctx['usernames'])], 'password': PASSWORD}),
+    'login_failed': lambda ctx, rng, worker: (
+        'POST', '/login', {'username': ctx['usernames'][worker % len(ctx['usernames'])], 'password': 'sbagliata'}),
+}
+# Scenari che richiedono un utente autenticato
+AUTHENTICATED = {'toggle_like', 'add_comment'}
+# Scenari che ripartono da una sessione vuota a ogni richiesta (login: altrimenti dopo il primo
+# accesso la rotta reindirizza subito senza verificare la password)
+ANONYMOUS_EACH_TIME = {'login', 'login_failed'}
+
+
+def load_context(site, deep_page):
+    """Legge dal database gli id e i nomi usati dagli scenari (serve un app context)."""
+    per_page = current_app.config['ARTICLES_PER_PAGE']
+    article_ids = [row[0] for row in site.db.session.query(site.Article.id)]
+    usernames = [row[0] for row in site.db.session.query(site.User.username).order_by(site.User.id)]
+    if not article_ids or not usernames:
+        raise SystemExit('Database vuoto: eseguire prima python -m benchmarks.seed')
+    # Cursore della pagina 'deep_page' della homepage (data grezza come salvata nel database)
+    row = site.db.session.execute(
+        site.db.text('SELECT pub_date, id FROM article ORDER BY pub_date DESC, id DESC LIMIT 1 OFFSET :offset'),
+        {'offset': min(len(article_ids) - 1, (deep_page - 1) * per_page - 1)}
+    ).first()
+    return {
+        'article_ids': article_ids,
+        'usernames': usernames,
+        'deep_page': deep_page,
+        'deep_cursor': encode_cursor(row[0], row[1]),
+    }
+
+
+# --- Sessioni (una per worker) ---
+class ClientSession:
+    """Richieste tramite il test client di Flask."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.client = flask_app.test_client()
+
+    def reset(self):
+        self.client = self.flask_app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        queries = response.headers.get('X-Query-Count')
+        response.close()
+        return response.status_code, int(queries) if queries is not None else None
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Misura la rotta richiesta, non la pagina a cui reindirizza."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    """Richieste HTTP a un server in esecuzione, con i cookie della sessione."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect())
+
+    def reset(self):
+        self.cookies.clear()
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        if method == 'POST' and body is None:
+            body = b''
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            status, headers = e.code, e.headers
+            e.read()
+        queries = headers.get('X-Query-Count') if headers else None
+        return status, int(queries) if queries is not None else None
+
+
+# --- Esecuzione ---
+def run_worker(session, scenario, ctx, requests, worker, warmup=0):
+    """Esegue le richieste di uno scenario; restituisce [(latenza in secondi, stato, query)]."""
+    rng = random.Random(f'{scenario}-{worker}')
+    build = SCENARIOS[scenario]
+    if scenario in AUTHENTICATED:
+        session.request('POST', '/login', {'username': ctx['usernames'][worker % len(ctx['usernames'])], 'password': PASSWORD})
+    for _ in range(warmup):
+        session.request(*build(ctx, rng, worker))
+    samples = []
+    for _ in range(requests):
+        method, path, data = build(ctx, rng, worker)
+        if scenario in ANONYMOUS_EACH_TIME:
+            session.reset()
+        started = time.perf_counter()
+        status, queries = session.request(method, path, data)
+        samples.append((time.perf_counter() - started, status, queries))
+    return samples
+
+
+def _split(total, parts):
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def run_threads(make_session, scenario, ctx, requests, concurrency, warmup):
+    results = [None] * concurrency
+
+    def target(worker, count):
+        results[worker] = run_worker(make_session(), scenario, ctx, count, worker, warmup)
+
+    threads = [threading.Thread(target=target, args=(worker, count))
+               for worker, count in enumerate(_split(requests, concurrency))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [sample for samples in results for sample in samples], time.perf_counter() - started
+
+
+def _http_process(base_url, scenario, ctx, count, worker, warmup):
+    return run_worker(HttpSession(base_url), scenario, ctx, count, worker, warmup)
+
+
+def run_processes(base_url, scenario, ctx, requests, concurrency, warmup):
+    jobs = [(base_url, scenario, ctx, count, worker, warmup) for worker, count in enumerate(_split(requests, concurrency))]
+    with multiprocessing.Pool(concurrency) as pool:
+        started = time.perf_counter()
+        results = pool.starmap(_http_process, jobs)
+        elapsed = time.perf_counter() - started
+    return [sample for samples in results for sample in samples], elapsed
+
+
+def percentile(sorted_values, p):
+    """Percentile con il metodo nearest-rank."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def _round(value, digits=3):
+    return round(value, digits) if value is not None else None
+
+
+def summarize(samples, elapsed):
+    """
+    Latenze, throughput e query calcolati solo sulle risposte riuscite: le risposte di errore
+    (status >= 400) sono contate in 'errors' ma non falsano i tempi.
+    """
+    succeeded = [(latency, queries) for latency, status, queries in samples if status < 400]
+    latencies = sorted(latency * 1000 for latency, _ in succeeded)
+    queries = [q for _, q in succeeded if q is not None]
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - len(succeeded),
+        'p50_ms': _round(percentile(latencies, 50)),
+        'p95_ms': _round(percentile(latencies, 95)),
+        'p99_ms': _round(percentile(latencies, 99)),
+        'mean_ms': _round(sum(latencies) / len(latencies) if latencies else None),
+        'max_ms': _round(latencies[-1] if latencies else None),
+        'requests_per_second': round(len(succeeded) / elapsed, 1),
+        'queries_per_request': _round(sum(queries) / len(queries) if queries else None, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Test di carico delle rotte principali del blog.')
+    parser.add_argument('--database', default='bench.db', help='Database popolato con benchmarks.seed')
+    parser.add_argument('--driver', choices=('client', 'http'), default='client')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Server per il driver http')
+    parser.add_argument('--processes', action='store_true', help='Driver http: un processo per worker invece di un thread')
+    parser.add_argument('--concurrency', type=int, default=4, help='Worker concorrenti')
+    parser.add_argument('--requests', type=int, default=200, help='Richieste per scenario')
+    parser.add_argument('--warmup', type=int, default=5, help='Richieste iniziali non misurate, per worker')
+    parser.add_argument('--deep-page', type=int, default=50, help='Pagina usata dagli scenari *_deep')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--no-page-cache', action='store_true', help='Driver client: disattiva la cache delle pagine')
+    parser.add_argument('--output', help='File in cui salvare i risultati JSON')
+    parser.add_argument('--baseline', help='Risultati precedenti con cui confrontarsi')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Peggioramento relativo tollerato (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    import app as site
+    config = {'SQLALCHEMY_DATABASE_URI': database_uri(args.database), 'SQL_QUERY_COUNTER': True}
+    if args.no_page_cache:
+        config['PAGE_CACHE_BACKEND'] = 'none'
+    flask_app = site.create_app(config)
+    flask_app.logger.disabled = True
+    with flask_app.app_context():
+        ctx = load_context(site, args.deep_page)
+
+    results = {
+        'meta': {
+            'driver': args.driver, 'processes': args.processes, 'concurrency': args.concurrency,
+            'requests': args.requests, 'database': os.path.basename(args.database),
+            'articles': len(ctx['article_ids']), 'users': len(ctx['usernames']),
+            'python': platform.python_version(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'scenarios': {},
+    }
+    for scenario in args.scenarios:
+        if args.driver == 'client':
+            samples, elapsed = run_threads(lambda: ClientSession(flask_app), scenario, ctx,
+                                           args.requests, args.concurrency, args.warmup)
+        elif args.processes:
+            samples, elapsed = run_processes(args.url, scenario, ctx, args.requests, args.concurrency, args.warmup)
+        else:
+            samples, elapsed = run_threads(lambda: HttpSession(args.url), scenario, ctx,
+                                           args.requests, args.concurrency, args.warmup)
+        results['scenarios'][scenario] = summarize(samples, elapsed)
+        print(f"{scenario:<20} {results['scenarios'][scenario]}", file=sys.stderr)
+    with flask_app.app_context():
+        site.view_counter.stop()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    failed = {name: stats['errors'] for name, stats in results['scenarios'].items() if stats['errors']}
+    for name, errors in failed.items():
+        print(f"ERRORI {name}: {errors} risposte con errore su {results['scenarios'][name]['requests']}: "
+              f"risultati non confrontabili", file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, args.threshold)
+        print_regressions(regressions, args.threshold)
+    return 1 if regressions or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# Throughput dei login concorrenti al variare del limite di hash in parallelo
+#
+# Per ogni valore di PASSWORD_HASH_MAX_CONCURRENT, 'concurrency' thread eseguono login validi
+# mentre altri thread leggono la homepage: si misura quanto i login rallentano le pagine.
+# Infine una raffica di login con password sbagliata mostra l'effetto del limite ai tentativi
+# (le risposte 429 sono contate in 'errors' e non calcolano l'hash).
+# Uso:
+#   python -m benchmarks.login --concurrency 16 --limits 1 2 4 16
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.load import ClientSession, load_context, run_threads, summarize
+from benchmarks.seed import database_uri, seed
+
+
+def run_limit(site, path, limit, concurrency, requests, readers):
+    flask_app = site.create_app({
+        'SQLALCHEMY_DATABASE_URI': database_uri(path),
+        'PAGE_CACHE_BACKEND': 'none',
+        'PASSWORD_HASH_MAX_CONCURRENT': limit,
+        'PASSWORD_HASH_QUEUE_TIMEOUT': 60,
+    })
+    flask_app.logger.disabled = True
+    with flask_app.app_context():
+        ctx = load_context(site, deep_page=1)
+
+    pages = {}
+    stop = threading.Event()
+
+    def read_pages():
+        session, samples = ClientSession(flask_app), []
+        while not stop.is_set():
+            samples.extend(run_threads(lambda: session, 'index', ctx, 1, 1, 0)[0])
+        pages['samples'] = samples
+
+    reader_threads = [threading.Thread(target=read_pages) for _ in range(readers)]
+    for thread in reader_threads:
+        thread.start()
+    samples, elapsed = run_threads(lambda: ClientSession(flask_app), 'login', ctx, requests, concurrency, 0)
+    stop.set()
+    for thread in reader_threads:
+        thread.join()
+
+    failed, failed_elapsed = run_threads(lambda: ClientSession(flask_app), 'login_failed', ctx, requests, concurrency, 0)
+    with flask_app.app_context():
+        site.view_counter.stop()
+    return {
+        'max_concurrent_hashes': limit,
+        'login': summarize(samples, elapsed),
+        'index_during_logins': summarize(pages['samples'], elapsed) if pages.get('samples') else None,
+        'login_failed': summarize(failed, failed_elapsed),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Throughput dei login concorrenti.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Thread che eseguono login')
+    parser.add_argument('--requests', type=int, default=64, help='Login per ogni limite')
+    parser.add_argument('--readers', type=int, default=2, help='Thread che leggono la homepage intanto')
+    parser.add_argument('--limits', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args(argv)
+
+    import app as site
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'login.db')
+        flask_app = site.create_app({'SQLALCHEMY_DATABASE_URI': database_uri(path)})
+        with flask_app.app_context():
+            site.init_db()
+            seed(site, users=args.concurrency, articles=50, comments=0, likes=0)
+        results = [run_limit(site, path, limit, args.concurrency, args.requests, args.readers) for limit in args.limits]
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+# Generatore di dati sintetici per i benchmark: utenti, articoli, commenti e like
+#
+# I dati sono riproducibili (stesso --seed, stessi dati) e vengono inseriti a blocchi
+# con executemany, quindi anche centinaia di migliaia di righe richiedono pochi secondi.
+# Uso:
+#   python -m benchmarks.seed --database bench.db --users 200 --articles 5000 --comments 50000 --likes 100000
+# Tutti gli utenti hanno la password 'password' (utente0 è amministratore).
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+PASSWORD = 'password'
+
+# Parole usate per titoli e testi: abbastanza varie da dare risultati diversi alla ricerca
+VOCABULARY = (
+    'python', 'flask', 'database', 'sqlite', 'ricerca', 'pagina', 'articolo', 'commento', 'utente',
+    'profilo', 'immagine', 'cache', 'indice', 'query', 'server', 'cliente', 'rete', 'memoria',
+    'disco', 'processo', 'thread', 'risposta', 'richiesta', 'modello', 'viaggio', 'cucina',
+    'musica', 'sport', 'cinema', 'libro', 'storia', 'scienza', 'natura', 'città', 'mare',
+    'montagna', 'estate', 'inverno', 'progetto', 'codice', 'errore', 'prestazioni', 'velocità',
+    'sicurezza', 'password', 'sessione', 'modulo',
+)
+
+START_DATE = datetime(2023, 1, 1)
+
+
+def username(index):
+    return f'utente{index}'
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def _insert(site, model, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        site.db.session.execute(site.db.insert(model), rows[start:start + batch_size])
+    site.db.session.commit()
+
+
+def seed(site, users=50, articles=500, comments=2000, likes=5000, seed_value=0, batch_size=1000):
+    """
+    Popola il database dell'app corrente (serve un app context). 'site' è il modulo app.
+    Restituisce il numero di righe create per tabella.
+    """
+    rng = random.Random(seed_value)
+    # Un solo hash, con il metodo configurato: calcolarne migliaia sarebbe lento
+    password_hash = generate_password_hash(PASSWORD, site.password_hasher.method)
+
+    first_user_id = (site.db.session.query(site.db.func.max(site.User.id)).scalar() or 0) + 1
+    user_rows = [
+        {'id': first_user_id + i, 'username': username(i), 'email': f'{username(i)}@example.com',
+         'password_hash': password_hash, 'bio': _text(rng, 12), 'is_admin': i == 0}
+        for i in range(users)
+    ]
+    _insert(site, site.User, user_rows, batch_size)
+    user_ids = [row['id'] for row in user_rows]
+
+    first_article_id = (site.db.session.query(site.db.func.max(site.Article.id)).scalar() or 0) + 1
+    article_rows = [
+        {'id': first_article_id + i, 'title': _text(rng, 5).capitalize(), 'content': _text(rng, 150),
+         'pub_date': START_DATE + timedelta(minutes=i * 30 + rng.randint(0, 29)),
+         'user_id': rng.choice(user_ids), 'views': rng.randint(0, 5000)}
+        for i in range(articles)
+    ]
+    _insert(site, site.Article, article_rows, batch_size)
+    article_ids = [row['id'] for row in article_rows]
+
+    comment_rows = []
+    for _ in range(comments if article_ids else 0):
+        article = rng.choice(article_rows)
+        comment_rows.append({
+            'text': _text(rng, rng.randint(5, 40)), 'user_id': rng.choice(user_ids), 'article_id': article['id'],
+            'pub_date': article['pub_date'] + timedelta(minutes=rng.randint(1, 60 * 24 * 30)),
+        })
+    _insert(site, site.Comment, comment_rows, batch_size)
+
+    # Ogni coppia (utente, articolo) può comparire una sola volta (chiave primaria di Like)
+    likes = min(likes, len(user_ids) * len(article_ids))
+    pairs = set()
+    while len(pairs) < likes:
+        pairs.add((rng.choice(user_ids), rng.choice(article_ids)))
+    like_rows = [
+        {'user_id': user_id, 'article_id': article_id, 'timestamp': START_DATE + timedelta(minutes=rng.randint(0, 10 ** 6))}
+        for user_id, article_id in sorted(pairs)
+    ]
+    _insert(site, site.Like, like_rows, batch_size)
+
+    site.reconcile_counters()
+    site.search.rebuild_search_index(site.db.session)
+    return {'users': len(user_rows), 'articles': len(article_rows), 'comments': len(comment_rows), 'likes': len(like_rows)}
+
+
+def database_uri(path):
+    return f'sqlite:///{os.path.abspath(path)}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Popola un database con dati sintetici per i benchmark.')
+    parser.add_argument('--database', default='bench.db', help='File SQLite da creare o popolare')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--articles', type=int, default=500)
+    parser.add_argument('--comments', type=int, default=2000)
+    parser.add_argument('--likes', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0, help='Seme del generatore casuale')
+    parser.add_argument('--reset', action='store_true', help='Elimina il file prima di popolarlo')
+    args = parser.parse_args(argv)
+
+    if args.reset:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.database + suffix):
+                os.remove(args.database + suffix)
+
+    import app as site
+    flask_app = site.create_app({'SQLALCHEMY_DATABASE_URI': database_uri(args.database)})
+    with flask_app.app_context():
+        site.init_db()
+        created = seed(site, args.users, args.articles, args.comments, args.likes, seed_value=args.seed)
+    print(json.dumps(created))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+# Misura il tempo di avvio: import del modulo e creazione dell'app con create_app()
+#
+# Ogni misura gira in un processo Python nuovo, così le cache degli import non falsano i tempi.
+# Uso:
+#   python -m benchmarks.startup                    # mediana su 5 avvii, soglie predefinite
+#   python -m benchmarks.startup --max-import 0.5 --max-create 0.2
+# Termina con codice 1 se l'avvio supera le soglie (utile in CI); 0 disattiva una soglia.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Soglie predefinite, con margine rispetto ai tempi misurati (circa 0.7s e 0.02s)
+MAX_IMPORT = 1.5
+MAX_CREATE = 0.25
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'gemini_imported': 'google.generativeai' in sys.modules,
+}))
+"""
+
+
+def measure_once():
+    output = subprocess.run(
+        [sys.executable, '-c', _PROBE], cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Misura il tempo di avvio dell'applicazione.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import', type=float, default=MAX_IMPORT, help='Secondi massimi per import app (0: nessuna soglia)')
+    parser.add_argument('--max-create', type=float, default=MAX_CREATE, help='Secondi massimi per create_app() (0: nessuna soglia)')
+    args = parser.parse_args(argv)
+
+    runs = [measure_once() for _ in range(args.runs)]
+    result = {
+        'runs': args.runs,
+        'import_median': round(statistics.median(r['import'] for r in runs), 4),
+        'create_app_median': round(statistics.median(r['create_app'] for r in runs), 4),
+        'gemini_imported': any(r['gemini_imported'] for r in runs),
+    }
+    print(json.dumps(result, indent=2))
+
+    failures = []
+    if result['gemini_imported']:
+        failures.append("l'SDK di Gemini viene importato all'avvio")
+    if args.max_import and result['import_median'] > args.max_import:
+        failures.append(f"import app: {result['import_median']}s > {args.max_import}s")
+    if args.max_create and result['create_app_median'] > args.max_create:
+        failures.append(f"create_app(): {result['create_app_median']}s > {args.max_create}s")
+    for failure in failures:
+        print(f'REGRESSIONE: {failure}', file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
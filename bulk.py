@@ -0,0 +1,202 @@
+# Importazione ed esportazione massiva dei dati (utenti, articoli, commenti, like) in JSONL o CSV
+#
+# Esportazione: ogni tabella viene letta a blocchi ordinati per chiave primaria (paginazione a
+# cursore, come rebuild_search_index) e scritta riga per riga: la memoria usata non dipende
+# dalla dimensione del database.
+# Importazione: il file viene letto in streaming e inserito a blocchi di 'batch_size' righe,
+# ciascuno con un unico INSERT a più parametri (executemany) nella propria transazione.
+# Nella stessa transazione si registra quante righe del file sono state elaborate (tabella
+# 'import_progress'): se l'importazione si interrompe, ripartendo si salta ciò che è già nel database.
+# Gli id, gli hash delle password e i nomi dei file delle immagini vengono copiati così come sono.
+import csv
+import json
+import os
+import time
+from datetime import date, datetime
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    insert,
+    select,
+    tuple_,
+    update,
+)
+
+import database
+
+FORMATS = ('jsonl', 'csv')
+
+# Alcuni articoli superano il limite predefinito del modulo csv (128 KB per campo)
+csv.field_size_limit(2 ** 31 - 1)
+
+metadata = MetaData()
+
+progress_table = Table(
+    'import_progress', metadata,
+    Column('source', String(500), primary_key=True), # Percorso assoluto del file importato
+    Column('records', Integer, nullable=False), # Righe del file già elaborate (inserite o ignorate come duplicati)
+    Column('updated_at', Float, nullable=False),
+)
+
+
+def data_path(directory, table, fmt):
+    return os.path.join(directory, f'{table.name}.{fmt}')
+
+
+def detect_format(directory, table):
+    """Il formato del file di una tabella presente nella cartella (None se manca)."""
+    return next((fmt for fmt in FORMATS if os.path.exists(data_path(directory, table, fmt))), None)
+
+
+# --- Conversione dei valori ---
+def _to_text(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _from_text(column, value, fmt):
+    """Converte un valore letto dal file nel tipo della colonna."""
+    if fmt == 'csv' and value == '' and column.nullable:
+        return None # Nel CSV la cella vuota rappresenta NULL
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value) if isinstance(value, str) else value
+    if isinstance(column.type, Date):
+        return date.fromisoformat(value) if isinstance(value, str) else value
+    if isinstance(column.type, Boolean):
+        return value if isinstance(value, bool) else str(value).lower() in ('1', 'true')
+    if isinstance(column.type, Integer):
+        return int(value)
+    return value
+
+
+# --- Esportazione ---
+def _iter_rows(conn, table, batch_size):
+    """Tutte le righe della tabella, lette a blocchi con un cursore sulla chiave primaria."""
+    key = list(table.primary_key.columns)
+    last = None
+    while True:
+        query = select(table).order_by(*key).limit(batch_size)
+        if last is not None:
+            query = query.where(tuple_(*key) > tuple_(*last) if len(key) > 1 else key[0] > last[0])
+        rows = conn.execute(query).mappings().all()
+        if not rows:
+            return
+        yield from rows
+        last = [rows[-1][column.name] for column in key]
+
+
+def export_table(engine, table, path, fmt='jsonl', batch_size=1000):
+    """
+    Scrive tutte le righe della tabella in 'path' e restituisce quante sono.
+    Il file viene scritto con un nome temporaneo e rinominato alla fine: non resta mai un file a metà.
+    """
+    names = [column.name for column in table.columns]
+    tmp_path = path + '.tmp'
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f, engine.connect() as conn:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(names)
+        for row in _iter_rows(conn, table, batch_size):
+            if fmt == 'csv':
+                writer.writerow(['' if row[name] is None else int(row[name]) if isinstance(row[name], bool)
+                                 else _to_text(row[name]) for name in names])
+            else:
+                f.write(json.dumps({name: _to_text(row[name]) for name in names}, ensure_ascii=False) + '\n')
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+# --- Importazione ---
+def _read_records(path, fmt, skip):
+    """Le righe del file come dizionari, saltando le prime 'skip' (già importate)."""
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            for index, record in enumerate(csv.DictReader(f)):
+                if index >= skip:
+                    yield record
+        else:
+            index = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                if index >= skip: # Le righe da saltare non vengono nemmeno decodificate
+                    yield json.loads(line)
+                index += 1
+
+
+def imported_records(engine, path):
+    """Righe del file già elaborate da un'importazione precedente (0 se mai iniziata)."""
+    metadata.create_all(engine)
+    with engine.connect() as conn:
+        return conn.execute(
+            select(progress_table.c.records).where(progress_table.c.source == os.path.abspath(path))
+        ).scalar() or 0
+
+
+def reset_progress(engine, path=None):
+    """Dimentica l'avanzamento di un file (o di tutti), per reimportarlo da capo."""
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        query = progress_table.delete()
+        if path is not None:
+            query = query.where(progress_table.c.source == os.path.abspath(path))
+        conn.execute(query)
+
+
+def import_table(engine, table, path, fmt='jsonl', batch_size=1000, skip_existing=False, on_batch=None):
+    """
+    Importa il file nella tabella a blocchi di 'batch_size' righe e restituisce
+    (importate, già presenti, saltate): 'già presenti' sono le righe ignorate con skip_existing
+    perché la loro chiave era già nel database, 'saltate' quelle elaborate in un'esecuzione precedente.
+    Senza skip_existing un duplicato interrompe l'importazione (i blocchi precedenti restano salvati).
+    on_batch(righe_elaborate) viene chiamata dopo ogni blocco.
+    """
+    source = os.path.abspath(path)
+    done = imported_records(engine, path)
+    columns = {column.name: column for column in table.columns}
+    statement = database.insert_or_ignore(table, engine.dialect.name) if skip_existing else insert(table)
+
+    def write(batch, records):
+        """Inserisce il blocco e restituisce le righe effettivamente inserite."""
+        with engine.begin() as conn:
+            inserted = conn.execute(statement, batch).rowcount
+            if not skip_existing or not conn.dialect.supports_sane_multi_rowcount:
+                inserted = len(batch) # Senza duplicati ignorati (o senza un conteggio affidabile)
+            # L'avanzamento si salva nella stessa transazione dei dati: o entrambi o nessuno
+            updated = conn.execute(
+                update(progress_table).where(progress_table.c.source == source)
+                .values(records=records, updated_at=time.time())
+            ).rowcount
+            if not updated:
+                conn.execute(insert(progress_table).values(source=source, records=records, updated_at=time.time()))
+        return inserted
+
+    read = imported = 0
+    batch = []
+    for record in _read_records(path, fmt, done):
+        batch.append({name: _from_text(columns[name], value, fmt) for name, value in record.items() if name in columns})
+        if len(batch) >= batch_size:
+            read += len(batch)
+            imported += write(batch, done + read)
+            batch = []
+            if on_batch is not None:
+                on_batch(done + read)
+    if batch:
+        read += len(batch)
+        imported += write(batch, done + read)
+        if on_batch is not None:
+            on_batch(done + read)
+    return imported, read - imported, done
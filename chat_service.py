@@ -0,0 +1,355 @@
+# Servizio del chatbot: interfaccia verso il modello, streaming, timeout e limite di chiamate concorrenti
+#
+# Il modello è dietro l'interfaccia ChatModel: in produzione GeminiChatModel,
+# nei test FakeChatModel, che risponde in locale senza rete.
+import queue
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class ChatbotError(Exception):
+    """Errore generico del chatbot."""
+
+
+class ChatbotBusyError(ChatbotError):
+    """Troppe chiamate al modello in corso: la richiesta non ha ottenuto uno slot in tempo."""
+
+
+class ChatbotTimeoutError(ChatbotError):
+    """Il modello non ha risposto entro il tempo massimo."""
+
+
+class ChatModel:
+    """Interfaccia di un modello di chat."""
+
+    name = 'chat-model'
+
+    def stream(self, prompt, history=None, timeout=None):
+        """Restituisce un iteratore sui pezzi di testo della risposta, man mano che arrivano."""
+        raise NotImplementedError
+
+
+class GeminiChatModel(ChatModel):
+    """Modello Google Gemini tramite l'SDK google-generativeai."""
+
+    def __init__(self, model):
+        self._model = model # Oggetto genai.GenerativeModel già configurato
+        self.name = getattr(model, 'model_name', 'gemini')
+
+    def stream(self, prompt, history=None, timeout=None):
+        chat = self._model.start_chat(history=history or [])
+        request_options = {'timeout': timeout} if timeout else None
+        response = chat.send_message(prompt, stream=True, request_options=request_options)
+        for chunk in response:
+            text = chunk.text
+            if text:
+                yield text
+
+
+def create_gemini_model(api_key, model_name):
+    """
+    Importa e configura l'SDK di Gemini solo quando serve (primo uso del chatbot):
+    l'import dell'SDK è lento e non deve pesare sull'avvio dell'applicazione.
+    """
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return GeminiChatModel(genai.GenerativeModel(model_name))
+
+
+class FakeChatModel(ChatModel):
+    """
+    Modello locale per test e sviluppo: restituisce una risposta fissa (o l'eco del
+    messaggio) divisa in parole, con un ritardo opzionale tra un pezzo e l'altro.
+    """
+
+    name = 'fake'
+
+    def __init__(self, reply=None, delay=0.0):
+        self.reply = reply
+        self.delay = delay
+        self.calls = 0
+
+    def stream(self, prompt, history=None, timeout=None):
+        self.calls += 1
+        text = self.reply if self.reply is not None else f'Hai scritto: {prompt}'
+        for word in text.split(' '):
+            if self.delay:
+                time.sleep(self.delay)
+            yield word + ' '
+
+
+class ChatService:
+    """
+    Esegue le chiamate al modello in un thread separato e inoltra i pezzi di risposta.
+
+    max_concurrent: chiamate al modello contemporanee al massimo, così il chatbot
+                    non occupa tutti i worker a scapito delle pagine del blog.
+    queue_timeout:  secondi di attesa per uno slot libero prima di rinunciare.
+    timeout:        secondi massimi per l'intera risposta.
+    observer:       funzione opzionale chiamata a fine chiamata con (secondi, esito),
+                    esito 'ok', 'error' o 'cancelled' (es. Metrics.observe_chatbot).
+    """
+
+    def __init__(self, model, max_concurrent=4, queue_timeout=2.0, timeout=30.0, observer=None):
+        self.model = model
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.observer = observer
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def stream(self, prompt, history=None):
+        """
+        Occupa subito uno slot (o solleva ChatbotBusyError) e restituisce un generatore
+        di pezzi di testo. Chiudere il generatore (es. il client si disconnette)
+        interrompe l'inoltro e libera lo slot appena la chiamata al modello termina.
+        """
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise ChatbotBusyError('Il chatbot è occupato, riprova tra poco.')
+
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+
+        def worker():
+            started = time.monotonic()
+            outcome = 'ok'
+            try:
+                for chunk in self.model.stream(prompt, history=history, timeout=self.timeout):
+                    if cancelled.is_set():
+                        outcome = 'cancelled'
+                        break
+                    chunks.put(('chunk', chunk))
+                chunks.put(('end', None))
+            except Exception as e: # noqa: BLE001 - qualsiasi errore del modello va mostrato al client
+                outcome = 'error'
+                chunks.put(('error', e))
+            finally:
+                self._slots.release()
+                if self.observer is not None:
+                    self.observer(time.monotonic() - started, outcome)
+
+        threading.Thread(target=worker, name='chatbot-upstream', daemon=True).start()
+        return self._relay(chunks, cancelled)
+
+    def _relay(self, chunks, cancelled):
+        deadline = time.monotonic() + self.timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ChatbotTimeoutError('Il chatbot non ha risposto in tempo.')
+                try:
+                    kind, value = chunks.get(timeout=remaining)
+                except queue.Empty:
+                    raise ChatbotTimeoutError('Il chatbot non ha risposto in tempo.')
+                if kind == 'chunk':
+                    yield value
+                elif kind == 'error':
+                    raise ChatbotError(str(value)) from value
+                else:
+                    return
+        finally:
+            cancelled.set()
+
+    def generate(self, prompt, history=None):
+        """Versione non in streaming: restituisce la risposta completa."""
+        return ''.join(self.stream(prompt, history=history))
+
+
+def normalize_prompt(prompt):
+    """Normalizza una domanda per la cache: minuscole, spazi compattati, punteggiatura finale rimossa."""
+    return ' '.join(prompt.lower().split()).rstrip(' ?!.')
+
+
+def estimate_tokens(text):
+    """Stima approssimativa dei token (circa 4 caratteri per token), sufficiente per il budget."""
+    return len(text) // 4 + 1
+
+
+class ResponseCache:
+    """
+    Cache delle risposte alle domande senza contesto (prima domanda di una conversazione),
+    con scadenza, numero massimo di voci (LRU) e contatori di hit/miss e tempo risparmiato.
+    """
+
+    def __init__(self, ttl=3600, max_entries=500):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict() # chiave -> (scadenza, risposta, latenza originale)
+        self._lock = threading.Lock()
+
+    def get(self, model_name, prompt):
+        key = (model_name, normalize_prompt(prompt))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry[2]
+            return entry[1]
+
+    def set(self, model_name, prompt, response, latency):
+        key = (model_name, normalize_prompt(prompt))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, response, latency)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'saved_seconds': round(self.saved_seconds, 3),
+            }
+
+
+class ConversationStore:
+    """
+    Memoria delle conversazioni lato server, una per utente.
+
+    Ogni conversazione tiene al massimo 'max_turns' scambi e 'max_tokens' token stimati:
+    gli scambi più vecchi escono dalla finestra e restano solo come breve riepilogo.
+    Le conversazioni inattive da più di 'ttl' secondi, o oltre 'max_conversations'
+    (le meno recenti), vengono eliminate.
+    """
+
+    SUMMARY_PREFIX = 'Riepilogo degli argomenti già discussi in questa conversazione: '
+
+    def __init__(self, max_turns=10, max_tokens=2000, max_conversations=1000, ttl=3600):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self._conversations = OrderedDict() # id -> {'summary', 'turns', 'tokens', 'updated'}
+        self._lock = threading.Lock()
+
+    def _get(self, conversation_id):
+        conversation = self._conversations.get(conversation_id)
+        if conversation is not None and conversation['updated'] + self.ttl <= time.monotonic():
+            del self._conversations[conversation_id]
+            conversation = None
+        return conversation
+
+    def turns(self, conversation_id):
+        """Scambi (domanda, risposta) ancora nella finestra, dal più vecchio."""
+        with self._lock:
+            conversation = self._get(conversation_id)
+            return list(conversation['turns']) if conversation else []
+
+    def history(self, conversation_id):
+        """La conversazione nel formato 'history' dell'SDK Gemini (ruoli user/model alternati)."""
+        with self._lock:
+            conversation = self._get(conversation_id)
+            if not conversation:
+                return []
+            history = []
+            if conversation['summary']:
+                history.append({'role': 'user', 'parts': [self.SUMMARY_PREFIX + conversation['summary']]})
+                history.append({'role': 'model', 'parts': ['Ok.']})
+            for user_text, model_text in conversation['turns']:
+                history.append({'role': 'user', 'parts': [user_text]})
+                history.append({'role': 'model', 'parts': [model_text]})
+            return history
+
+    def append(self, conversation_id, user_text, model_text):
+        """Aggiunge uno scambio e riporta la conversazione entro i limiti."""
+        with self._lock:
+            conversation = self._get(conversation_id)
+            if conversation is None:
+                conversation = {'summary': '', 'turns': deque(), 'tokens': 0}
+                self._conversations[conversation_id] = conversation
+            conversation['turns'].append((user_text, model_text))
+            conversation['tokens'] += estimate_tokens(user_text) + estimate_tokens(model_text)
+            conversation['updated'] = time.monotonic()
+            self._conversations.move_to_end(conversation_id)
+
+            while conversation['turns'] and (
+                len(conversation['turns']) > self.max_turns or conversation['tokens'] > self.max_tokens
+            ):
+                old_user, old_model = conversation['turns'].popleft()
+                conversation['tokens'] -= estimate_tokens(old_user) + estimate_tokens(old_model)
+                # Delle domande uscite dalla finestra resta solo l'inizio, nel riepilogo
+                topic = ' '.join(old_user.split())[:80]
+                summary = f"{conversation['summary']}; {topic}" if conversation['summary'] else topic
+                # Anche il riepilogo ha un limite: si tengono gli argomenti più recenti
+                # (max_tokens caratteri sono circa un quarto del budget in token)
+                conversation['summary'] = summary[-self.max_tokens:]
+
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+    def reset(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+    def __len__(self):
+        return len(self._conversations)
+
+
+class ChatAssistant:
+    """
+    Unisce il servizio del modello, la cache delle risposte e la memoria delle conversazioni.
+    """
+
+    def __init__(self, service, cache=None, conversations=None):
+        self.service = service
+        self.cache = cache
+        self.conversations = conversations
+
+    def stream(self, conversation_id, prompt):
+        """
+        Restituisce un generatore di pezzi di testo. Le domande senza contesto vengono
+        servite dalla cache quando possibile; in caso contrario solleva ChatbotBusyError
+        subito, come ChatService.stream().
+        """
+        history = self.conversations.history(conversation_id) if self.conversations is not None else []
+        use_cache = self.cache is not None and not history
+        if use_cache:
+            cached = self.cache.get(self.service.model.name, prompt)
+            if cached is not None:
+                return self._replay(conversation_id, prompt, cached)
+        started = time.monotonic()
+        chunks = self.service.stream(prompt, history=history)
+        return self._record(conversation_id, prompt, chunks, started, use_cache)
+
+    def _replay(self, conversation_id, prompt, response):
+        yield response
+        if self.conversations is not None:
+            self.conversations.append(conversation_id, prompt, response)
+
+    def _record(self, conversation_id, prompt, chunks, started, use_cache):
+        parts = []
+        try:
+            for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        finally:
+            chunks.close()
+        # Si arriva qui solo se la risposta è completa (niente errori né disconnessioni)
+        response = ''.join(parts)
+        if use_cache:
+            self.cache.set(self.service.model.name, prompt, response, time.monotonic() - started)
+        if self.conversations is not None:
+            self.conversations.append(conversation_id, prompt, response)
+
+    def generate(self, conversation_id, prompt):
+        """Versione non in streaming: restituisce la risposta completa."""
+        return ''.join(self.stream(conversation_id, prompt))
+
+    def stats(self):
+        stats = {'conversations': len(self.conversations) if self.conversations is not None else 0}
+        if self.cache is not None:
+            stats.update(self.cache.stats())
+        return stats
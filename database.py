@@ -0,0 +1,114 @@
+# Profilo del database: pragma SQLite, pool di connessioni e nuovi tentativi quando il database è occupato
+#
+# Con più worker gunicorn sullo stesso file SQLite, la modalità predefinita (journal DELETE)
+# blocca i lettori mentre qualcuno scrive e produce errori "database is locked".
+# Il profilo 'production' attiva WAL (i lettori non aspettano più gli scrittori), imposta
+# busy_timeout e le cache su ogni nuova connessione. Con un database server (URI postgresql://,
+# mysql://, ...) i pragma non vengono applicati e restano solo le impostazioni del pool.
+import time
+
+from sqlalchemy import event, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def is_sqlite_memory(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def sqlite_pragmas(config):
+    """Pragma da eseguire su ogni connessione, secondo il profilo scelto (DATABASE_PROFILE)."""
+    if config['DATABASE_PROFILE'] != 'production':
+        return {}
+    return {
+        'journal_mode': config['SQLITE_JOURNAL_MODE'],
+        'synchronous': config['SQLITE_SYNCHRONOUS'],
+        'cache_size': config['SQLITE_CACHE_SIZE'],
+        'mmap_size': config['SQLITE_MMAP_SIZE'],
+        'busy_timeout': config['SQLITE_BUSY_TIMEOUT'],
+        'temp_store': 'MEMORY',
+    }
+
+
+def engine_options(config):
+    """
+    Opzioni per create_engine() (SQLALCHEMY_ENGINE_OPTIONS) ricavate dalla configurazione.
+    Il database in memoria usa il pool predefinito di SQLAlchemy (una sola connessione condivisa).
+    """
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if is_sqlite_memory(uri):
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if is_sqlite(uri):
+        if config['DATABASE_PROFILE'] == 'production':
+            # Timeout del driver sqlite3 (secondi) allineato a busy_timeout (millisecondi)
+            options['connect_args'] = {'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000}
+    else:
+        # I server chiudono le connessioni inattive: si ricreano prima che scadano
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+        options['pool_pre_ping'] = True
+    return options
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Esegue i pragma su ogni nuova connessione dell'engine (solo per SQLite)."""
+    if not pragmas or engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def is_busy_error(error):
+    """True se l'errore indica un database bloccato da un'altra scrittura (SQLITE_BUSY/SQLITE_LOCKED)."""
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database is busy' in message or 'database table is locked' in message
+
+
+def run_in_transaction(session, work, retries=3, delay=0.05):
+    """
+    Esegue work() e fa commit. Se il database è occupato annulla la transazione, attende
+    (delay, poi il doppio, ...) e riprova tutto da capo, fino a 'retries' volte.
+    work() deve quindi poter essere ripetuta: va usata per transazioni brevi.
+    Restituisce il valore di work().
+    """
+    for attempt in range(retries + 1):
+        try:
+            result = work()
+            session.commit()
+            return result
+        except OperationalError as e:
+            session.rollback()
+            if attempt == retries or not is_busy_error(e):
+                raise
+            time.sleep(delay * 2 ** attempt)
+
+
+def insert_or_ignore(table, dialect_name):
+    """
+    INSERT che non fa nulla se la chiave esiste già (rowcount 0), in un'unica istruzione:
+    nessun IntegrityError quando due richieste inseriscono la stessa riga insieme.
+    """
+    if dialect_name == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect_name in ('mysql', 'mariadb'):
+        return insert(table).prefix_with('IGNORE')
+    return insert(table) # Altri database: un duplicato solleva IntegrityError
@@ -0,0 +1,137 @@
+# Richieste condizionali (ETag/Last-Modified), intestazioni Cache-Control e compressione dell'HTML
+#
+# Ogni pagina cacheabile ha un "validatore": una query leggera (date, contatori, timestamp di
+# modifica) che cambia quando cambia il contenuto. Se il browser o il proxy hanno già la versione
+# corrente (If-None-Match / If-Modified-Since) si risponde 304 senza eseguire la vista né il template.
+# If-Modified-Since vale solo per i validatori che forniscono una data: deve coprire tutto il contenuto
+# della pagina, altrimenti un client senza ETag riceverebbe 304 su una versione superata.
+# Le immagini caricate hanno nomi univoci (UUID): vengono servite come immutabili per un anno.
+# Con HTML_COMPRESSION le pagine HTML vengono compresse (gzip e/o brotli) una volta per versione.
+import functools
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import UTC
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+try:
+    import brotli
+except ImportError: # brotli non installato: resta disponibile solo gzip
+    brotli = None
+
+
+def compute_etag(parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class HttpCache:
+    """
+    Decoratore per le viste GET con validatore, più un hook per immagini caricate e compressione.
+
+    Il validatore restituisce (parti, ultima_modifica) oppure None se la pagina non va validata
+    (es. risultati di ricerca). ultima_modifica è None se nessuna data cambia con ogni parte della
+    pagina: si invia solo l'ETag e If-Modified-Since viene ignorato. L'ETag comprende anche endpoint, argomenti e stato di autenticazione,
+    come la chiave della cache delle pagine. Le risposte con messaggi flash non ricevono validatori.
+    """
+
+    def __init__(self, max_compressed=256):
+        self.max_compressed = max_compressed
+        self._compressed = OrderedDict() # (etag, codifica) -> corpo compresso
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.after_request(self._after_request)
+
+    def conditional(self, validator):
+        """validator: funzione che riceve gli argomenti della vista (vedi sopra)."""
+        def decorator(f):
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                return self.conditional_call(validator(**kwargs), lambda: f(*args, **kwargs))
+            return decorated_function
+        return decorator
+
+    def conditional_call(self, validation, render):
+        """Risponde 304 se il client ha la versione corrente, altrimenti render() con ETag e Last-Modified."""
+        if validation is None or not current_app.config['HTTP_CONDITIONAL_REQUESTS'] \
+                or request.method != 'GET' or session.get('_flashes'):
+            return render()
+        parts, last_modified = validation
+        if last_modified is not None and last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=UTC) # Le date salvate sono in UTC
+        # Il ruolo cambia i link mostrati (Modifica, Elimina, amministrazione)
+        auth_state = f'user:{current_user.id}:{int(current_user.is_admin)}' if current_user.is_authenticated else 'anon'
+        etag = compute_etag((
+            request.endpoint, sorted(request.view_args.items()), sorted(request.args.items(multi=True)), auth_state, parts
+        ))
+
+        if self._not_modified(etag, last_modified):
+            response = make_response('', 304)
+        else:
+            response = make_response(render())
+            if response.status_code != 200 or session.get('_flashes'):
+                return response
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # no-cache: si può conservare ma va rivalidata a ogni uso (con una richiesta condizionale)
+        response.headers['Cache-Control'] = ('private' if current_user.is_authenticated else 'public') + ', no-cache'
+        response.vary.add('Cookie')
+        return response
+
+    def _not_modified(self, etag, last_modified):
+        if request.if_none_match:
+            # Anche l'ETag di una versione compressa ("<etag>-gzip") indica la stessa versione
+            return any(request.if_none_match.contains_weak(candidate)
+                       for candidate in (etag, f'{etag}-gzip', f'{etag}-br'))
+        if last_modified is not None and request.if_modified_since is not None:
+            return last_modified.replace(microsecond=0) <= request.if_modified_since
+        return False
+
+    def _after_request(self, response):
+        if request.endpoint == 'static' and (request.view_args or {}).get('filename', '').startswith('uploads/'):
+            if response.status_code in (200, 304):
+                response.headers['Cache-Control'] = f"public, max-age={current_app.config['UPLOAD_CACHE_MAX_AGE']}, immutable"
+            return response
+        return self._compress_html(response)
+
+    def _compress_html(self, response):
+        encodings = [e for e in current_app.config['HTML_COMPRESSION'] if e != 'br' or brotli is not None]
+        if not encodings or response.mimetype != 'text/html' or response.status_code != 200 \
+                or response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(encodings)
+        body = response.get_data()
+        if encoding is None or len(body) < current_app.config['HTML_COMPRESSION_MIN_SIZE']:
+            return response
+
+        etag, _ = response.get_etag()
+        compressed = None
+        if etag:
+            # Stessa versione della pagina, stesso corpo: si comprime una volta sola
+            with self._lock:
+                compressed = self._compressed.get((etag, encoding))
+                if compressed is not None:
+                    self._compressed.move_to_end((etag, encoding))
+        if compressed is None:
+            compressed = _compress(body, encoding)
+            if etag:
+                with self._lock:
+                    self._compressed[(etag, encoding)] = compressed
+                    while len(self._compressed) > self.max_compressed:
+                        self._compressed.popitem(last=False)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            response.set_etag(f'{etag}-{encoding}')
+        return response
@@ -0,0 +1,147 @@
+# Pipeline per le immagini caricate: validazione del contenuto, varianti ridimensionate e WebP
+#
+# L'originale viene salvato subito nell'archivio dei file caricati (storage.py); le varianti
+# (es. 64, 320 e 800 px di larghezza) vengono generate fuori dalla richiesta dalla coda dei lavori.
+# I template scelgono la variante giusta con srcset, ripiegando sull'originale finché le varianti non esistono.
+import logging
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pillow non installato: niente varianti, solo controllo della firma del file
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Formati accettati (rilevati dal contenuto) ed estensione con cui vengono salvati
+IMAGE_FORMATS = {'PNG': 'png', 'JPEG': 'jpg', 'GIF': 'gif'}
+
+# Firme ("magic bytes") usate quando Pillow non è disponibile
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+
+# Limite di pixel per evitare "decompression bomb" (immagini piccole su disco ma enormi in memoria)
+MAX_IMAGE_PIXELS = 40_000_000
+
+
+class InvalidImageError(ValueError):
+    """Il file caricato non è un'immagine in un formato accettato."""
+
+
+def detect_format(stream):
+    """
+    Restituisce il formato dell'immagine ('PNG', 'JPEG', 'GIF') leggendone il contenuto.
+    Solleva InvalidImageError se il file non è un'immagine valida.
+    """
+    position = stream.tell()
+    try:
+        if Image is not None:
+            try:
+                with Image.open(stream) as image:
+                    image_format = image.format
+                    if image.width * image.height > MAX_IMAGE_PIXELS:
+                        raise InvalidImageError('Immagine troppo grande.')
+                    image.verify() # Controlla che i dati non siano troncati o corrotti
+            except InvalidImageError:
+                raise
+            except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+                raise InvalidImageError(f'Immagine non valida: {e}')
+        else:
+            header = stream.read(16)
+            image_format = next((fmt for signature, fmt in _SIGNATURES if header.startswith(signature)), None)
+    finally:
+        stream.seek(position)
+    if image_format not in IMAGE_FORMATS:
+        raise InvalidImageError(f'Formato non consentito: {image_format}')
+    return image_format
+
+
+def variant_name(filename, width, extension=None):
+    """Nome del file di una variante, es. 'abc.jpg' -> 'abc_320.jpg' (o 'abc_320.webp')."""
+    stem, original_extension = filename.rsplit('.', 1)
+    return f'{stem}_{width}.{extension or original_extension}'
+
+
+def is_variant(filename, widths):
+    """True se il file è una variante generata (usato dal backfill per saltarle)."""
+    stem = filename.rsplit('.', 1)[0]
+    return any(stem.endswith(f'_{width}') for width in widths)
+
+
+def generate_variants(upload_folder, filename, widths, webp=True, quality=82, overwrite=False, raise_errors=False):
+    """
+    Genera le varianti ridimensionate di un'immagine già salvata.
+    I metadati (EXIF, GPS, profili) non vengono copiati nelle varianti.
+    Restituisce il numero di file creati. Con raise_errors gli errori vengono propagati
+    (la coda dei lavori riprova), altrimenti solo stampati.
+    """
+    if Image is None:
+        return 0
+    source = os.path.join(upload_folder, filename)
+    created = 0
+    try:
+        with Image.open(source) as image:
+            image.seek(0) # Per le GIF animate si usa il primo fotogramma
+            # Applica la rotazione indicata nell'EXIF prima di eliminarlo
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'P') else 'RGB')
+            extension = filename.rsplit('.', 1)[1].lower()
+            for width in widths:
+                targets = [(variant_name(filename, width), extension)]
+                if webp:
+                    targets.append((variant_name(filename, width, 'webp'), 'webp'))
+                if not overwrite and all(os.path.exists(os.path.join(upload_folder, name)) for name, _ in targets):
+                    continue
+                resized = image.copy()
+                if resized.width > width: # Non si ingrandiscono le immagini piccole
+                    resized.thumbnail((width, width * 10), Image.LANCZOS)
+                for name, target_extension in targets:
+                    _save_variant(resized, os.path.join(upload_folder, name), target_extension, quality)
+                    created += 1
+    except Exception:
+        if raise_errors:
+            raise
+        logger.exception("Errore durante la generazione delle varianti di %s", filename)
+    return created
+
+
+def _save_variant(image, path, extension, quality):
+    # Scrive su un file temporaneo e lo rinomina: chi legge non vede mai un file a metà
+    tmp_path = path + '.tmp'
+    if extension == 'webp':
+        image.save(tmp_path, 'WEBP', quality=quality, method=4)
+    elif extension == 'jpg':
+        image.convert('RGB').save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+    elif extension == 'png':
+        image.save(tmp_path, 'PNG', optimize=True)
+    else:
+        image.save(tmp_path, 'GIF')
+    os.replace(tmp_path, path)
+
+
+def existing_variants(upload_folder, filename, widths, webp=True):
+    """
+    Restituisce [(larghezza, nome_variante, nome_webp_o_None)] per le varianti già presenti su disco.
+    """
+    variants = []
+    for width in widths:
+        name = variant_name(filename, width)
+        if os.path.exists(os.path.join(upload_folder, name)):
+            webp_name = variant_name(filename, width, 'webp') if webp else None
+            if webp_name and not os.path.exists(os.path.join(upload_folder, webp_name)):
+                webp_name = None
+            variants.append((width, name, webp_name))
+    return variants
+
+
+def variant_names(filename, widths):
+    """Nomi di tutte le varianti possibili di un'immagine (da eliminare insieme all'originale)."""
+    names = []
+    for width in widths:
+        names += [variant_name(filename, width), variant_name(filename, width, 'webp')]
+    return names
@@ -0,0 +1,302 @@
+# Coda di lavori in background, persistente in una tabella del database
+#
+# Le viste accodano il lavoro lento (eliminazione di file, varianti delle immagini, indice di
+# ricerca, visualizzazioni non scritte) e rispondono subito. I lavori restano nella tabella 'job'
+# finché non vengono eseguiti: se il processo si ferma, ripartono al riavvio o da un altro worker.
+# Un lavoro fallito viene riprovato con attesa crescente (retry_delay, poi il doppio, ...) fino a
+# 'max_attempts' tentativi, poi resta 'failed' con l'ultimo errore.
+#
+# Modalità (JOBS_MODE):
+# - 'thread': i lavori vengono eseguiti da thread nel processo web (predefinita)
+# - 'worker': il processo web accoda soltanto; li esegue 'flask jobs-worker' in un processo separato
+# - 'inline': eseguiti subito, nella richiesta stessa (test e sviluppo)
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from sqlalchemy import (
+    Column,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    delete,
+    func,
+    insert,
+    select,
+    update,
+)
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+metadata = MetaData()
+
+job_table = Table(
+    'job', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('payload', Text, nullable=False),
+    Column('status', String(10), nullable=False, default=PENDING),
+    Column('attempts', Integer, nullable=False, default=0),
+    Column('max_attempts', Integer, nullable=False),
+    Column('run_at', Float, nullable=False), # Timestamp UNIX dal quale il lavoro può partire
+    Column('locked_by', String(100), nullable=True),
+    Column('locked_at', Float, nullable=True),
+    Column('last_error', Text, nullable=True),
+    Column('created_at', Float, nullable=False),
+    # I worker cercano i lavori pronti in ordine di run_at
+    Index('ix_job_status_run_at', 'status', 'run_at'),
+)
+
+
+class TaskRegistry:
+    """Lavori registrati con il decoratore task: le code di più app possono condividere lo stesso registro."""
+
+    def __init__(self):
+        self.tasks = {} # nome -> (funzione, max_attempts)
+
+    def task(self, name=None, max_attempts=5):
+        """Decoratore che registra una funzione come lavoro; gli argomenti devono essere serializzabili in JSON."""
+        def decorator(f):
+            self.tasks[name or f.__name__] = (f, max_attempts)
+            return f
+        return decorator
+
+
+class JobQueue:
+    """
+    Registro dei lavori (decoratore task) e loro esecuzione.
+
+    workers:       thread che eseguono i lavori (modalità 'thread' e 'flask jobs-worker').
+    poll_interval: secondi tra due controlli della tabella quando non ci sono lavori.
+    retry_delay:   attesa prima del secondo tentativo; raddoppia a ogni fallimento.
+    stale_timeout: un lavoro 'running' da più di questi secondi (processo terminato a metà)
+                   torna 'pending'.
+    registry:      TaskRegistry con i lavori (predefinito: uno nuovo, usato solo da questa coda).
+    """
+
+    def __init__(self, workers=2, poll_interval=1.0, retry_delay=5.0, stale_timeout=300, registry=None):
+        self.mode = 'thread'
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.stale_timeout = stale_timeout
+        self.keep_done = False
+        self.registry = registry if registry is not None else TaskRegistry()
+        self._tasks = self.registry.tasks
+        self._app = None
+        self._engine = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+        self._inline = threading.local()
+
+    def init_app(self, app, engine):
+        self.mode = app.config['JOBS_MODE']
+        self.workers = app.config['JOBS_WORKERS']
+        self.poll_interval = app.config['JOBS_POLL_INTERVAL']
+        self.retry_delay = app.config['JOBS_RETRY_DELAY']
+        self.stale_timeout = app.config['JOBS_STALE_TIMEOUT']
+        self.keep_done = app.config['JOBS_KEEP_DONE']
+        self._app = app
+        self._engine = engine
+        app.extensions['job_queue'] = self
+        if self.mode == 'thread':
+            # Così anche i lavori rimasti in coda da un'esecuzione precedente partono senza attendere il prossimo
+            app.before_request(self.ensure_started)
+
+    def create_table(self):
+        metadata.create_all(self._engine)
+
+    def task(self, name=None, max_attempts=5):
+        """Come TaskRegistry.task, sul registro di questa coda."""
+        return self.registry.task(name, max_attempts)
+
+    # --- Accodamento ---
+    def enqueue(self, name, delay=0, **payload):
+        """
+        Accoda un lavoro e restituisce il suo id. Va chiamata dopo il commit dei dati che il
+        lavoro legge: il lavoro può partire subito, in un'altra transazione.
+        """
+        if name not in self._tasks:
+            raise KeyError(f'Lavoro non registrato: {name}')
+        now = time.time()
+        with self._engine.begin() as conn:
+            job_id = conn.execute(insert(job_table).values(
+                name=name, payload=json.dumps(payload), status=PENDING, attempts=0,
+                max_attempts=self._tasks[name][1], run_at=now + delay, created_at=now
+            )).inserted_primary_key[0]
+        if self.mode == 'inline':
+            if not getattr(self._inline, 'running', False): # Un lavoro che ne accoda altri non si annida
+                self._inline.running = True
+                try:
+                    self.run_pending()
+                finally:
+                    self._inline.running = False
+        elif self.mode == 'thread':
+            self.ensure_started()
+            self._wakeup.set()
+        return job_id
+
+    def schedule(self, name, delay=0, **payload):
+        """
+        Accoda il lavoro solo se non ce n'è già uno in attesa con lo stesso nome e restituisce il suo
+        id (None se c'era già). Un lavoro periodico la chiama alla fine per programmare il successivo.
+        """
+        with self._engine.connect() as conn:
+            waiting = conn.execute(
+                select(job_table.c.id).where(job_table.c.name == name, job_table.c.status == PENDING).limit(1)
+            ).first()
+        if waiting is not None:
+            return None
+        return self.enqueue(name, delay, **payload)
+
+    # --- Esecuzione ---
+    def claim(self, worker_id):
+        """Prende in carico il prossimo lavoro pronto; restituisce la riga come dizionario o None."""
+        now = time.time()
+        with self._engine.begin() as conn:
+            candidates = conn.execute(
+                select(job_table.c.id).where(job_table.c.status == PENDING, job_table.c.run_at <= now)
+                .order_by(job_table.c.run_at, job_table.c.id).limit(10)
+            ).scalars().all()
+        for job_id in candidates:
+            with self._engine.begin() as conn:
+                # Il controllo sullo stato rende la presa in carico atomica tra più worker
+                claimed = conn.execute(
+                    update(job_table).where(job_table.c.id == job_id, job_table.c.status == PENDING)
+                    .values(status=RUNNING, locked_by=worker_id, locked_at=now, attempts=job_table.c.attempts + 1)
+                ).rowcount
+                if claimed:
+                    return dict(conn.execute(select(job_table).where(job_table.c.id == job_id)).mappings().one())
+        return None
+
+    def execute(self, job):
+        """Esegue un lavoro preso in carico; restituisce True se è andato a buon fine."""
+        function = self._tasks.get(job['name'], (None, None))[0]
+        try:
+            if function is None:
+                raise LookupError(f"Lavoro non registrato: {job['name']}")
+            with self._app.app_context():
+                function(**json.loads(job['payload']))
+        except Exception as e: # noqa: BLE001 - un lavoro fallito viene ritentato, non ferma il worker
+            self._failed(job, e)
+            return False
+        with self._engine.begin() as conn:
+            if self.keep_done:
+                conn.execute(update(job_table).where(job_table.c.id == job['id'])
+                             .values(status=DONE, locked_by=None, last_error=None))
+            else:
+                conn.execute(delete(job_table).where(job_table.c.id == job['id']))
+        return True
+
+    def _failed(self, job, error):
+        attempts = job['attempts']
+        values = {'locked_by': None, 'last_error': f'{type(error).__name__}: {error}'}
+        if attempts >= job['max_attempts']:
+            values['status'] = FAILED
+            logger.error("Lavoro %s #%s fallito definitivamente dopo %s tentativi: %s", job['name'], job['id'], attempts, error)
+        else:
+            values.update(status=PENDING, run_at=time.time() + self.retry_delay * 2 ** (attempts - 1))
+        with self._engine.begin() as conn:
+            conn.execute(update(job_table).where(job_table.c.id == job['id']).values(**values))
+
+    def run_pending(self, limit=None, worker_id=None):
+        """Esegue i lavori pronti (al massimo 'limit'); restituisce quanti ne ha eseguiti."""
+        worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+        processed = 0
+        while limit is None or processed < limit:
+            job = self.claim(worker_id)
+            if job is None:
+                break
+            self.execute(job)
+            processed += 1
+        return processed
+
+    def recover_stale(self):
+        """
+        Rimette in coda i lavori rimasti 'running' da un processo che si è fermato a metà; quelli che
+        hanno già usato tutti i tentativi (es. un lavoro che fa terminare il processo) diventano 'failed'.
+        Restituisce i lavori rimessi in coda.
+        """
+        stale = (job_table.c.status == RUNNING, job_table.c.locked_at < time.time() - self.stale_timeout)
+        with self._engine.begin() as conn:
+            failed = conn.execute(
+                update(job_table).where(*stale, job_table.c.attempts >= job_table.c.max_attempts)
+                .values(status=FAILED, locked_by=None, last_error='Interrotto: il processo si è fermato durante il lavoro')
+            ).rowcount
+            if failed:
+                logger.error("%s lavori interrotti falliti definitivamente dopo l'ultimo tentativo", failed)
+            return conn.execute(update(job_table).where(*stale).values(status=PENDING, locked_by=None)).rowcount
+
+    def work(self, stop_event):
+        """Ciclo di un worker: esegue i lavori pronti e attende quando non ce ne sono."""
+        while not stop_event.is_set():
+            try:
+                if self.run_pending(limit=10):
+                    continue
+            except Exception: # Es. database temporaneamente bloccato: si riprova al giro successivo
+                logger.exception("Errore della coda dei lavori")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def ensure_started(self):
+        """
+        Avvia i thread dei worker nel processo corrente, al primo lavoro o alla prima richiesta
+        (una volta per processo, come ViewCounter: funziona anche con 'gunicorn --preload').
+        """
+        if self.mode != 'thread' or self._app is None or self._thread_pid == os.getpid():
+            return # Già avviati in questo processo (o fermati all'uscita: non si riavviano)
+        with self._start_lock:
+            if self._thread_pid == os.getpid():
+                return
+            if self._thread_pid is None:
+                atexit.register(self.stop)
+            self._stop.clear()
+            self._thread_pid = os.getpid()
+            try: # Una volta per processo, non per ogni thread (jobs-worker la chiama da sé)
+                self.recover_stale()
+            except Exception:
+                logger.exception("Errore della coda dei lavori")
+            self._threads = [
+                threading.Thread(target=self.work, args=(self._stop,), name=f'job-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread_pid == os.getpid():
+            for thread in self._threads:
+                thread.join(timeout=timeout)
+        self._threads = []
+
+    # --- Amministrazione ---
+    def stats(self):
+        with self._engine.connect() as conn:
+            rows = conn.execute(select(job_table.c.status, func.count()).group_by(job_table.c.status)).all()
+        return {status: count for status, count in rows}
+
+    def retry_failed(self):
+        """Rimette in coda i lavori falliti definitivamente, con i tentativi azzerati."""
+        with self._engine.begin() as conn:
+            return conn.execute(
+                update(job_table).where(job_table.c.status == FAILED)
+                .values(status=PENDING, attempts=0, run_at=time.time())
+            ).rowcount
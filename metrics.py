@@ -0,0 +1,212 @@
+# Strumentazione opzionale: tempi delle rotte, query SQL, rendering dei template e chatbot
+#
+# Attiva solo con METRICS_ENABLED: da spenta non registra hook né listener e non costa nulla.
+# I valori sono istogrammi in memoria, per processo (ogni worker gunicorn ha i suoi), esposti
+# in JSON o nel formato testuale di Prometheus dalla rotta /admin/metrics.
+# Con METRICS_PROFILE_SAMPLE_RATE > 0 una parte delle richieste viene profilata con cProfile
+# e il profilo viene salvato su file se la richiesta supera METRICS_PROFILE_THRESHOLD secondi.
+import bisect
+import cProfile
+import os
+import random
+import threading
+import time
+
+from flask import (
+    before_render_template,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+
+# Limiti superiori dei bucket degli istogrammi
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+CHATBOT_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# Nome -> (descrizione, bucket, nomi delle etichette)
+FAMILIES = {
+    'http_request_duration_seconds': ('Durata delle richieste per endpoint', SECONDS_BUCKETS, ('endpoint', 'method')),
+    'sql_queries_per_request': ('Query SQL eseguite per richiesta', COUNT_BUCKETS, ('endpoint',)),
+    'sql_duration_seconds_per_request': ('Tempo totale delle query SQL per richiesta', SECONDS_BUCKETS, ('endpoint',)),
+    'template_render_seconds': ('Tempo di rendering dei template', SECONDS_BUCKETS, ('template',)),
+    'chatbot_upstream_seconds': ('Durata delle chiamate al modello del chatbot', CHATBOT_BUCKETS, ('outcome',)),
+}
+
+
+class Histogram:
+    """Istogramma a bucket fissi (conteggi non cumulativi; lo diventano nell'esportazione)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # L'ultimo è +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Raccolta delle metriche del processo; si collega all'app con init_app()."""
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_sample_rate = 0.0
+        self.profile_threshold = 1.0
+        self.profile_dir = None
+        self.profiles_saved = 0
+        self._histograms = {} # (nome, valori delle etichette) -> Histogram
+        self._lock = threading.Lock()
+
+    def init_app(self, app, engine):
+        """Registra hook e listener solo se METRICS_ENABLED è attivo."""
+        self.enabled = app.config['METRICS_ENABLED']
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        self.profile_sample_rate = app.config['METRICS_PROFILE_SAMPLE_RATE']
+        self.profile_threshold = app.config['METRICS_PROFILE_THRESHOLD']
+        self.profile_dir = app.config['METRICS_PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # --- Registrazione dei valori ---
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        _, buckets, label_names = FAMILIES[name]
+        key = (name, tuple(str(labels.get(label, '')) for label in label_names))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def observe_chatbot(self, seconds, outcome):
+        """Callback per ChatService: durata di una chiamata al modello ed esito ('ok', 'error', 'cancelled')."""
+        self.observe('chatbot_upstream_seconds', seconds, outcome=outcome)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    # --- Hook delle richieste ---
+    def _before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_time = 0.0
+        if self.profile_sample_rate and random.random() < self.profile_sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError: # Un altro profiler è già attivo in questo thread
+                return
+            g.metrics_profiler = profiler
+
+    def _after_request(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+        endpoint = request.endpoint or 'unknown'
+        self.observe('http_request_duration_seconds', duration, endpoint=endpoint, method=request.method)
+        self.observe('sql_queries_per_request', g.get('metrics_sql_count', 0), endpoint=endpoint)
+        self.observe('sql_duration_seconds_per_request', g.get('metrics_sql_time', 0.0), endpoint=endpoint)
+
+        profiler = g.pop('metrics_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            if duration >= self.profile_threshold:
+                self._save_profile(profiler, endpoint, duration)
+        return response
+
+    def _save_profile(self, profiler, endpoint, duration):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        filename = f"{endpoint.replace('.', '_')}-{time.strftime('%Y%m%d-%H%M%S')}-{int(duration * 1000)}ms-{os.getpid()}.prof"
+        profiler.dump_stats(os.path.join(self.profile_dir, filename))
+        self.profiles_saved += 1
+
+    # --- Template ---
+    def _before_render(self, sender, template, context, **extra):
+        g.setdefault('metrics_render_started', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        starts = g.get('metrics_render_started')
+        if starts:
+            self.observe('template_render_seconds', time.perf_counter() - starts.pop(), template=template.name)
+
+    # --- Query SQL ---
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_started')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if has_request_context() and 'metrics_sql_count' in g:
+            g.metrics_sql_count += 1
+            g.metrics_sql_time += elapsed
+
+    # --- Esportazione ---
+    def snapshot(self):
+        """Le metriche come dizionario (per la risposta JSON)."""
+        result = {}
+        with self._lock:
+            for (name, label_values), histogram in sorted(self._histograms.items()):
+                labels = dict(zip(FAMILIES[name][2], label_values))
+                result.setdefault(name, []).append({
+                    'labels': labels,
+                    'count': histogram.count,
+                    'sum': round(histogram.sum, 6),
+                    'mean': round(histogram.sum / histogram.count, 6) if histogram.count else 0.0,
+                    'buckets': {_format_bound(bound): total for bound, total in histogram.cumulative()},
+                })
+        result['profiles_saved'] = self.profiles_saved
+        return result
+
+    def prometheus(self):
+        """Le metriche nel formato testuale di Prometheus (versione 0.0.4)."""
+        lines = []
+        with self._lock:
+            items = sorted(self._histograms.items())
+            for name, (description, _, label_names) in FAMILIES.items():
+                family = [(values, h) for (n, values), h in items if n == name]
+                if not family:
+                    continue
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for label_values, histogram in family:
+                    labels = ','.join(f'{label}="{_escape(value)}"' for label, value in zip(label_names, label_values))
+                    for bound, total in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{_format_bound(bound)}"}} {total}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
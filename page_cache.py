@@ -0,0 +1,254 @@
+# Cache delle pagine renderizzate con scadenza (TTL), eviction LRU e invalidazione per tag
+#
+# Due backend:
+# - MemoryCache: dizionario nel processo, il più veloce ma non condiviso tra i worker
+# - SQLiteCache: file SQLite condiviso da tutti i worker gunicorn della stessa macchina
+# Ogni pagina salvata ha dei tag (es. "article:5"); le rotte che modificano i dati
+# invalidano i tag interessati e tutte le varianti della pagina vengono eliminate.
+import functools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, make_response, message_flashed, request, session
+from flask_login import current_user
+
+
+class MemoryCache:
+    """Backend in memoria, con LRU tramite OrderedDict."""
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # chiave -> (scadenza, valore, tag)
+        self._tags = {} # tag -> insieme di chiavi
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl, tags=()):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class SQLiteCache:
+    """
+    Backend su file SQLite, condivisibile tra processi.
+    L'ultimo accesso viene aggiornato al massimo una volta ogni 'touch_interval'
+    secondi per voce, così le letture non diventano una scrittura ciascuna.
+    """
+
+    def __init__(self, path, max_entries=1000, touch_interval=10):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self._schema_pid = None # Processo in cui lo schema è già stato controllato
+
+    def _conn(self):
+        """
+        Una connessione per thread e per processo, aperta al primo uso: sqlite3 non condivide le
+        connessioni tra thread, e una connessione aperta prima di un fork (gunicorn --preload)
+        non va usata dal processo figlio. Alla prima connessione del processo crea lo schema.
+        """
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) == pid:
+            return self._local.conn
+        if self._schema_pid != pid:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if self._schema_pid != pid:
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS page_cache ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS ix_page_cache_accessed ON page_cache (accessed);"
+                "CREATE TABLE IF NOT EXISTS page_cache_tag (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key));"
+                "CREATE INDEX IF NOT EXISTS ix_page_cache_tag_key ON page_cache_tag (key);"
+            )
+            self._schema_pid = pid
+        # Quella ereditata dal processo padre resta in memoria ma non viene più usata né chiusa
+        self._local.inherited = getattr(self._local, 'conn', None)
+        self._local.conn, self._local.pid = conn, pid
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires, accessed FROM page_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires, accessed = row
+        if expires <= now:
+            self._delete_keys(conn, [key])
+            return None
+        if now - accessed > self.touch_interval:
+            conn.execute("UPDATE page_cache SET accessed = ? WHERE key = ?", (now, key))
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl, tags=()):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM page_cache_tag WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT OR REPLACE INTO page_cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now + ttl, now)
+            )
+            conn.executemany("INSERT OR IGNORE INTO page_cache_tag (tag, key) VALUES (?, ?)", [(tag, key) for tag in tags])
+            # Eviction LRU: elimina le voci scadute e quelle usate meno di recente oltre il limite
+            (count,) = conn.execute("SELECT COUNT(*) FROM page_cache").fetchone()
+            if count > self.max_entries:
+                conn.execute("DELETE FROM page_cache WHERE expires <= ?", (now,))
+                conn.execute(
+                    "DELETE FROM page_cache WHERE key IN ("
+                    " SELECT key FROM page_cache ORDER BY accessed LIMIT max(0, (SELECT COUNT(*) FROM page_cache) - ?))",
+                    (self.max_entries,)
+                )
+                conn.execute("DELETE FROM page_cache_tag WHERE key NOT IN (SELECT key FROM page_cache)")
+
+    def invalidate(self, *tags):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for tag in tags:
+                keys = [row[0] for row in conn.execute("SELECT key FROM page_cache_tag WHERE tag = ?", (tag,))]
+                self._delete_keys(conn, keys)
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM page_cache")
+            conn.execute("DELETE FROM page_cache_tag")
+
+    @staticmethod
+    def _delete_keys(conn, keys):
+        conn.executemany("DELETE FROM page_cache WHERE key = ?", [(key,) for key in keys])
+        conn.executemany("DELETE FROM page_cache_tag WHERE key = ?", [(key,) for key in keys])
+
+
+def create_backend(config):
+    """Crea il backend scelto in configurazione (PAGE_CACHE_BACKEND), o None se la cache è disattivata."""
+    backend = config['PAGE_CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryCache(max_entries=config['PAGE_CACHE_MAX_ENTRIES'])
+    if backend == 'sqlite':
+        return SQLiteCache(config['PAGE_CACHE_PATH'], max_entries=config['PAGE_CACHE_MAX_ENTRIES'])
+    return None
+
+
+class PageCache:
+    """
+    Decoratore per le viste GET: salva il corpo della risposta e lo riusa finché
+    non scade o non viene invalidato.
+
+    La chiave comprende endpoint, argomenti dell'URL e stato di autenticazione
+    (anonimo oppure id utente), così i pulsanti personali (Mi Piace, Modifica)
+    restano corretti. Le risposte con messaggi flash non vengono né servite dalla
+    cache né salvate.
+    """
+
+    def init_app(self, app):
+        app.extensions['page_cache'] = create_backend(app.config)
+        # Segnala quando una vista chiama flash(): quella risposta non va salvata
+        message_flashed.connect(self._on_flash, app)
+
+    @property
+    def backend(self):
+        """Il backend dell'app corrente (None se la cache è disattivata)."""
+        return current_app.extensions.get('page_cache')
+
+    @staticmethod
+    def _on_flash(sender, message, category):
+        g.page_cache_flashed = True
+
+    def cache_key(self):
+        if current_user.is_authenticated:
+            auth_state = f'user:{current_user.id}:{int(current_user.is_admin)}' # Il ruolo cambia i link mostrati
+        else:
+            auth_state = 'anon'
+        args = '&'.join(f'{k}={v}' for k, v in sorted(request.args.items(multi=True)))
+        return f'{request.endpoint}|{sorted(request.view_args.items())}|{args}|{auth_state}'
+
+    def cached(self, tags, ttl=None):
+        """
+        tags: funzione che riceve gli argomenti della vista e restituisce la lista dei tag.
+        """
+        def decorator(f):
+            @functools.wraps(f)
+            def decorated_function(*args, **kwargs):
+                return self.cached_call(tags(**kwargs), lambda: f(*args, **kwargs), ttl=ttl)
+            return decorated_function
+        return decorator
+
+    def cached_call(self, tags, render, ttl=None):
+        """Restituisce la risposta dalla cache oppure la genera con render() e la salva."""
+        backend = self.backend
+        if backend is None or request.method != 'GET' or session.get('_flashes'):
+            return render()
+
+        key = self.cache_key()
+        cached = backend.get(key)
+        if cached is not None:
+            body, status, mimetype = cached
+            response = make_response(body, status)
+            response.mimetype = mimetype
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        response = make_response(render())
+        if response.status_code == 200 and not response.direct_passthrough and not g.get('page_cache_flashed'):
+            backend.set(key, (response.get_data(), response.status_code, response.mimetype),
+                             ttl or current_app.config['PAGE_CACHE_TTL'], tags)
+            response.headers['X-Cache'] = 'MISS'
+        return response
+
+    def invalidate(self, *tags):
+        if self.backend is not None:
+            self.backend.invalidate(*tags)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
@@ -0,0 +1,159 @@
+# Paginazione a cursore (keyset) e cache dei conteggi totali
+#
+# Invece di OFFSET (page-1)*per_page, che costringe il database a scorrere tutte le
+# righe precedenti, ogni pagina parte dalla coppia (pub_date, id) dell'ultimo elemento
+# mostrato e sfrutta un indice composto su quelle colonne.
+import base64
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import String, tuple_, type_coerce
+
+
+class KeysetPagination:
+    """Una pagina di risultati con i cursori per la pagina successiva e precedente."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor # Elementi più vecchi
+        self.prev_cursor = prev_cursor # Elementi più recenti
+        self.total = total # None se il conteggio esatto è disattivato
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def encode_cursor(date_value, item_id):
+    """Codifica (data, id) in una stringa opaca da usare nell'URL."""
+    raw = f'{date_value}|{item_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decodifica un cursore; restituisce None se non è valido (si riparte dalla prima pagina)."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_value, item_id = base64.urlsafe_b64decode(padded.encode()).decode().rsplit('|', 1)
+        return date_value, int(item_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_paginate(query, date_column, id_column, per_page, after=None, before=None, total=None):
+    """
+    Pagina una query in ordine decrescente di (date_column, id_column).
+
+    after:  cursore dell'ultimo elemento visto -> elementi più vecchi
+    before: cursore del primo elemento visto -> elementi più recenti
+    La query non deve avere già un ORDER BY. Si legge una riga in più del necessario
+    per sapere se esiste una pagina successiva, senza COUNT(*).
+    """
+    # Su SQLite le date sono testo: confrontiamo il valore grezzo memorizzato, così
+    # l'uguaglianza è esatta anche tra formati con e senza microsecondi
+    raw_dates = query.session.get_bind().dialect.name == 'sqlite'
+    date_key = type_coerce(date_column, String) if raw_dates else date_column
+    query = query.add_columns(date_key.label('cursor_date'))
+
+    def bound(cursor):
+        date_value, item_id = cursor
+        if not raw_dates:
+            date_value = datetime.fromisoformat(date_value)
+        return tuple_(date_key, id_column), (date_value, item_id)
+
+    before_key = decode_cursor(before)
+    after_key = decode_cursor(after)
+    if before_key:
+        key, value = bound(before_key)
+        rows = query.filter(key > value).order_by(date_column.asc(), id_column.asc()).limit(per_page + 1).all()
+        has_more_recent = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        has_older = True
+    else:
+        if after_key:
+            key, value = bound(after_key)
+            query = query.filter(key < value)
+        rows = query.order_by(date_column.desc(), id_column.desc()).limit(per_page + 1).all()
+        has_older = len(rows) > per_page
+        rows = rows[:per_page]
+        has_more_recent = after_key is not None
+
+    def cursor_for(row):
+        item = row[0]
+        return encode_cursor(row.cursor_date, getattr(item, id_column.key))
+
+    items = [row[0] for row in rows]
+    next_cursor = cursor_for(rows[-1]) if rows and has_older else None
+    prev_cursor = cursor_for(rows[0]) if rows and has_more_recent else None
+    return KeysetPagination(items, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor, total=total)
+
+
+def id_paginate(query, id_column, per_page, after=None, before=None):
+    """
+    Pagina una query in ordine crescente di id, con l'id (intero) come cursore.
+    after: id dell'ultimo elemento visto -> pagina successiva; before: id del primo -> precedente.
+    Gli elementi sono le righe della query come tuple (es. (utente, articoli, commenti)).
+    """
+    query = query.add_columns(id_column.label('cursor_id'))
+    if before is not None:
+        rows = query.filter(id_column < before).order_by(id_column.desc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after is not None:
+            query = query.filter(id_column > after)
+        rows = query.order_by(id_column.asc()).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_prev = after is not None
+
+    items = [tuple(row)[:-1] for row in rows]
+    next_cursor = rows[-1].cursor_id if rows and has_next else None
+    prev_cursor = rows[0].cursor_id if rows and has_prev else None
+    return KeysetPagination(items, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+class CountCache:
+    """
+    Cache dei conteggi totali (COUNT(*)) con scadenza e numero massimo di voci.
+    Evita di ricalcolare il totale dei risultati a ogni cambio di pagina.
+    """
+
+    def __init__(self, ttl=60, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                return entry[1]
+        value = compute()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """Svuota la cache (chiamato quando articoli o commenti vengono creati/eliminati)."""
+        with self._lock:
+            self._entries.clear()
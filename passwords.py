@@ -0,0 +1,150 @@
+# Hash delle password su un pool limitato e limitazione dei tentativi di accesso falliti
+#
+# Il calcolo dell'hash (scrypt/PBKDF2) è volutamente pesante: eseguito direttamente nelle viste,
+# una raffica di login occuperebbe tutti i worker. Qui gira su un pool di thread con un numero
+# massimo di calcoli contemporanei (hashlib rilascia il GIL durante il calcolo); chi non trova
+# posto entro 'queue_timeout' secondi riceve PasswordHasherBusyError.
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusyError(Exception):
+    """Troppi calcoli di hash in corso: la richiesta non ha ottenuto uno slot in tempo."""
+
+
+class PasswordHasher:
+    """
+    Calcola e verifica gli hash delle password su un pool di thread limitato.
+
+    method:         metodo di werkzeug, es. 'scrypt' o 'pbkdf2:sha256:600000'. Cambiandolo, gli
+                    hash esistenti vengono ricalcolati al login successivo (vedi needs_rehash).
+    max_concurrent: calcoli di hash contemporanei al massimo.
+    queue_timeout:  secondi di attesa per uno slot libero.
+    """
+
+    def __init__(self, method='scrypt', max_concurrent=2, queue_timeout=5.0):
+        self._configure(method, max_concurrent, queue_timeout)
+
+    def init_app(self, app):
+        self._configure(
+            app.config['PASSWORD_HASH_METHOD'],
+            app.config['PASSWORD_HASH_MAX_CONCURRENT'],
+            app.config['PASSWORD_HASH_QUEUE_TIMEOUT']
+        )
+        app.extensions['password_hasher'] = self
+
+    def _configure(self, method, max_concurrent, queue_timeout):
+        self.method = method
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._executor = None # Creato al primo hash
+        self._executor_lock = threading.Lock()
+        self._prefix = None
+
+    def _submit(self, function, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise PasswordHasherBusyError('Troppe richieste di accesso, riprova tra poco.')
+        try:
+            if self._executor is None:
+                with self._executor_lock:
+                    if self._executor is None:
+                        self._executor = ThreadPoolExecutor(self.max_concurrent, thread_name_prefix='password-hash')
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._submit(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True se l'hash è stato calcolato con un metodo o un costo diverso da quello configurato."""
+        if self._prefix is None:
+            # Il prefisso ("scrypt:32768:8:1", "pbkdf2:sha256:600000") contiene i parametri effettivi
+            self._prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return password_hash.split('$', 1)[0] != self._prefix
+
+
+class LoginThrottle:
+    """
+    Limita i tentativi di accesso falliti per nome utente e per indirizzo IP in una finestra
+    scorrevole di 'window' secondi. Superato il limite, i tentativi vengono respinti senza
+    calcolare l'hash, finché i fallimenti più vecchi non escono dalla finestra.
+    I contatori sono in memoria, per processo, con al massimo 'max_keys' chiavi.
+    """
+
+    def __init__(self, max_per_user=5, max_per_ip=20, window=300, max_keys=10000):
+        self.max_per_user = max_per_user
+        self.max_per_ip = max_per_ip
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = OrderedDict() # chiave -> deque di timestamp
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_per_user = app.config['LOGIN_MAX_FAILURES_PER_USER']
+        self.max_per_ip = app.config['LOGIN_MAX_FAILURES_PER_IP']
+        self.window = app.config['LOGIN_FAILURE_WINDOW']
+        app.extensions['login_throttle'] = self
+
+    def _keys(self, username, ip):
+        return ((f'user:{username.lower()}', self.max_per_user), (f'ip:{ip}', self.max_per_ip))
+
+    def _retry_after(self, username, ip, now):
+        # Da chiamare con il lock preso
+        wait = 0.0
+        for key, limit in self._keys(username, ip):
+            failures = self._failures.get(key)
+            if not failures:
+                continue
+            while failures and failures[0] <= now - self.window:
+                failures.popleft()
+            if len(failures) >= limit:
+                wait = max(wait, failures[len(failures) - limit] + self.window - now)
+        return wait
+
+    def retry_after(self, username, ip):
+        """Secondi da attendere prima di poter riprovare (0 se il tentativo è consentito)."""
+        with self._lock:
+            return self._retry_after(username, ip, time.monotonic())
+
+    def try_acquire(self, username, ip):
+        """
+        Registra il tentativo come fallito prima di calcolare l'hash, nello stesso lock del controllo:
+        tentativi in parallelo non superano il limite. Restituisce (tentativo, 0) oppure (None, secondi
+        da attendere); un tentativo riuscito (o non valutato) va restituito con release().
+        """
+        now = time.monotonic()
+        with self._lock:
+            wait = self._retry_after(username, ip, now)
+            if wait:
+                return None, wait
+            for key, limit in self._keys(username, ip):
+                failures = self._failures.get(key)
+                if failures is None:
+                    failures = self._failures[key] = deque(maxlen=limit)
+                failures.append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+        return now, 0
+
+    def release(self, username, ip, attempt):
+        """Toglie un tentativo registrato da try_acquire() (accesso riuscito o hash non calcolato)."""
+        with self._lock:
+            for key, _ in self._keys(username, ip):
+                failures = self._failures.get(key)
+                if failures is not None and attempt in failures:
+                    failures.remove(attempt)
+
+    def reset(self, username):
+        """Azzera i fallimenti del nome utente dopo un accesso riuscito."""
+        with self._lock:
+            self._failures.pop(f'user:{username.lower()}', None)
@@ -0,0 +1,273 @@
+# Classifiche degli articoli: "di tendenza" (punteggio che decade nel tempo), più visti e più apprezzati
+#
+# Il punteggio di tendenza non viene calcolato alla lettura: sta nella tabella 'article_rank',
+# indicizzata per (punteggio, id), e viene aggiornato in modo incrementale:
+# - ogni like, commento e blocco di visualizzazioni aggiunge il suo peso nella stessa transazione
+#   (un like tolto o un commento eliminato sottrae il peso che avrebbe oggi);
+# - periodicamente (lavoro 'refresh_rankings') tutti i punteggi vengono moltiplicati per
+#   0.5 ** (tempo trascorso / half_life): il decadimento esponenziale non cambia l'ordine tra
+#   articoli senza nuove interazioni, quindi basta applicarlo ogni tanto con un solo UPDATE.
+# 'flask rebuild-rankings' ricalcola tutto da capo dai like, dai commenti e dalle visualizzazioni.
+# Le prime pagine di ogni classifica vengono servite da una cache in memoria dei primi 'top_k'.
+import bisect
+import threading
+import time
+from datetime import UTC, datetime
+
+from sqlalchemy import (
+    Column,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    insert,
+    select,
+    text,
+    tuple_,
+    update,
+)
+
+import database
+from pagination import KeysetPagination, decode_cursor, encode_cursor
+
+RANK_TABLE = 'article_rank'
+
+metadata = MetaData()
+
+rank_table = Table(
+    RANK_TABLE, metadata,
+    Column('article_id', Integer, primary_key=True),
+    Column('trending', Float, nullable=False, default=0.0),
+    # Lettura dei primi N e paginazione a cursore su (punteggio, id)
+    Index('ix_article_rank_trending_id', 'trending', 'article_id'),
+)
+
+# Stato condiviso tra i processi: quando è stato applicato l'ultimo decadimento
+state_table = Table(
+    'ranking_state', metadata,
+    Column('name', String(50), primary_key=True),
+    Column('value', Float, nullable=False),
+)
+
+# Sotto questa soglia un punteggio diventa 0 e il decadimento smette di riscriverlo
+MIN_SCORE = 1e-4
+
+
+def utc_now():
+    """Le date salvate con db.func.now() (pub_date) sono in UTC, senza fuso."""
+    return datetime.now(UTC).replace(tzinfo=None)
+
+
+class Ranking:
+    """
+    Punteggi di tendenza e cache dei primi risultati delle classifiche.
+
+    half_life: secondi dopo i quali il peso di un'interazione si dimezza.
+    like_weight, comment_weight, view_weight: peso di un like, di un commento e di una visualizzazione.
+    top_k: elementi di ogni classifica tenuti in memoria (le pagine oltre vengono lette dal database).
+    cache_ttl: secondi di validità della cache.
+    """
+
+    def __init__(self, half_life=86400, like_weight=3.0, comment_weight=5.0, view_weight=0.1, top_k=100, cache_ttl=30):
+        self.half_life = half_life
+        self.like_weight = like_weight
+        self.comment_weight = comment_weight
+        self.view_weight = view_weight
+        self.top_k = top_k
+        self.cache_ttl = cache_ttl
+        self.refresh_interval = 300
+        self._engine = None
+        self._cache = {} # classifica -> (scadenza, [(punteggio, id)], completa)
+        self._lock = threading.Lock()
+
+    def init_app(self, app, engine):
+        self.half_life = app.config['RANKING_HALF_LIFE_HOURS'] * 3600
+        self.like_weight = app.config['RANKING_LIKE_WEIGHT']
+        self.comment_weight = app.config['RANKING_COMMENT_WEIGHT']
+        self.view_weight = app.config['RANKING_VIEW_WEIGHT']
+        self.top_k = app.config['RANKING_TOP_K']
+        self.cache_ttl = app.config['RANKING_CACHE_TTL']
+        self.refresh_interval = app.config['RANKING_REFRESH_INTERVAL']
+        self._engine = engine
+        self.clear_cache()
+        app.extensions['ranking'] = self
+
+    def create_tables(self):
+        metadata.create_all(self._engine)
+
+    def decay(self, age_seconds):
+        """Frazione del peso che resta a un'interazione di 'age_seconds' secondi fa."""
+        return 0.5 ** (max(age_seconds, 0) / self.half_life)
+
+    # --- Eventi (il commit è a carico del chiamante) ---
+    def add(self, session, article_id, amount):
+        """Somma 'amount' al punteggio dell'articolo (negativo per togliere), senza scendere sotto 0."""
+        self.add_many(session, {article_id: amount})
+
+    def add_many(self, session, amounts):
+        """Come add() per più articoli: {id_articolo: quantità}, con due istruzioni a blocchi."""
+        if not amounts:
+            return
+        session.execute(
+            database.insert_or_ignore(rank_table, self._engine.dialect.name),
+            [{'article_id': article_id, 'trending': 0.0} for article_id in amounts]
+        )
+        session.execute(
+            text(f"UPDATE {RANK_TABLE} SET trending = CASE WHEN trending + :amount < 0 THEN 0 "
+                 f"ELSE trending + :amount END WHERE article_id = :id"),
+            [{'id': article_id, 'amount': amount} for article_id, amount in amounts.items()]
+        )
+
+    def like_score(self, age_seconds=0):
+        """Peso attuale di un like di 'age_seconds' secondi fa (da sommare con add_many)."""
+        return self.like_weight * self.decay(age_seconds)
+
+    def comment_score(self, age_seconds=0):
+        return self.comment_weight * self.decay(age_seconds)
+
+    def record_like(self, session, article_id, liked, age_seconds=0):
+        """Like aggiunto (liked=True) o tolto; per un like tolto 'age_seconds' è l'età del like."""
+        amount = self.like_score(age_seconds)
+        self.add(session, article_id, amount if liked else -amount)
+
+    def record_comment(self, session, article_id, added, age_seconds=0):
+        """Commento aggiunto (added=True) o eliminato; per uno eliminato 'age_seconds' è l'età del commento."""
+        amount = self.comment_score(age_seconds)
+        self.add(session, article_id, amount if added else -amount)
+
+    def record_views(self, conn, batch):
+        """Per ViewCounter.on_write: visualizzazioni {id_articolo: incremento} appena scritte."""
+        self.add_many(conn, {article_id: self.view_weight * amount for article_id, amount in batch.items()})
+
+    def remove_articles(self, session, article_ids):
+        if article_ids:
+            session.execute(delete(rank_table).where(rank_table.c.article_id.in_(article_ids)))
+
+    # --- Aggiornamento periodico ---
+    def apply_decay(self, now=None):
+        """
+        Fa decadere tutti i punteggi per il tempo trascorso dall'ultima volta. Più processi possono
+        chiamarla insieme: l'istante dell'ultimo decadimento si aggiorna solo se nessuno l'ha cambiato
+        nel frattempo (confronto e scrittura nella stessa transazione). Restituisce le righe aggiornate.
+        """
+        now = time.time() if now is None else now
+        with self._engine.begin() as conn:
+            last = conn.execute(select(state_table.c.value).where(state_table.c.name == 'decayed_at')).scalar()
+            if last is None:
+                conn.execute(insert(state_table).values(name='decayed_at', value=now))
+                return 0
+            claimed = conn.execute(
+                update(state_table).where(state_table.c.name == 'decayed_at', state_table.c.value == last).values(value=now)
+            ).rowcount
+            if not claimed or now <= last:
+                return 0
+            return conn.execute(
+                text(f"UPDATE {RANK_TABLE} SET trending = CASE WHEN trending * :factor < :min_score THEN 0 "
+                     f"ELSE trending * :factor END WHERE trending > 0"),
+                {'factor': self.decay(now - last), 'min_score': MIN_SCORE}
+            ).rowcount
+
+    def rebuild(self, session, batch_size=1000):
+        """
+        Ricalcola tutti i punteggi da capo, a blocchi di articoli. Le visualizzazioni non hanno una
+        data: si considerano avvenute alla pubblicazione. Restituisce il numero di articoli in classifica.
+        I like hanno l'ora locale (datetime.now() in toggle_like), commenti e articoli l'ora UTC.
+        """
+        now_local, now_utc = datetime.now(), utc_now()
+        session.execute(delete(rank_table))
+        ranked = 0
+        last_id = 0
+        while True:
+            articles = session.execute(
+                text("SELECT id, views, pub_date FROM article WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                {'last_id': last_id, 'limit': batch_size}
+            ).all()
+            if not articles:
+                break
+            last_id = articles[-1].id
+            first_id = articles[0].id
+            scores = {
+                a.id: self.view_weight * (a.views or 0) * self.decay((now_utc - _as_datetime(a.pub_date)).total_seconds())
+                for a in articles
+            }
+            bounds = {'first': first_id, 'last': last_id}
+            for article_id, timestamp in session.execute(
+                    text('SELECT article_id, timestamp FROM "like" WHERE article_id BETWEEN :first AND :last'), bounds):
+                if article_id in scores:
+                    scores[article_id] += self.like_weight * self.decay((now_local - _as_datetime(timestamp)).total_seconds())
+            for article_id, pub_date in session.execute(
+                    text('SELECT article_id, pub_date FROM comment WHERE article_id BETWEEN :first AND :last'), bounds):
+                if article_id in scores:
+                    scores[article_id] += self.comment_weight * self.decay((now_utc - _as_datetime(pub_date)).total_seconds())
+            rows = [{'article_id': article_id, 'trending': score} for article_id, score in scores.items() if score >= MIN_SCORE]
+            if rows:
+                session.execute(insert(rank_table), rows)
+            ranked += len(rows)
+        session.execute(delete(state_table).where(state_table.c.name == 'decayed_at'))
+        session.execute(insert(state_table).values(name='decayed_at', value=time.time()))
+        session.commit()
+        self.clear_cache()
+        return ranked
+
+    # --- Lettura delle classifiche ---
+    def page(self, session, feed, score_column, id_column, per_page, after=None, where=()):
+        """
+        Una pagina della classifica 'feed' ordinata per (score_column, id_column) decrescenti.
+        Gli elementi sono coppie (punteggio, id); 'after' è il cursore della pagina precedente.
+        Le pagine che rientrano nei primi top_k vengono servite dalla cache senza query.
+        """
+        key = _decode_key(after)
+        entries, complete = self._top(session, feed, score_column, id_column, where)
+        # Le voci sono in ordine decrescente: si cerca la prima strettamente dopo il cursore
+        start = 0 if key is None else bisect.bisect_right([(-s, -i) for s, i in entries], (-key[0], -key[1]))
+        if complete or start + per_page < len(entries):
+            rows = entries[start:start + per_page + 1]
+        else:
+            query = select(score_column, id_column).where(*where)
+            if key is not None:
+                query = query.where(tuple_(score_column, id_column) < tuple_(*key))
+            rows = [tuple(row) for row in session.execute(
+                query.order_by(score_column.desc(), id_column.desc()).limit(per_page + 1)
+            ).all()]
+        items = rows[:per_page]
+        next_cursor = encode_cursor(repr(float(items[-1][0])), items[-1][1]) if len(rows) > per_page else None
+        return KeysetPagination(items, per_page, next_cursor=next_cursor)
+
+    def _top(self, session, feed, score_column, id_column, where):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(feed)
+            if cached and cached[0] > now:
+                return cached[1], cached[2]
+        rows = session.execute(
+            select(score_column, id_column).where(*where)
+            .order_by(score_column.desc(), id_column.desc()).limit(self.top_k + 1)
+        ).all()
+        entries = [(float(score), article_id) for score, article_id in rows[:self.top_k]]
+        complete = len(rows) <= self.top_k
+        with self._lock:
+            self._cache[feed] = (now + self.cache_ttl, entries, complete)
+        return entries, complete
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def _decode_key(cursor):
+    """(punteggio, id) dal cursore; None se manca o non è valido (si riparte dalla prima pagina)."""
+    decoded = decode_cursor(cursor)
+    if decoded is None:
+        return None
+    try:
+        return float(decoded[0]), decoded[1]
+    except ValueError:
+        return None
+
+
+def _as_datetime(value):
+    # Con text() SQLite restituisce le date come stringhe
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
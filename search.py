@@ -0,0 +1,180 @@
+# Ricerca full-text sugli articoli basata su SQLite FTS5
+#
+# Il modulo non importa nulla da app.py: riceve la sessione SQLAlchemy dai chiamanti,
+# così può essere usato sia dalle rotte sia dai comandi CLI.
+import logging
+import re
+import weakref
+
+from markupsafe import Markup, escape
+from sqlalchemy import column, table, text
+from sqlalchemy.exc import SQLAlchemyError
+
+# Nome della tabella virtuale che contiene l'indice
+SEARCH_TABLE = 'article_fts'
+
+# Marcatori usati da snippet()/highlight() prima dell'escape HTML
+_MARK_OPEN = '\x02'
+_MARK_CLOSE = '\x03'
+
+# Pesi BM25 per le colonne (titolo, contenuto): un match nel titolo conta di più
+_BM25_WEIGHTS = (10.0, 1.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Engine in cui l'indice esiste già: l'indice non viene mai eliminato, quindi basta trovarlo una volta.
+# Se manca si ricontrolla a ogni chiamata (può crearlo 'flask rebuild-search-index' da un altro processo).
+_available_engines = weakref.WeakSet()
+
+logger = logging.getLogger(__name__)
+
+
+def _plain_text(html):
+    """Rimuove i tag HTML dal contenuto, che viene salvato con il markup dell'editor."""
+    return Markup(html or '').striptags()
+
+
+def is_available(session):
+    """Controlla se il database in uso è SQLite e se l'indice FTS5 esiste."""
+    engine = session.get_bind()
+    if engine.dialect.name != 'sqlite':
+        return False
+    if engine in _available_engines:
+        return True
+    row = session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': SEARCH_TABLE}
+    ).first()
+    if row is None:
+        return False
+    _available_engines.add(engine)
+    return True
+
+
+def create_search_index(session):
+    """
+    Crea la tabella FTS5 se non esiste ancora.
+    Restituisce False se il database non è SQLite o se SQLite è compilato senza FTS5.
+    """
+    if session.get_bind().dialect.name != 'sqlite':
+        return False
+    if is_available(session):
+        return True
+    try:
+        # prefix='2 3' mantiene indici aggiuntivi per le ricerche per prefisso (es. "pyt*")
+        session.execute(text(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            "title, content, prefix='2 3', tokenize='unicode61 remove_diacritics 2')"
+        ))
+        session.execute(
+            text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) VALUES ('rank', :rank)"),
+            {'rank': 'bm25({}, {})'.format(*_BM25_WEIGHTS)}
+        )
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.warning("Indice di ricerca FTS5 non disponibile, uso la ricerca ILIKE. Errore: %s", e)
+        return False
+    return True
+
+
+def index_article(session, article):
+    """Inserisce o aggiorna un articolo nell'indice (il commit è a carico del chiamante)."""
+    if not is_available(session):
+        return
+    session.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id"), {'id': article.id})
+    session.execute(
+        text(f"INSERT INTO {SEARCH_TABLE}(rowid, title, content) VALUES (:id, :title, :content)"),
+        {'id': article.id, 'title': article.title, 'content': _plain_text(article.content)}
+    )
+
+
+def remove_article(session, article_id):
+    """Rimuove un articolo dall'indice (il commit è a carico del chiamante)."""
+    if not is_available(session):
+        return
+    session.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id"), {'id': article_id})
+
+
+def remove_articles(session, article_ids):
+    """Rimuove più articoli dall'indice con un'unica istruzione (il commit è a carico del chiamante)."""
+    if not article_ids or not is_available(session):
+        return
+    session.execute(text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id"), [{'id': article_id} for article_id in article_ids])
+
+
+def rebuild_search_index(session, batch_size=500):
+    """
+    Ricostruisce completamente l'indice leggendo la tabella 'article' a blocchi.
+    Restituisce il numero di articoli indicizzati.
+    """
+    if not create_search_index(session):
+        return 0
+    session.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    indexed = 0
+    last_id = 0
+    while True:
+        rows = session.execute(
+            text("SELECT id, title, content FROM article WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {'last_id': last_id, 'limit': batch_size}
+        ).all()
+        if not rows:
+            break
+        session.execute(
+            text(f"INSERT INTO {SEARCH_TABLE}(rowid, title, content) VALUES (:id, :title, :content)"),
+            [{'id': r.id, 'title': r.title, 'content': _plain_text(r.content)} for r in rows]
+        )
+        indexed += len(rows)
+        last_id = rows[-1].id
+    # Compatta i segmenti dell'indice dopo il caricamento massivo
+    session.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')"))
+    session.commit()
+    return indexed
+
+
+def build_match_query(user_query):
+    """
+    Converte il testo inserito dall'utente in un'espressione MATCH sicura.
+    Ogni parola viene quotata (niente operatori FTS5 iniettati) e l'ultima
+    diventa una ricerca per prefisso, così "flas" trova anche "flask".
+    """
+    tokens = _TOKEN_RE.findall(user_query or '')
+    if not tokens:
+        return None
+    terms = [f'"{t}"' for t in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def match_clause(match_query):
+    """
+    Restituisce (tabella, condizione) da usare in una query ORM:
+    la tabella si unisce ad Article su rowid e si ordina per 'rank' (BM25).
+    """
+    fts = table(SEARCH_TABLE, column('rowid'), column('rank'))
+    condition = text(f"{SEARCH_TABLE} MATCH :match_query").bindparams(match_query=match_query)
+    return fts, condition
+
+
+def snippets_for(session, match_query, article_ids, tokens=24):
+    """
+    Restituisce {article_id: (titolo_evidenziato, estratto_evidenziato)} per gli articoli
+    della pagina corrente. Il testo è già escapato e i termini trovati sono in <mark>.
+    """
+    if not article_ids or not is_available(session):
+        return {}
+    placeholders = ', '.join(f':id{i}' for i in range(len(article_ids)))
+    params = {f'id{i}': article_id for i, article_id in enumerate(article_ids)}
+    params.update(match_query=match_query, open=_MARK_OPEN, close=_MARK_CLOSE, tokens=tokens)
+    rows = session.execute(text(
+        f"SELECT rowid, highlight({SEARCH_TABLE}, 0, :open, :close) AS title, "
+        f"snippet({SEARCH_TABLE}, 1, :open, :close, '…', :tokens) AS excerpt "
+        f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match_query AND rowid IN ({placeholders})"
+    ), params).all()
+    return {r.rowid: (_highlight_markup(r.title), _highlight_markup(r.excerpt)) for r in rows}
+
+
+def _highlight_markup(value):
+    """Escapa il testo e sostituisce i marcatori con <mark>."""
+    escaped = str(escape(value or ''))
+    return Markup(escaped.replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>'))
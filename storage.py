@@ -0,0 +1,408 @@
+# Archivio dei file caricati: nomi dal contenuto, sottocartelle, deduplicazione e conteggio dei riferimenti
+#
+# Ogni file prende il nome dall'hash SHA-256 del contenuto e viene salvato in due livelli di
+# sottocartelle ('3f/a2/3fa2…c1.jpg'): nessuna cartella cresce oltre qualche centinaio di voci e
+# lo stesso file caricato più volte (es. lo stesso avatar) occupa spazio una volta sola.
+# Il caricamento viene copiato a blocchi su un file temporaneo calcolando intanto hash e dimensione:
+# oltre max_size la copia si interrompe senza leggere il resto.
+# La tabella 'upload_ref' conta quanti record (articoli, profili) usano ogni file. I riferimenti
+# cambiano nella stessa transazione dei record; un file senza più riferimenti viene eliminato
+# dopo il commit (collect, dal lavoro 'remove_upload'), quindi eliminare un articolo non tocca
+# un'immagine usata anche da altri.
+# I file stanno in una cartella locale (LocalBackend) o in un servizio compatibile S3 (S3Backend);
+# LocalS3Client imita il client S3 su una cartella, per provare S3Backend senza un servizio vero.
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+from sqlalchemy import (
+    Column,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    delete,
+    insert,
+    select,
+    text,
+)
+
+import database
+
+REF_TABLE = 'upload_ref'
+
+metadata = MetaData()
+
+ref_table = Table(
+    REF_TABLE, metadata,
+    Column('name', String(100), primary_key=True), # Percorso relativo, es. '3f/a2/3fa2…c1.jpg'
+    Column('refs', Integer, nullable=False), # Record che usano il file (0: da eliminare)
+    Column('created_at', Float, nullable=False),
+)
+
+# Livelli di sottocartelle (2 caratteri esadecimali ciascuno: 256 voci per cartella)
+SHARD_LEVELS = 2
+
+_CONTENT_NAME = re.compile(rf'^(?:[0-9a-f]{{2}}/){{{SHARD_LEVELS}}}[0-9a-f]{{64}}\.[a-z0-9]+$')
+
+
+class UploadTooLargeError(ValueError):
+    """Il file caricato supera la dimensione massima."""
+
+    def __init__(self, max_size):
+        super().__init__(f'Il file supera la dimensione massima consentita ({max_size / (1024 * 1024):g} MB).')
+        self.max_size = max_size
+
+
+def content_name(digest, extension):
+    """Percorso di un file dall'hash del contenuto, es. ('3fa2…c1', 'jpg') -> '3f/a2/3fa2…c1.jpg'."""
+    shards = [digest[2 * level:2 * level + 2] for level in range(SHARD_LEVELS)]
+    return '/'.join(shards + [f'{digest}.{extension}'])
+
+
+def is_content_name(name):
+    """False per i nomi dei file salvati prima dell'archivio (es. '<uuid>.jpg') e per le varianti."""
+    return bool(_CONTENT_NAME.match(name))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# --- Dove stanno i file ---
+class LocalBackend:
+    """File in una cartella locale (UPLOAD_FOLDER, servita come /static/uploads)."""
+
+    local = True
+
+    def __init__(self, root):
+        self.root = root
+        # I file temporanei stanno sullo stesso disco: put() li collega con un hard link, senza copiarli
+        self.staging_dir = os.path.join(root, '.staging')
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/'))
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def put(self, name, source_path):
+        """Salva una copia di 'source_path' con il nome indicato ('source_path' resta com'è)."""
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Nome temporaneo univoco: due salvataggi dello stesso contenuto possono avvenire insieme
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.link(source_path, tmp_path)
+        except OSError: # File system senza hard link
+            shutil.copyfile(source_path, tmp_path)
+        try:
+            os.replace(tmp_path, path)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+    def open(self, name):
+        return open(self.path(name), 'rb')
+
+    def delete(self, name):
+        _remove(self.path(name))
+
+    def names(self):
+        """Tutti i file salvati (anche le varianti), come percorsi relativi."""
+        for directory, subdirectories, filenames in os.walk(self.root):
+            subdirectories[:] = sorted(d for d in subdirectories if not d.startswith('.'))
+            relative = os.path.relpath(directory, self.root)
+            for filename in sorted(filenames):
+                if not filename.startswith('.') and not filename.endswith('.tmp'):
+                    yield filename if relative == '.' else f"{relative.replace(os.sep, '/')}/{filename}"
+
+    def url(self, name):
+        return None # Serviti da Flask come file statici
+
+
+def _error_code(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
+
+class S3Backend:
+    """
+    Oggetti in un bucket di un servizio compatibile S3 (AWS, MinIO, ...), con un client boto3
+    (o LocalS3Client). public_url: indirizzo da cui il bucket è raggiungibile dai browser.
+    Le varianti ridimensionate non vengono generate: le pagine usano l'originale.
+    """
+
+    local = False
+    staging_dir = None # Cartella temporanea di sistema
+
+    def __init__(self, client, bucket, prefix='', public_url=None, cache_control=None):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.cache_control = cache_control
+
+    def key(self, name):
+        return self.prefix + name
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(name))
+        except Exception as e:
+            if _error_code(e) in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def put(self, name, source_path):
+        extra = {'ContentType': mimetypes.guess_type(name)[0] or 'application/octet-stream'}
+        if self.cache_control:
+            extra['CacheControl'] = self.cache_control
+        self.client.upload_file(source_path, self.bucket, self.key(name), ExtraArgs=extra)
+
+    def open(self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body']
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def names(self):
+        token = None
+        while True:
+            params = {'Bucket': self.bucket, 'Prefix': self.prefix}
+            if token:
+                params['ContinuationToken'] = token
+            page = self.client.list_objects_v2(**params)
+            for item in page.get('Contents', []):
+                yield item['Key'][len(self.prefix):]
+            if not page.get('IsTruncated'):
+                return
+            token = page['NextContinuationToken']
+
+    def url(self, name):
+        return f'{self.public_url}/{self.key(name)}' if self.public_url else None
+
+
+def create_s3_client(endpoint_url=None, region=None):
+    """Importa boto3 solo quando serve (le credenziali vengono dalle solite variabili AWS_*)."""
+    import boto3
+    return boto3.client('s3', endpoint_url=endpoint_url or None, region_name=region or None)
+
+
+class LocalS3ClientError(Exception):
+    """Stessa forma di botocore.exceptions.ClientError (attributo response con il codice)."""
+
+    def __init__(self, code, operation):
+        super().__init__(f'{operation}: {code}')
+        self.response = {'Error': {'Code': code}}
+
+
+class LocalS3Client:
+    """
+    Client locale per test e sviluppo con i metodi del client boto3 usati da S3Backend:
+    ogni bucket è una sottocartella di 'root' e ogni oggetto un file con la chiave come percorso.
+    """
+
+    def __init__(self, root, page_size=1000):
+        self.root = root
+        self.page_size = page_size
+        self.calls = Counter()
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def head_object(self, Bucket, Key):
+        self.calls['head_object'] += 1
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise LocalS3ClientError('404', 'HeadObject')
+        return {'ContentLength': os.path.getsize(path)}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        self.calls['upload_file'] += 1
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    def get_object(self, Bucket, Key):
+        self.calls['get_object'] += 1
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise LocalS3ClientError('NoSuchKey', 'GetObject')
+        return {'Body': open(path, 'rb'), 'ContentLength': os.path.getsize(path)}
+
+    def delete_object(self, Bucket, Key):
+        self.calls['delete_object'] += 1
+        _remove(self._path(Bucket, Key)) # Come S3: eliminare un oggetto che non c'è non è un errore
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None):
+        self.calls['list_objects_v2'] += 1
+        bucket_root = os.path.join(self.root, Bucket)
+        keys = sorted(
+            os.path.relpath(os.path.join(directory, filename), bucket_root).replace(os.sep, '/')
+            for directory, _, filenames in os.walk(bucket_root) for filename in filenames
+            if not filename.endswith('.tmp')
+        )
+        keys = [key for key in keys if key.startswith(Prefix) and (ContinuationToken is None or key > ContinuationToken)]
+        page = keys[:self.page_size]
+        result = {'Contents': [{'Key': key} for key in page], 'IsTruncated': len(keys) > self.page_size}
+        if result['IsTruncated']:
+            result['NextContinuationToken'] = page[-1]
+        return result
+
+
+# --- Archivio ---
+class UploadStore:
+    """
+    Salva i file caricati per contenuto e ne conta i riferimenti.
+
+    backend: dove stanno i file (LocalBackend o S3Backend).
+    max_size: byte massimi di un file caricato.
+    chunk_size: byte letti e scritti alla volta durante la copia.
+    """
+
+    def __init__(self, backend=None, max_size=10 * 1024 * 1024, chunk_size=64 * 1024):
+        self.backend = backend
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self._engine = None
+
+    def init_app(self, app, engine, backend):
+        self.backend = backend
+        self.max_size = app.config['UPLOAD_MAX_SIZE']
+        self.chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+        self._engine = engine
+        app.extensions['upload_store'] = self
+
+    def create_table(self):
+        metadata.create_all(self._engine)
+
+    def spool(self, stream):
+        """
+        Copia lo stream a blocchi su un file temporaneo e restituisce (percorso, hash, byte).
+        Solleva UploadTooLargeError appena si supera max_size (il file temporaneo viene eliminato).
+        """
+        if self.backend.staging_dir:
+            os.makedirs(self.backend.staging_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.upload', dir=self.backend.staging_dir)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise UploadTooLargeError(self.max_size)
+                    digest.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            _remove(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest(), size
+
+    def save(self, session, stream, extension):
+        """
+        Salva il contenuto dello stream e restituisce (nome, nuovo): 'nuovo' è False se lo stesso
+        contenuto era già archiviato. Con una sessione aggiunge anche un riferimento al file
+        (il commit è a carico del chiamante).
+        """
+        tmp_path, digest, _ = self.spool(stream)
+        try:
+            name = content_name(digest, extension)
+            # Prima il file, poi il riferimento: il caricamento (lento su S3) avviene fuori dalla
+            # transazione, che non tiene il lock in scrittura per tutta la sua durata
+            new = not self.backend.exists(name)
+            if new:
+                self.backend.put(name, tmp_path)
+            if session is not None:
+                self.acquire(session, name)
+                # collect() può aver eliminato lo stesso contenuto (riga a 0 riferimenti) prima di
+                # acquire: da qui il riferimento lo blocca, quindi basta ricontrollare una volta
+                # (put() non consuma il file temporaneo, che viene eliminato solo alla fine)
+                if not self.backend.exists(name):
+                    self.backend.put(name, tmp_path)
+            return name, new
+        finally:
+            _remove(tmp_path)
+
+    # --- Riferimenti (il commit è a carico del chiamante) ---
+    def acquire(self, session, name, count=1):
+        session.execute(
+            database.insert_or_ignore(ref_table, self._engine.dialect.name),
+            {'name': name, 'refs': 0, 'created_at': time.time()}
+        )
+        session.execute(
+            text(f"UPDATE {REF_TABLE} SET refs = refs + :count WHERE name = :name"), {'name': name, 'count': count}
+        )
+
+    def release(self, session, *names):
+        """Toglie un riferimento per ogni nome (ripetuto se usato da più record); dopo il commit: collect()."""
+        counts = Counter(name for name in names if name)
+        if counts:
+            session.execute(
+                text(f"UPDATE {REF_TABLE} SET refs = CASE WHEN refs - :count < 0 THEN 0 "
+                     f"ELSE refs - :count END WHERE name = :name"),
+                [{'name': name, 'count': count} for name, count in counts.items()]
+            )
+
+    def refs(self, name):
+        with self._engine.connect() as conn:
+            return conn.execute(select(ref_table.c.refs).where(ref_table.c.name == name)).scalar()
+
+    # --- Eliminazione ---
+    def collect(self, names, derived=None, untracked=False):
+        """
+        Elimina i file che nessuno usa più: riga con 0 riferimenti, oppure nessuna riga per i file
+        salvati prima dell'archivio (o per tutti con untracked=True, es. file rimasti da un commit fallito).
+        derived(nome) restituisce i file da eliminare insieme (le varianti). Restituisce i file eliminati.
+        """
+        removed = 0
+        for name in dict.fromkeys(names):
+            with self._engine.begin() as conn:
+                # Il DELETE prende subito il lock in scrittura: un caricamento dello stesso contenuto
+                # ancora in corso (riferimento non confermato) attende oppure fa attendere questo
+                deleted = conn.execute(delete(ref_table).where(ref_table.c.name == name, ref_table.c.refs <= 0)).rowcount
+                if not deleted:
+                    if conn.execute(select(ref_table.c.refs).where(ref_table.c.name == name)).scalar() is not None:
+                        continue # Ancora usato
+                    if is_content_name(name) and not untracked:
+                        continue # Mai registrato (es. dati importati): si lascia a 'flask rebuild-upload-refs'
+                # I file si eliminano prima del commit, mentre il lock impedisce nuovi riferimenti
+                for related in [name, *(derived(name) if derived else ())]:
+                    self.backend.delete(related)
+                removed += 1
+        return removed
+
+    def rebuild(self, counts):
+        """
+        Riscrive la tabella dei riferimenti da {nome: record che lo usano}.
+        Restituisce i nomi referenziati ma assenti dall'archivio.
+        """
+        now = time.time()
+        with self._engine.begin() as conn:
+            conn.execute(delete(ref_table))
+            rows = [{'name': name, 'refs': count, 'created_at': now} for name, count in counts.items() if count > 0]
+            if rows:
+                conn.execute(insert(ref_table), rows)
+        return [name for name in counts if not self.backend.exists(name)]
+
+    def unreferenced(self):
+        """File dell'archivio senza riferimenti (varianti escluse), da passare a collect(untracked=True)."""
+        with self._engine.connect() as conn:
+            used = set(conn.execute(select(ref_table.c.name).where(ref_table.c.refs > 0)).scalars())
+        return [name for name in self.backend.names() if is_content_name(name) and name not in used]
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Crea app indipendenti con database e file in tmp_path; 'config' sovrascrive i valori di prova."""
+    import app as site
+
+    def make(name='app', **config):
+        directory = tmp_path / name
+        directory.mkdir()
+        app = site.create_app({
+            'TESTING': True,
+            'SECRET_KEY': 'test',
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{directory / 'site.db'}",
+            'UPLOAD_FOLDER': str(directory / 'uploads'),
+            'PAGE_CACHE_PATH': str(directory / 'page_cache.db'),
+            'STORAGE_FAKE_S3_PATH': str(directory / 'fake-s3'),
+            'JOBS_MODE': 'inline',
+            'CHATBOT_BACKEND': 'fake',
+            **config,
+        })
+        with app.app_context():
+            site.init_db()
+        return app
+
+    return make
@@ -0,0 +1,33 @@
+import app as site
+from page_cache import MemoryCache, SQLiteCache
+
+
+def test_apps_do_not_share_services(make_app):
+    first = make_app('first', VIEW_COUNTER_MAX_PENDING=100, VIEW_COUNTER_FLUSH_INTERVAL=60,
+                     JOBS_MODE='worker', PAGE_CACHE_BACKEND='memory')
+    second = make_app('second', VIEW_COUNTER_MAX_PENDING=200, VIEW_COUNTER_FLUSH_INTERVAL=60,
+                      JOBS_MODE='worker', PAGE_CACHE_BACKEND='sqlite')
+
+    for name in ('view_counter', 'job_queue', 'page_cache', 'metrics', 'ranking', 'upload_store', 'write_batcher'):
+        assert first.extensions[name] is not second.extensions[name], name
+
+    # I nomi del modulo (site.view_counter, site.job_queue, ...) seguono l'app corrente
+    with first.app_context():
+        assert site.view_counter.max_pending == 100
+        site.view_counter.increment(1)
+        site.view_counter.increment(1)
+        jobs_before = site.job_queue.stats().get('pending', 0)
+        site.job_queue.enqueue('index_article', article_id=1)
+        assert site.job_queue.stats()['pending'] == jobs_before + 1
+        assert isinstance(site.page_cache.backend, MemoryCache)
+        site.page_cache.backend.set('pagina', 'prima app', 60)
+    with second.app_context():
+        assert site.view_counter.max_pending == 200
+        assert site.view_counter.pending(1) == 0
+        assert site.job_queue.stats().get('pending', 0) == jobs_before
+        assert site.job_queue._engine.url != first.extensions['job_queue']._engine.url
+        assert isinstance(site.page_cache.backend, SQLiteCache)
+        assert site.page_cache.backend.get('pagina') is None
+    with first.app_context():
+        assert site.view_counter.pending(1) == 2
+        assert site.page_cache.backend.get('pagina') == 'prima app'
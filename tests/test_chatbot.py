@@ -0,0 +1,115 @@
+import json
+import threading
+
+import pytest
+
+from app import create_chat_assistant
+from chat_service import FakeChatModel
+
+
+class FailingChatModel(FakeChatModel):
+    def stream(self, prompt, history=None, timeout=None):
+        yield 'ciao '
+        raise RuntimeError('boom')
+
+
+class SlowChatModel(FakeChatModel):
+    """Risponde con molte parole lente e registra quante ne ha prodotte."""
+
+    def __init__(self, words=100, delay=0.05):
+        super().__init__(reply=' '.join(['parola'] * words), delay=delay)
+        self.produced = 0
+
+    def stream(self, prompt, history=None, timeout=None):
+        for chunk in super().stream(prompt, history=history, timeout=timeout):
+            self.produced += 1
+            yield chunk
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines())
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def use_model(app, model):
+    """Sostituisce il modello del chatbot e restituisce il servizio, con gli esiti registrati in 'outcomes'."""
+    with app.app_context():
+        assistant = create_chat_assistant(model, app.config)
+    app.extensions['chat_assistant'] = assistant
+    service = assistant.service
+    service.outcomes = []
+    finished = threading.Event()
+
+    def observer(seconds, outcome):
+        service.outcomes.append(outcome)
+        finished.set()
+
+    service.observer = observer
+    service.finished = finished
+    return service
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(CHATBOT_TIMEOUT=1.0, CHATBOT_MAX_CONCURRENT=1, CHATBOT_QUEUE_TIMEOUT=0.1)
+
+
+def test_stream_sends_message_events(app):
+    use_model(app, FakeChatModel(reply='Ciao a tutti'))
+    response = app.test_client().post('/chatbot/stream', data={'message': 'ciao'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = parse_events(response.get_data(as_text=True))
+    assert events == [
+        ('message', {'text': 'Ciao '}), ('message', {'text': 'a '}), ('message', {'text': 'tutti '}), ('done', {}),
+    ]
+
+
+def test_stream_reports_model_errors(app):
+    service = use_model(app, FailingChatModel())
+    response = app.test_client().post('/chatbot/stream', data={'message': 'ciao'})
+    events = parse_events(response.get_data(as_text=True))
+    assert events[0] == ('message', {'text': 'ciao '})
+    assert events[-1][0] == 'error'
+    assert 'boom' not in events[-1][1]['error'] # Il dettaglio dell'eccezione resta nel log
+    assert service.finished.wait(1) and service.outcomes == ['error']
+
+
+def test_stream_times_out(app):
+    app.config['CHATBOT_TIMEOUT'] = 0.2
+    service = use_model(app, SlowChatModel(words=10, delay=0.1))
+    response = app.test_client().post('/chatbot/stream', data={'message': 'ciao'})
+    events = parse_events(response.get_data(as_text=True))
+    assert events[-1] == ('error', {'error': 'Il chatbot non ha risposto in tempo.'})
+    assert all(event == 'message' for event, _ in events[:-1])
+    # Il thread del modello si ferma al pezzo successivo e libera lo slot
+    assert service.finished.wait(1) and service.outcomes == ['cancelled']
+    assert service._slots.acquire(blocking=False)
+
+
+def test_client_disconnect_cancels_the_model_call(app):
+    model = SlowChatModel()
+    service = use_model(app, model)
+    response = app.test_client().post('/chatbot/stream', data={'message': 'ciao'}, buffered=False)
+    chunks = iter(response.response)
+    assert next(chunks).startswith(b'event: message')
+    response.close() # Come il server quando il client si disconnette
+    assert service.finished.wait(1) and service.outcomes == ['cancelled']
+    assert model.produced < 10
+    assert service._slots.acquire(blocking=False)
+
+
+def test_busy_chatbot_returns_503(app):
+    service = use_model(app, SlowChatModel())
+    client = app.test_client()
+    first = client.post('/chatbot/stream', data={'message': 'ciao'}, buffered=False)
+    try:
+        response = client.post('/chatbot/stream', data={'message': 'ciao'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '5'
+    finally:
+        first.close()
+    assert service.finished.wait(1)
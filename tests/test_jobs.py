@@ -0,0 +1,40 @@
+import time
+
+from flask import Flask
+from sqlalchemy import create_engine, insert, select
+
+from jobs import PENDING, RUNNING, JobQueue, job_table
+
+
+def make_queue(tmp_path, workers=3):
+    app = Flask(__name__)
+    app.config.update(
+        JOBS_MODE='thread', JOBS_WORKERS=workers, JOBS_POLL_INTERVAL=0.05, JOBS_RETRY_DELAY=0,
+        JOBS_STALE_TIMEOUT=60, JOBS_KEEP_DONE=False,
+    )
+    queue = JobQueue()
+    queue.init_app(app, create_engine(f"sqlite:///{tmp_path / 'jobs.db'}"))
+    queue.create_table()
+    return queue
+
+
+def test_ensure_started_recovers_stale_jobs_once(tmp_path, monkeypatch):
+    queue = make_queue(tmp_path)
+    calls = []
+    recover_stale = queue.recover_stale
+    monkeypatch.setattr(queue, 'recover_stale', lambda: calls.append(1) or recover_stale())
+    with queue._engine.begin() as conn:
+        conn.execute(insert(job_table).values(
+            name='missing', payload='{}', status=RUNNING, attempts=1, max_attempts=5,
+            run_at=time.time() + 3600, locked_at=time.time() - 3600, locked_by='old-worker', created_at=time.time(),
+        ))
+    try:
+        queue.ensure_started()
+        queue.ensure_started()
+        assert len(queue._threads) == 3
+        assert calls == [1]
+    finally:
+        queue.stop()
+    with queue._engine.connect() as conn:
+        status, locked_by = conn.execute(select(job_table.c.status, job_table.c.locked_by)).one()
+    assert (status, locked_by) == (PENDING, None)
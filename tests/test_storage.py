@@ -0,0 +1,82 @@
+import io
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from storage import LocalBackend, LocalS3Client, S3Backend, UploadStore
+
+
+@pytest.fixture(params=['local', 's3'])
+def store(request, tmp_path):
+    if request.param == 'local':
+        backend = LocalBackend(str(tmp_path / 'uploads'))
+    else:
+        backend = S3Backend(LocalS3Client(str(tmp_path / 's3')), 'bucket', prefix='uploads/')
+    store = UploadStore(backend)
+    store._engine = create_engine(f"sqlite:///{tmp_path / 'refs.db'}")
+    store.create_table()
+    return store
+
+
+def save(store, content):
+    with Session(store._engine) as session:
+        name, new = store.save(session, io.BytesIO(content), 'png')
+        session.commit()
+    return name, new
+
+
+def release(store, *names):
+    with Session(store._engine) as session:
+        store.release(session, *names)
+        session.commit()
+
+
+def test_same_content_is_stored_once(store):
+    name, new = save(store, b'immagine')
+    again, new_again = save(store, b'immagine')
+    assert (again, new, new_again) == (name, True, False)
+    assert store.refs(name) == 2
+    assert list(store.backend.names()) == [name]
+
+
+def test_collect_removes_only_unreferenced_files(store):
+    name, _ = save(store, b'immagine')
+    save(store, b'immagine')
+    release(store, name)
+    assert store.collect([name]) == 0
+    assert store.backend.exists(name)
+    release(store, name)
+    assert store.collect([name]) == 1
+    assert not store.backend.exists(name)
+
+
+def test_save_restores_file_collected_before_acquire(store):
+    name, _ = save(store, b'immagine')
+    release(store, name)
+    store.backend.delete(name) # Riga ancora a 0 riferimenti, file già eliminato
+    put = store.backend.put
+
+    def put_then_collect(content_name, source_path):
+        put(content_name, source_path)
+        # collect() di un'altra richiesta tra il caricamento e il riferimento (solo la prima volta)
+        store.backend.put = put
+        assert store.collect([content_name]) == 1
+
+    store.backend.put = put_then_collect
+    again, new = save(store, b'immagine')
+    assert (again, new) == (name, True)
+    assert store.refs(name) == 1
+    with store.backend.open(name) as f:
+        assert f.read() == b'immagine'
+
+
+def test_s3_backend_lists_all_pages(tmp_path):
+    client = LocalS3Client(str(tmp_path / 's3'), page_size=2)
+    store = UploadStore(S3Backend(client, 'bucket', prefix='uploads/', public_url='https://cdn.example.com/'))
+    store._engine = create_engine('sqlite://')
+    store.create_table()
+    names = sorted(save(store, bytes([i]))[0] for i in range(5))
+    assert sorted(store.backend.names()) == names
+    assert client.calls['list_objects_v2'] == 3
+    assert store.backend.url(names[0]) == f'https://cdn.example.com/uploads/{names[0]}'
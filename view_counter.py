@@ -0,0 +1,147 @@
+# Contatore delle visualizzazioni con buffer in memoria
+#
+# article_detail() non scrive più sul database a ogni lettura: gli incrementi
+# vengono accumulati qui e scritti con un unico UPDATE a blocchi da un thread
+# in background (a intervalli regolari, oppure subito quando si supera una soglia).
+# Se la scrittura fallisce, il blocco viene passato a 'fallback' (la coda dei lavori
+# lo salva nel database e lo riprova), altrimenti resta in memoria per il flush successivo.
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+    """
+    Aggrega gli incrementi di Article.views in memoria.
+
+    flush_interval: secondi tra due scritture automatiche.
+    max_pending: numero di visualizzazioni non ancora scritte oltre il quale il thread
+                 viene svegliato per scriverle subito (la richiesta non attende).
+                 Indica all'incirca quante visualizzazioni si possono perdere in caso di crash.
+    """
+
+    def __init__(self, flush_interval=5.0, max_pending=500):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = Counter()
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # Evita due flush concorrenti
+        self._stop = threading.Event()
+        self._wakeup = threading.Event() # Soglia raggiunta: il thread scrive senza aspettare l'intervallo
+        self._thread = None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+        self._engine = None
+        self.fallback = None # fallback(batch): salva altrove un blocco che non è stato possibile scrivere
+        self.on_write = None # on_write(conn, batch): chiamata nella stessa transazione della scrittura
+
+    def init_app(self, app, engine):
+        """Legge la configurazione dell'app e imposta il database su cui scrivere."""
+        self.flush_interval = app.config['VIEW_COUNTER_FLUSH_INTERVAL']
+        self.max_pending = app.config['VIEW_COUNTER_MAX_PENDING']
+        self._engine = engine
+        app.extensions['view_counter'] = self
+
+    def _ensure_started(self):
+        """
+        Avvia il thread di scrittura alla prima visualizzazione, non all'import: così funziona
+        anche con 'gunicorn --preload', dove i thread del processo master non passano ai worker.
+        """
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            if self._thread_pid is None:
+                atexit.register(self.stop)
+            self._stop.clear()
+            self._wakeup.clear()
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='view-counter-flush', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Ferma il thread e scrive le visualizzazioni rimaste in memoria."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval + 1)
+        self._thread = None
+        self.flush()
+
+    def increment(self, article_id, amount=1):
+        """Registra una visualizzazione senza toccare il database: raggiunta la soglia sveglia il thread."""
+        self._ensure_started()
+        with self._lock:
+            self._pending[article_id] += amount
+            self._pending_total += amount
+            threshold_reached = self._pending_total >= self.max_pending
+        if threshold_reached:
+            self._wakeup.set()
+
+    def pending(self, article_id):
+        """Visualizzazioni di un articolo non ancora scritte sul database."""
+        with self._lock:
+            return self._pending.get(article_id, 0)
+
+    def discard(self, article_id):
+        """Scarta gli incrementi di un articolo eliminato."""
+        with self._lock:
+            self._pending_total -= self._pending.pop(article_id, 0)
+
+    def flush(self):
+        """
+        Scrive tutti gli incrementi in un'unica transazione.
+        Restituisce il numero di visualizzazioni scritte.
+        """
+        if self._engine is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, Counter()
+                self._pending_total = 0
+            try:
+                self.write(batch)
+            except Exception:
+                logger.exception("Errore durante la scrittura delle visualizzazioni")
+                if self.fallback is not None:
+                    try:
+                        self.fallback(batch)
+                        return 0
+                    except Exception:
+                        logger.exception("Errore durante il salvataggio delle visualizzazioni")
+                # Rimette gli incrementi nel buffer: verranno riprovati al prossimo flush
+                with self._lock:
+                    self._pending.update(batch)
+                    self._pending_total += sum(batch.values())
+                return 0
+            return sum(batch.values())
+
+    def write(self, batch):
+        """Scrive un blocco {id_articolo: incremento} con un unico UPDATE a blocchi."""
+        with self._engine.begin() as conn:
+            conn.execute(
+                text("UPDATE article SET views = COALESCE(views, 0) + :amount WHERE id = :id"),
+                [{'id': article_id, 'amount': amount} for article_id, amount in batch.items()]
+            )
+            if self.on_write is not None:
+                self.on_write(conn, batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                return # Il resto lo scrive stop()
+            if not self.flush() and self._pending_total:
+                # Scrittura fallita: si riprova all'intervallo successivo, anche se la soglia resta superata
+                self._stop.wait(self.flush_interval)
@@ -0,0 +1,114 @@
+# Raggruppamento delle scritture di like e commenti in poche transazioni ("group commit")
+#
+# Con molte richieste che mettono like o commentano insieme, ognuna apre la sua piccola transazione:
+# su SQLite le scritture si mettono in fila una dietro l'altra e ogni commit costa una scrittura
+# sincronizzata su disco. In modalità raggruppata (WRITE_COALESCING) le viste consegnano la scrittura
+# a un thread del processo, che ne raccoglie fino a 'max_batch' (aspettando al più 'max_delay'
+# secondi dopo la prima) e le esegue in un'unica transazione. Ogni richiesta attende il proprio
+# risultato: risponde solo a scrittura avvenuta, come senza raggruppamento.
+# Se la transazione di un gruppo fallisce, le sue scritture vengono ripetute una per una:
+# l'errore arriva soltanto alla richiesta che lo ha causato.
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+_STOP = object()
+
+
+class WriteBatcher:
+    """
+    Esegue le scritture di più richieste in transazioni comuni.
+
+    max_batch: scritture al massimo in una transazione.
+    max_delay: secondi di attesa di altre scritture dopo la prima (0: solo quelle già in coda).
+    apply:     apply(operazioni) esegue le operazioni in un'unica transazione e restituisce i
+               risultati nello stesso ordine; viene chiamata in un app context (impostata da create_app).
+    """
+
+    def __init__(self, max_batch=100, max_delay=0.002):
+        self.enabled = False
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.apply = None
+        self.batches = 0 # Transazioni eseguite (per i benchmark)
+        self.writes = 0 # Scritture eseguite
+        self._app = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config['WRITE_COALESCING']
+        self.max_batch = app.config['WRITE_COALESCING_MAX_BATCH']
+        self.max_delay = app.config['WRITE_COALESCING_MAX_DELAY']
+        self._app = app
+        app.extensions['write_batcher'] = self
+
+    def submit(self, operation):
+        """Consegna un'operazione al thread di scrittura e ne restituisce il risultato (o ne solleva l'errore)."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((operation, future))
+        return future.result()
+
+    def _ensure_started(self):
+        """Avvia il thread di scrittura nel processo corrente alla prima scrittura (come ViewCounter)."""
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            if self._thread_pid is None:
+                atexit.register(self.stop)
+            if self._thread_pid is not None:
+                self._queue = queue.Queue() # Processo figlio: la coda ereditata non ha più un lettore
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='write-batcher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """Esegue le scritture già in coda e ferma il thread."""
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._queue.put(_STOP)
+            self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            with self._app.app_context():
+                results = self.apply([operation for operation, _ in batch])
+        except Exception as e: # noqa: BLE001 - l'errore viene consegnato a chi attende la scrittura
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Si ripetono una per una, ciascuna nella propria transazione (e nel proprio app context)
+            for operation, future in batch:
+                self._write([(operation, future)])
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)